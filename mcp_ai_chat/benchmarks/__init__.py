@@ -0,0 +1,14 @@
+"""
+MCP AI Chat Group - 规模基准测试
+
+在合成数据集（10k / 100k / 1M 条消息）上通过 handle_tool_call 逐个运行全部工具，
+报告每个工具的 p50/p99 延迟、峰值RSS和每次调用写入的字节数，并与保存的基线比较。
+
+用法：
+    python -m mcp_ai_chat.benchmarks --scale 10k                    # 运行并打印结果
+    python -m mcp_ai_chat.benchmarks --scale 10k --save-baseline    # 保存为基线
+    python -m mcp_ai_chat.benchmarks --scale 10k --compare          # 与基线比较，退化时返回非零
+
+- dataset：生成合成数据（代理、群组、大群、任务、中英文混合消息）
+- scenarios：每个工具的调用参数
+"""
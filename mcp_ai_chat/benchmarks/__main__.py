@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+MCP AI Chat Group - 规模基准测试命令
+
+每个工具在独立的子进程（fork）中运行，峰值RSS互不影响；写入字节数取自
+/proc/self/io 的 wchar（不可用时不报告）。基线保存在 baselines/<后端>-<规模>.json。
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from .. import config
+from ..core import search_index, session, sqlite_store
+from .dataset import SCALES, generate_dataset, use_data_dir
+from .scenarios import SCENARIOS
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+# 比较基线时低于该值的延迟差异视为噪声（毫秒）
+_LATENCY_NOISE_MS = 1.0
+# 比较基线时低于该值的写入量差异视为噪声（字节）
+_WRITE_NOISE_BYTES = 1024
+
+
+def _written_bytes() -> Optional[int]:
+    """本进程累计写入的字节数（Linux）"""
+    try:
+        with open("/proc/self/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """本进程的峰值RSS（MB）"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    """最近秩百分位数"""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_tool(tool: str, context: dict, calls: int, warmup: int) -> dict:
+    """
+    在当前进程中运行一个工具的全部调用
+
+    Returns:
+        {"calls", "errors", "p50_ms", "p99_ms", "mean_ms", "write_bytes_per_call", "peak_rss_mb"}
+    """
+    from ..handlers import handle_tool_call
+
+    loop = asyncio.new_event_loop()
+    latencies = []
+    written = 0
+    errors = 0
+    try:
+        for i in range(warmup + calls):
+            agent, arguments = SCENARIOS[tool](context, i)
+            session.set_current_agent(agent)
+            session.set_current_session_id(f"{agent}_bench")
+
+            written_before = _written_bytes()
+            started = time.perf_counter()
+            result = loop.run_until_complete(handle_tool_call(tool, arguments))
+            elapsed = time.perf_counter() - started
+            written_after = _written_bytes()
+
+            if i < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            if written_before is not None and written_after is not None:
+                written += written_after - written_before
+            if result and result[0].text.startswith(("错误", "❌")):
+                errors += 1
+    finally:
+        loop.close()
+
+    latencies.sort()
+    return {
+        "calls": calls,
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "write_bytes_per_call": (
+            round(written / calls) if _written_bytes() is not None else None
+        ),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _run_in_child(conn, tool: str, context: dict, calls: int, warmup: int) -> None:
+    try:
+        conn.send(run_tool(tool, context, calls, warmup))
+    except BaseException as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_tool_isolated(tool: str, context: dict, calls: int, warmup: int) -> dict:
+    """在 fork 出的子进程中运行工具（不支持 fork 时在当前进程运行）"""
+    if not hasattr(os, "fork"):
+        return run_tool(tool, context, calls, warmup)
+    sqlite_store.close_connections()  # SQLite 连接不能跨 fork 使用
+    search_index.close_connections()
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_in_child, args=(sender, tool, context, calls, warmup))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "子进程异常退出"}
+    process.join()
+    return result
+
+
+def baseline_file(backend: str, scale: str) -> Path:
+    return BASELINE_DIR / f"{backend}-{scale}.json"
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    找出比基线退化的指标
+
+    Returns:
+        [(工具, 指标, 基线值, 当前值), ...]
+    """
+    regressions = []
+    for tool, current in results.items():
+        base = baseline.get(tool)
+        if not base or "error" in current or "error" in base:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if (
+                current[metric] > base[metric] * (1 + tolerance)
+                and current[metric] - base[metric] > _LATENCY_NOISE_MS
+            ):
+                regressions.append((tool, metric, base[metric], current[metric]))
+        written, base_written = current.get("write_bytes_per_call"), base.get("write_bytes_per_call")
+        if (
+            written is not None
+            and base_written is not None
+            and written > base_written * (1 + tolerance) + _WRITE_NOISE_BYTES
+        ):
+            regressions.append((tool, "write_bytes_per_call", base_written, written))
+        if current["errors"] > base.get("errors", 0):
+            regressions.append((tool, "errors", base.get("errors", 0), current["errors"]))
+    return regressions
+
+
+def tools_without_baseline(results: dict, baseline: dict) -> list:
+    """基线中没有记录的工具（新增的工具，需要重新保存基线后才有退化检查）"""
+    return [tool for tool in results if tool not in baseline]
+
+
+def _format_value(value, digits: int = 2) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def print_results(results: dict) -> None:
+    print(f"{'工具':<26}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>10}{'写入B/次':>12}{'错误':>6}")
+    for tool, r in results.items():
+        if "error" in r:
+            print(f"{tool:<26}  ❌ {r['error']}")
+            continue
+        print(
+            f"{tool:<26}{_format_value(r['p50_ms']):>10}{_format_value(r['p99_ms']):>10}"
+            f"{_format_value(r['peak_rss_mb'], 1):>10}"
+            f"{_format_value(r['write_bytes_per_call']):>12}{r['errors']:>6}"
+        )
+
+
+def main(argv=None) -> int:
+    """主入口"""
+    parser = argparse.ArgumentParser(
+        prog="python -m mcp_ai_chat.benchmarks", description="MCP AI Chat 规模基准测试"
+    )
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=config.STORAGE_BACKEND)
+    parser.add_argument("--calls", type=int, default=30, help="每个工具计时的调用次数")
+    parser.add_argument("--warmup", type=int, default=2, help="每个工具不计时的预热调用次数")
+    parser.add_argument("--tools", help="只运行这些工具（逗号分隔），默认全部")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", type=Path, help="数据目录（默认临时目录，运行后删除）")
+    parser.add_argument("--save-baseline", action="store_true", help="把结果保存为基线")
+    parser.add_argument("--compare", action="store_true", help="与基线比较，退化时返回1")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许的相对退化，默认0.5")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args(argv)
+
+    tools = args.tools.split(",") if args.tools else list(SCENARIOS)
+    unknown = [t for t in tools if t not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知工具: {', '.join(unknown)}")
+
+    config.STORAGE_BACKEND = args.backend
+    with tempfile.TemporaryDirectory(prefix="mcp_ai_chat_bench_") as tmp:
+        use_data_dir(args.data_dir or Path(tmp))
+
+        started = time.perf_counter()
+        context = generate_dataset(args.scale, args.seed)
+        print(
+            f"📦 数据集 {args.scale}（{args.backend}）生成用时 {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+
+        results = {}
+        for tool in tools:
+            results[tool] = run_tool_isolated(tool, context, args.calls, args.warmup)
+        sqlite_store.close_connections()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_results(results)
+
+    path = baseline_file(args.backend, args.scale)
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps(
+                {
+                    "created_at": datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "calls": args.calls,
+                    "results": results,
+                },
+                ensure_ascii=False,
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        print(f"\n✅ 基线已保存: {path}")
+
+    if args.compare:
+        if not path.exists():
+            print(f"\n❌ 没有基线: {path}")
+            return 1
+        baseline = json.loads(path.read_text(encoding="utf-8"))["results"]
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        missing = tools_without_baseline(results, baseline)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 项退化:")
+            for tool, metric, before, after in regressions:
+                print(f"   {tool}.{metric}: {before} → {after}")
+        if missing:
+            print(f"\n❌ {len(missing)} 个工具没有基线，请用 --save-baseline 重新保存: {', '.join(missing)}")
+        if regressions or missing:
+            return 1
+        print("\n✅ 与基线相比没有退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
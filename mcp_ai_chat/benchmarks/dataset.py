@@ -0,0 +1,219 @@
+"""
+MCP AI Chat Group - 基准测试数据集
+
+生成接近真实使用的合成数据并直接写入存储：
+- 大量代理，每个代理有会话和已读水位
+- 普通群组（3~30人）和一个全员大群
+- 私聊、广播和群组消息混合，中英文混合内容，带@提醒、重要程度和回复
+- 不同状态、优先级的任务
+
+消息以流的方式写入（JSON 后端直接写日志再重建索引，SQLite 后端在一个事务内导入），
+1M 条消息也不需要一次性放进内存。
+"""
+
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+from .. import config
+from ..core import message_log, sqlite_store, storage
+
+# 规模名 → 数据量
+SCALES = {
+    "10k": {"messages": 10_000, "agents": 50, "groups": 20, "tasks": 500},
+    "100k": {"messages": 100_000, "agents": 200, "groups": 100, "tasks": 5_000},
+    "1m": {"messages": 1_000_000, "agents": 500, "groups": 300, "tasks": 20_000},
+}
+
+# 每个代理/群组在上下文中保留的最近消息ID数量（供场景取用）
+_RECENT_IDS = 50
+
+_ZH_WORDS = [
+    "接口", "重构", "数据库", "性能", "测试", "部署", "需求", "评审", "缓存", "索引",
+    "并发", "日志", "前端", "后端", "任务", "进度", "问题", "修复", "方案", "讨论",
+]
+_EN_WORDS = [
+    "api", "refactor", "latency", "benchmark", "deploy", "review", "cache", "index",
+    "thread", "merge", "schema", "query", "timeout", "retry", "release", "bugfix",
+]
+_TOPICS = ["架构", "性能优化", "release", "code review", "需求讨论", None]
+_TASK_STATUSES = ["待开始", "进行中", "已完成", "已取消"]
+_PRIORITIES = ["P0", "P1", "P2", "P3"]
+
+
+def use_data_dir(data_dir: Path) -> None:
+    """把 MESSAGES_DIR 下的所有数据文件重定向到 data_dir"""
+    original_dir = config.MESSAGES_DIR
+    for name in dir(config):
+        value = getattr(config, name)
+        if isinstance(value, Path) and (value == original_dir or original_dir in value.parents):
+            setattr(config, name, data_dir / value.relative_to(original_dir))
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+
+def _content(rng: random.Random) -> str:
+    """中英文混合的消息内容，长度从一句话到几段不等"""
+    words = rng.choices(_ZH_WORDS + _EN_WORDS, k=rng.choice((4, 8, 16, 32, 96)))
+    return " ".join(words)
+
+
+def generate_dataset(scale: str, seed: int = 0) -> dict:
+    """
+    在当前数据目录生成数据集
+
+    Args:
+        scale: SCALES 中的规模名
+        seed: 随机种子（相同种子生成相同数据）
+
+    Returns:
+        场景使用的上下文：代理、群组成员、各代理/群组最近的消息ID、任务ID等
+    """
+    spec = SCALES[scale]
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    agents = [f"agent_{i:04d}" for i in range(spec["agents"])]
+    groups = {}
+    for i in range(spec["groups"]):
+        members = rng.sample(agents, rng.randint(3, min(30, len(agents))))
+        groups[f"GROUP_BENCH_{i:04d}"] = {
+            "name": f"群组{i} {rng.choice(_EN_WORDS)}",
+            "description": _content(rng),
+            "creator": members[0],
+            "members": members,
+            "created_at": (now - timedelta(days=60)).isoformat(),
+            "active": True,
+            "status": "active",
+        }
+    groups["GROUP_BENCH_ALL"] = {
+        "name": "全员大群",
+        "description": "all hands",
+        "creator": agents[0],
+        "members": list(agents),
+        "created_at": (now - timedelta(days=60)).isoformat(),
+        "active": True,
+        "status": "active",
+    }
+
+    context = {
+        "scale": scale,
+        "agents": agents,
+        "groups": {gid: list(g["members"]) for gid, g in groups.items()},
+        "group_creators": {gid: g["creator"] for gid, g in groups.items()},
+        "private_ids": {},
+        "group_ids": {},
+    }
+
+    def messages() -> Iterator[dict]:
+        group_list = list(groups)
+        count = spec["messages"]
+        start = now - timedelta(days=30)
+        step = timedelta(days=30) / count
+        reply_info = {}  # 可被回复的消息ID → (发送者, 内容摘要)
+        for seq in range(1, count + 1):
+            sender = rng.choice(agents)
+            message = {
+                "id": f"MSG_BENCH_{seq}",
+                "seq": seq,
+                "sender": sender,
+                "sender_role": "benchmark",
+                "content": _content(rng),
+                "timestamp": (start + step * seq).isoformat(),
+                "timestamp_ms": round((start + step * seq).timestamp() * 1000),
+            }
+            roll = rng.random()
+            if roll < 0.6:
+                group_id = rng.choice(group_list)
+                members = groups[group_id]["members"]
+                message.update(
+                    type="group",
+                    group_id=group_id,
+                    group_name=groups[group_id]["name"],
+                    recipients=members,
+                    topic=rng.choice(_TOPICS),
+                    mentions=rng.sample(members, 1) if rng.random() < 0.1 else [],
+                    importance=rng.choices(("normal", "high", "low"), (85, 5, 10))[0],
+                    is_pinned=False,
+                )
+                recent = context["group_ids"].setdefault(group_id, [])
+                if recent and rng.random() < 0.1:
+                    reply_to = rng.choice(recent)
+                    message.update(
+                        reply_to=reply_to,
+                        reply_to_sender=reply_info[reply_to][0],
+                        reply_to_content=reply_info[reply_to][1],
+                    )
+                recent.append(message["id"])
+                for dropped in recent[:-_RECENT_IDS]:
+                    del reply_info[dropped]
+                del recent[:-_RECENT_IDS]
+                reply_info[message["id"]] = (sender, message["content"][:200])
+            else:
+                recipients = ["*"] if roll > 0.98 else rng.sample(agents, rng.randint(1, 3))
+                message["recipients"] = recipients
+                for recipient in recipients:
+                    recent = context["private_ids"].setdefault(recipient, [])
+                    recent.append(message["id"])
+                    del recent[:-_RECENT_IDS]
+            yield message
+
+    tasks = []
+    for i in range(spec["tasks"]):
+        creator = rng.choice(agents)
+        tasks.append(
+            {
+                "id": f"TASK_BENCH_{i}",
+                "title": f"任务 {i}: {rng.choice(_EN_WORDS)}",
+                "description": _content(rng),
+                "priority": rng.choice(_PRIORITIES),
+                "status": rng.choice(_TASK_STATUSES),
+                "creator": creator,
+                "assignee": rng.choice(agents) if rng.random() < 0.8 else None,
+                "created_at": (now - timedelta(days=rng.randint(0, 30))).isoformat(),
+                "due_date": None,
+                "updated_at": now.isoformat(),
+            }
+        )
+    context["tasks"] = [(t["id"], t["creator"]) for t in tasks]
+
+    stores = {
+        "agents": {
+            agent: {
+                "role": "benchmark",
+                "description": f"{agent} 合成代理",
+                "session_id": f"{agent}_bench",
+                "registered_at": now.isoformat(),
+            }
+            for agent in agents
+        },
+        "sessions": {
+            f"{agent}_bench": {
+                "agent_name": agent,
+                "role": "benchmark",
+                "description": "",
+                "created_at": now.isoformat(),
+                "active": True,
+            }
+            for agent in agents
+        },
+        "groups": groups,
+    }
+
+    if config.STORAGE_BACKEND == "sqlite":
+        sqlite_store.import_data(messages(), tasks, stores)
+    else:
+        message_log.compact_messages(messages())
+        storage.save_tasks(tasks)
+        storage.save_agents(stores["agents"])
+        storage.save_sessions(stores["sessions"])
+        storage.save_groups(groups)
+
+    # 每个代理读到了九成左右的消息
+    storage._save_document(
+        "read_state",
+        {agent: {"hwm": int(spec["messages"] * rng.uniform(0.8, 0.95)), "read": []} for agent in agents},
+    )
+    storage.rebuild_unread_counters()
+    storage.rebuild_search_index()
+    return context
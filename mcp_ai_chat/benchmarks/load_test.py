@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+MCP AI Chat Group - 多代理负载测试
+
+启动 N 个真实的 server_modular 子进程（通过 stdio 连接），共享同一个数据目录，
+每个代理按给定比例不停调用 send / group / receive / standby / task，结束后报告：
+- 吞吐量，以及每种操作的 p50/p99/最大延迟和错误数
+- 丢失更新：已确认写入但不在存储中的消息、最终状态与最后一次确认的更新不符的任务、
+  重复的任务ID
+- JSON 损坏：运行期间反复直接读取数据目录中的 JSON 文件（不经缓存），记录解析失败
+  的次数；结束后检查消息日志、收件箱索引和未读计数
+
+用法：
+    python -m mcp_ai_chat.benchmarks.load_test --agents 10 --duration 30
+    python -m mcp_ai_chat.benchmarks.load_test --agents 20 --mix send=3,receive=3,standby=2,task=2
+    python -m mcp_ai_chat.benchmarks.load_test --backend sqlite --json
+
+发现丢失更新、损坏或索引不一致时返回非零退出码。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+from .. import config
+from ..core import message_log, storage
+from .dataset import use_data_dir
+
+try:
+    from mcp import ClientSession
+    from mcp.client.stdio import StdioServerParameters, stdio_client
+except ImportError:
+    print("错误: 请先安装MCP Python SDK:")
+    print("pip install mcp")
+    sys.exit(1)
+
+DEFAULT_MIX = "send=4,group=2,receive=3,standby=1,task=2"
+
+# 写入消息内容中的标记，用于在存储中找回本次发送的消息
+_TOKEN_PREFIX = "LT|"
+
+_TASK_ID_RE = re.compile(r"任务ID: (\S+)")
+_GROUP_ID_RE = re.compile(r"群组ID: (\S+)")
+_TASK_STATUSES = ["进行中", "已完成", "待开始"]
+
+
+def parse_mix(text: str) -> dict:
+    """解析操作比例，如 "send=4,receive=3" → {"send": 4, "receive": 3}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in _OPERATIONS:
+            raise ValueError(f"未知操作: {name}（可用: {', '.join(_OPERATIONS)}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadTest:
+    """一次负载测试的共享状态：连接、计时结果和已确认的写入"""
+
+    def __init__(self, agents: int, seed: int) -> None:
+        self.agent_names = [f"lt_agent_{i:02d}" for i in range(agents)]
+        self.rng = random.Random(seed)
+        self.sessions: dict = {}
+        self.group_id = None
+        self.latencies: dict = {}
+        self.errors: Counter = Counter()
+        self.sent_tokens: set = set()
+        self.created_tasks: set = set()
+        self.task_owner: dict = {}
+        self.expected_status: dict = {}
+        self.corruption_events: list = []
+
+    async def call(self, op: str, agent: str, tool: str, arguments: dict):
+        """调用工具并记录延迟；失败时返回None"""
+        started = time.perf_counter()
+        try:
+            result = await self.sessions[agent].call_tool(tool, arguments)
+        except Exception:
+            self.errors[op] += 1
+            self.latencies.setdefault(op, []).append((time.perf_counter() - started) * 1000)
+            return None
+        self.latencies.setdefault(op, []).append((time.perf_counter() - started) * 1000)
+        text = result.content[0].text if result.content else ""
+        if result.isError or text.startswith(("错误", "❌")):
+            self.errors[op] += 1
+            return None
+        return text
+
+
+async def _op_send(lt: LoadTest, agent: str, n: int) -> None:
+    recipient = lt.rng.choice([a for a in lt.agent_names if a != agent] or [agent])
+    token = f"{_TOKEN_PREFIX}{agent}|{n}"
+    if await lt.call("send", agent, "send_message", {"recipients": recipient, "message": token}):
+        lt.sent_tokens.add(token)
+
+
+async def _op_group(lt: LoadTest, agent: str, n: int) -> None:
+    token = f"{_TOKEN_PREFIX}{agent}|{n}"
+    text = await lt.call(
+        "group", agent, "send_group_message", {"group_id": lt.group_id, "message": token}
+    )
+    if text:
+        lt.sent_tokens.add(token)
+
+
+async def _op_receive(lt: LoadTest, agent: str, n: int) -> None:
+    await lt.call(
+        "receive", agent, "receive_messages", {"recipient": agent, "unread_only": True, "limit": 20}
+    )
+
+
+async def _op_standby(lt: LoadTest, agent: str, n: int) -> None:
+    await lt.call("standby", agent, "standby", {"wait": False, "auto_read": False})
+
+
+async def _op_task(lt: LoadTest, agent: str, n: int) -> None:
+    own = [t for t, owner in lt.task_owner.items() if owner == agent]
+    if not own or lt.rng.random() < 0.3:
+        text = await lt.call(
+            "task",
+            agent,
+            "create_task",
+            {"title": f"{_TOKEN_PREFIX}{agent}|{n}", "description": "load test", "priority": "P2"},
+        )
+        match = _TASK_ID_RE.search(text or "")
+        if match:
+            lt.created_tasks.add(match.group(1))
+            lt.task_owner[match.group(1)] = agent
+            lt.expected_status[match.group(1)] = "待开始"
+        return
+    task_id = lt.rng.choice(own)
+    status = _TASK_STATUSES[n % len(_TASK_STATUSES)]
+    if await lt.call("task", agent, "update_task_status", {"task_id": task_id, "status": status}):
+        lt.expected_status[task_id] = status
+
+
+_OPERATIONS = {
+    "send": _op_send,
+    "group": _op_group,
+    "receive": _op_receive,
+    "standby": _op_standby,
+    "task": _op_task,
+}
+
+
+async def _agent_loop(lt: LoadTest, agent: str, mix: dict, deadline: float) -> int:
+    """一个代理不停按比例选择操作，直到截止时间；返回完成的操作数"""
+    names, weights = list(mix), list(mix.values())
+    n = 0
+    while time.monotonic() < deadline:
+        op = lt.rng.choices(names, weights)[0]
+        await _OPERATIONS[op](lt, agent, n)
+        n += 1
+    return n
+
+
+async def _watch_json_files(lt: LoadTest, data_dir: Path, stop: asyncio.Event) -> None:
+    """运行期间反复直接解析数据目录中的 JSON 文件，记录读到损坏内容的次数"""
+    while not stop.is_set():
+        for path in data_dir.glob("*.json"):
+            try:
+                json.loads(path.read_bytes())
+            except FileNotFoundError:
+                continue
+            except ValueError as e:
+                lt.corruption_events.append({"file": path.name, "error": str(e)})
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+def verify_store(lt: LoadTest) -> dict:
+    """在所有服务器退出后检查存储：丢失的写入、重复的任务和索引一致性"""
+    stored_tokens = Counter(
+        m.get("content")
+        for m in storage.load_messages()
+        if str(m.get("content", "")).startswith(_TOKEN_PREFIX)
+    )
+    tasks = storage.load_tasks()
+    task_ids = Counter(t.get("id") for t in tasks)
+    status_by_id = {t.get("id"): t.get("status") for t in tasks}
+
+    lost_messages = sorted(lt.sent_tokens - set(stored_tokens))
+    lost_tasks = sorted(lt.created_tasks - set(task_ids))
+    lost_status_updates = sorted(
+        task_id
+        for task_id, status in lt.expected_status.items()
+        if task_id in status_by_id and task_ids[task_id] == 1 and status_by_id[task_id] != status
+    )
+
+    undecodable_lines = 0
+    if config.STORAGE_BACKEND != "sqlite":
+        for log_file in message_log.shard_log_files():
+            if not log_file.exists():
+                continue
+            with open(log_file, "rb") as f:
+                for line in f:
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        undecodable_lines += 1
+
+    return {
+        "lost_messages": lost_messages,
+        "duplicate_messages": sorted(t for t, c in stored_tokens.items() if c > 1),
+        "lost_tasks": lost_tasks,
+        "duplicate_task_ids": sorted(t for t, c in task_ids.items() if c > 1),
+        "lost_status_updates": lost_status_updates,
+        "undecodable_log_lines": undecodable_lines,
+        "mailboxes_ok": storage.check_mailboxes()["ok"],
+        "unread_counters_ok": storage.check_unread_counters()["ok"],
+    }
+
+
+async def run_load_test(
+    agents: int, duration: float, mix: dict, backend: str, data_root: Path, seed: int = 0
+) -> dict:
+    """
+    启动服务器进程并运行负载
+
+    Args:
+        agents: 代理（服务器进程）数量
+        duration: 施加负载的秒数
+        mix: 操作 → 权重
+        backend: 存储后端
+        data_root: 作为服务器 HOME 的目录（数据位于其下的 .mcp_ai_chat）
+        seed: 随机种子
+
+    Returns:
+        报告（吞吐量、各操作延迟、丢失更新、损坏事件、一致性检查）
+    """
+    lt = LoadTest(agents, seed)
+    data_dir = data_root / ".mcp_ai_chat"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    package_root = str(Path(__file__).resolve().parents[2])
+    env = {
+        **os.environ,
+        "HOME": str(data_root),
+        "USERPROFILE": str(data_root),
+        "MCP_AI_CHAT_STORAGE_BACKEND": backend,
+        "PYTHONPATH": os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")])),
+    }
+    params = StdioServerParameters(
+        command=sys.executable, args=["-m", "mcp_ai_chat.server_modular"], env=env
+    )
+
+    async with AsyncExitStack() as stack:
+        for agent in lt.agent_names:
+            read, write = await stack.enter_async_context(stdio_client(params))
+            session = await stack.enter_async_context(ClientSession(read, write))
+            await session.initialize()
+            lt.sessions[agent] = session
+        await asyncio.gather(
+            *(
+                lt.call("register", agent, "register_agent", {"agent_name": agent, "role": "负载测试"})
+                for agent in lt.agent_names
+            )
+        )
+        text = await lt.call(
+            "setup",
+            lt.agent_names[0],
+            "create_group",
+            {"name": "负载测试群", "members": lt.agent_names},
+        )
+        lt.group_id = _GROUP_ID_RE.search(text or "").group(1)
+        lt.latencies.clear()
+
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(_watch_json_files(lt, data_dir, stop))
+        started = time.monotonic()
+        deadline = started + duration
+        counts = await asyncio.gather(
+            *(_agent_loop(lt, agent, mix, deadline) for agent in lt.agent_names)
+        )
+        elapsed = time.monotonic() - started
+        stop.set()
+        await watcher
+
+    config.STORAGE_BACKEND = backend
+    use_data_dir(data_dir)
+    integrity = verify_store(lt)
+
+    operations = {}
+    for op, values in sorted(lt.latencies.items()):
+        values.sort()
+        operations[op] = {
+            "count": len(values),
+            "errors": lt.errors[op],
+            "p50_ms": round(_percentile(values, 0.50), 2),
+            "p99_ms": round(_percentile(values, 0.99), 2),
+            "max_ms": round(values[-1], 2),
+        }
+    return {
+        "agents": agents,
+        "backend": backend,
+        "duration_s": round(elapsed, 2),
+        "total_ops": sum(counts),
+        "throughput_ops_s": round(sum(counts) / elapsed, 1),
+        "operations": operations,
+        "corruption_events": lt.corruption_events,
+        **integrity,
+    }
+
+
+def report_failed(report: dict) -> bool:
+    """报告中是否有丢失更新、损坏或不一致"""
+    return bool(
+        report["lost_messages"]
+        or report["duplicate_messages"]
+        or report["lost_tasks"]
+        or report["duplicate_task_ids"]
+        or report["lost_status_updates"]
+        or report["undecodable_log_lines"]
+        or report["corruption_events"]
+        or not report["mailboxes_ok"]
+        or not report["unread_counters_ok"]
+    )
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"👥 {report['agents']} 个代理（{report['backend']}），{report['duration_s']}s，"
+        f"共 {report['total_ops']} 次调用，吞吐量 {report['throughput_ops_s']} 次/秒\n"
+    )
+    print(f"{'操作':<10}{'次数':>8}{'错误':>6}{'p50 ms':>10}{'p99 ms':>10}{'最大 ms':>10}")
+    for op, r in report["operations"].items():
+        print(
+            f"{op:<10}{r['count']:>8}{r['errors']:>6}{r['p50_ms']:>10.2f}"
+            f"{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}"
+        )
+    print()
+    for key, label in [
+        ("lost_messages", "丢失的消息"),
+        ("duplicate_messages", "重复的消息"),
+        ("lost_tasks", "丢失的任务"),
+        ("duplicate_task_ids", "重复的任务ID"),
+        ("lost_status_updates", "丢失的任务状态更新"),
+        ("corruption_events", "读到损坏的JSON"),
+    ]:
+        print(f"{'❌' if report[key] else '✅'} {label}: {len(report[key])}")
+    print(
+        f"{'❌' if report['undecodable_log_lines'] else '✅'} "
+        f"消息日志中无法解析的行: {report['undecodable_log_lines']}"
+    )
+    print(f"{'✅' if report['mailboxes_ok'] else '❌'} 收件箱索引一致")
+    print(f"{'✅' if report['unread_counters_ok'] else '❌'} 未读计数一致")
+
+
+def main(argv=None) -> int:
+    """主入口"""
+    parser = argparse.ArgumentParser(
+        prog="python -m mcp_ai_chat.benchmarks.load_test", description="MCP AI Chat 多代理负载测试"
+    )
+    parser.add_argument("--agents", type=int, default=10, help="代理（服务器进程）数量")
+    parser.add_argument("--duration", type=float, default=20, help="施加负载的秒数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"操作比例，默认 {DEFAULT_MIX}")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=config.STORAGE_BACKEND)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", type=Path, help="服务器的 HOME 目录（默认临时目录）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出报告")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with tempfile.TemporaryDirectory(prefix="mcp_ai_chat_load_") as tmp:
+        report = asyncio.run(
+            run_load_test(
+                args.agents, args.duration, mix, args.backend, args.data_dir or Path(tmp), args.seed
+            )
+        )
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 1 if report_failed(report) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
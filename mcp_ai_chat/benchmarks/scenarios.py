@@ -0,0 +1,270 @@
+"""
+MCP AI Chat Group - 基准测试场景
+
+SCENARIOS：工具名 → 场景函数 (上下文, 调用序号) → (调用代理, 工具参数)。
+上下文由 dataset.generate_dataset 返回；场景只读取上下文，
+同一工具的多次调用尽量落在不同的代理、群组和消息上。
+"""
+
+from pathlib import Path
+from typing import Callable
+
+from .. import config
+
+# 供 share_code_snippet / request_review 读取的真实文件
+_SOURCE_FILE = str(Path(config.__file__))
+
+
+def _agent(ctx: dict, i: int) -> str:
+    agents = ctx["agents"]
+    return agents[(i * 7) % len(agents)]
+
+
+def _group_with_member(ctx: dict, i: int) -> tuple:
+    """(群组ID, 成员)：轮流选取普通群组和全员大群"""
+    group_ids = sorted(ctx["groups"])
+    group_id = group_ids[i % len(group_ids)]
+    members = ctx["groups"][group_id]
+    return group_id, members[i % len(members)]
+
+
+def _group_message(ctx: dict, i: int) -> tuple:
+    """(群组ID, 成员, 群组内的一条消息ID)"""
+    group_ids = sorted(g for g in ctx["group_ids"] if g in ctx["groups"])
+    group_id = group_ids[i % len(group_ids)]
+    members = ctx["groups"][group_id]
+    recent = ctx["group_ids"][group_id]
+    return group_id, members[i % len(members)], recent[-1 - i % len(recent)]
+
+
+def _recipients(ctx: dict, i: int) -> str:
+    agents = ctx["agents"]
+    return "&".join(agents[(i * 3 + k) % len(agents)] for k in range(1, 3))
+
+
+def _task(ctx: dict, i: int) -> tuple:
+    task_id, creator = ctx["tasks"][i % len(ctx["tasks"])]
+    return task_id, creator
+
+
+def _send_message(ctx, i):
+    return _agent(ctx, i), {"recipients": _recipients(ctx, i), "message": f"bench 消息 {i}"}
+
+
+def _receive_messages(ctx, i):
+    agent = _agent(ctx, i)
+    return agent, {"recipient": agent, "limit": 20, "unread_only": i % 2 == 0}
+
+
+def _mark_messages_read(ctx, i):
+    agents = [a for a in ctx["agents"] if ctx["private_ids"].get(a)]
+    agent = agents[i % len(agents)]
+    return agent, {"message_ids": ctx["private_ids"][agent][-5:]}
+
+
+def _request_help(ctx, i):
+    return _agent(ctx, i), {
+        "recipients": _recipients(ctx, i),
+        "topic": "性能问题",
+        "description": f"benchmark request {i}",
+    }
+
+
+def _request_review(ctx, i):
+    return _agent(ctx, i), {
+        "recipients": _recipients(ctx, i),
+        "file_path": _SOURCE_FILE,
+        "description": "请评审",
+    }
+
+
+def _notify_completion(ctx, i):
+    return _agent(ctx, i), {
+        "recipients": _recipients(ctx, i),
+        "task_title": f"任务 {i}",
+        "summary": "已完成 benchmark",
+    }
+
+
+def _share_code_snippet(ctx, i):
+    return _agent(ctx, i), {
+        "recipients": _recipients(ctx, i),
+        "file_path": _SOURCE_FILE,
+        "description": "配置片段",
+        "line_start": 1,
+        "line_end": 20,
+    }
+
+
+_SEARCH_QUERIES = ["性能 优化", "cache index", "数据库 索引", "deploy 部署", "并发 thread"]
+
+
+def _search_messages(ctx, i):
+    query = _SEARCH_QUERIES[i % len(_SEARCH_QUERIES)]
+    if i % 2:
+        return _agent(ctx, i), {"query": query, "limit": 10}
+    group_id, member = _group_with_member(ctx, i)
+    return member, {"query": query, "group_id": group_id, "limit": 10}
+
+
+def _create_task(ctx, i):
+    return _agent(ctx, i), {"title": f"bench 任务 {i}", "description": "synthetic", "priority": "P2"}
+
+
+def _assign_task(ctx, i):
+    task_id, creator = _task(ctx, i)
+    return creator, {"task_id": task_id, "assignee": _agent(ctx, i + 1)}
+
+
+def _update_task_status(ctx, i):
+    task_id, creator = _task(ctx, i)
+    return creator, {"task_id": task_id, "status": "进行中", "progress_note": "bench"}
+
+
+def _get_tasks(ctx, i):
+    agent = _agent(ctx, i)
+    return agent, {"assignee": agent}
+
+
+def _delete_task(ctx, i):
+    task_id, creator = _task(ctx, len(ctx["tasks"]) - 1 - i)
+    return creator, {"task_ids": [task_id]}
+
+
+def _create_group(ctx, i):
+    agents = ctx["agents"]
+    return _agent(ctx, i), {
+        "name": f"bench 群组 {i}",
+        "description": "synthetic",
+        "members": [agents[(i + k) % len(agents)] for k in range(5)],
+    }
+
+
+def _send_group_message(ctx, i):
+    group_id, member = _group_with_member(ctx, i)
+    return member, {
+        "group_id": group_id,
+        "message": f"bench 群组消息 {i}",
+        "mentions": ctx["groups"][group_id][:1] if i % 5 == 0 else [],
+    }
+
+
+def _receive_group_messages(ctx, i):
+    group_id, member = _group_with_member(ctx, i)
+    return member, {"group_id": group_id, "limit": 20, "unread_only": i % 2 == 0}
+
+
+def _list_groups(ctx, i):
+    agent = _agent(ctx, i)
+    return agent, {"member": agent, "include_preview": i % 2 == 0}
+
+
+def _join_group(ctx, i):
+    group_ids = sorted(g for g in ctx["groups"] if g != "GROUP_BENCH_ALL")
+    group_id = group_ids[i % len(group_ids)]
+    outsiders = [a for a in ctx["agents"] if a not in ctx["groups"][group_id]]
+    return outsiders[i // len(group_ids) % len(outsiders)], {"group_id": group_id}
+
+
+def _leave_group(ctx, i):
+    # 离开 join_group 场景加入的群组，两者先后运行后成员关系复原
+    return _join_group(ctx, i)
+
+
+def _summarize_group_messages(ctx, i):
+    group_id, member = _group_with_member(ctx, i)
+    return member, {"group_id": group_id, "time_range": "last_7_days"}
+
+
+def _get_unread_counts(ctx, i):
+    return _agent(ctx, i), {}
+
+
+def _archive_group(ctx, i):
+    group_ids = sorted(g for g in ctx["groups"] if g != "GROUP_BENCH_ALL")
+    group_id = group_ids[-1 - i % len(group_ids)]
+    return ctx["group_creators"][group_id], {"group_id": group_id, "reason": "bench"}
+
+
+def _pin_message(ctx, i):
+    group_id, member, message_id = _group_message(ctx, i)
+    return member, {"group_id": group_id, "message_id": message_id}
+
+
+def _unpin_message(ctx, i):
+    group_id, member, message_id = _group_message(ctx, i)
+    return member, {"group_id": group_id, "message_id": message_id}
+
+
+def _get_thread(ctx, i):
+    group_id, member, message_id = _group_message(ctx, i)
+    return member, {"message_id": message_id}
+
+
+def _register_agent(ctx, i):
+    agent = _agent(ctx, i)
+    return agent, {"agent_name": agent, "role": "benchmark", "description": "synthetic"}
+
+
+def _set_employee_config(ctx, i):
+    agent = _agent(ctx, i)
+    relative = Path(_SOURCE_FILE).relative_to(config.WORKSPACE_ROOT)
+    return agent, {"agent_name": agent, "mdc_file_path": str(relative)}
+
+
+def _no_arguments(ctx, i):
+    return _agent(ctx, i), {}
+
+
+def _standby(ctx, i):
+    return _agent(ctx, i), {"wait": False}
+
+
+def _batch(ctx, i):
+    # 一个典型的代理回合：收消息 → 标记已读 → 查任务 → 回复
+    agent, mark_arguments = _mark_messages_read(ctx, i)
+    return agent, {
+        "calls": [
+            {"tool": "receive_messages", "arguments": {"recipient": agent, "limit": 20}},
+            {"tool": "mark_messages_read", "arguments": mark_arguments},
+            {"tool": "get_tasks", "arguments": {"assignee": agent}},
+            {"tool": "send_message", "arguments": _send_message(ctx, i)[1]},
+        ]
+    }
+
+
+SCENARIOS: dict[str, Callable[[dict, int], tuple]] = {
+    "send_message": _send_message,
+    "receive_messages": _receive_messages,
+    "mark_messages_read": _mark_messages_read,
+    "request_help": _request_help,
+    "request_review": _request_review,
+    "notify_completion": _notify_completion,
+    "share_code_snippet": _share_code_snippet,
+    "search_messages": _search_messages,
+    "create_task": _create_task,
+    "assign_task": _assign_task,
+    "update_task_status": _update_task_status,
+    "get_tasks": _get_tasks,
+    "delete_task": _delete_task,
+    "create_group": _create_group,
+    "send_group_message": _send_group_message,
+    "receive_group_messages": _receive_group_messages,
+    "list_groups": _list_groups,
+    "join_group": _join_group,
+    "leave_group": _leave_group,
+    "summarize_group_messages": _summarize_group_messages,
+    "get_unread_counts": _get_unread_counts,
+    "archive_group": _archive_group,
+    "pin_message": _pin_message,
+    "unpin_message": _unpin_message,
+    "get_thread": _get_thread,
+    "register_agent": _register_agent,
+    "set_employee_config": _set_employee_config,
+    "get_current_session": _no_arguments,
+    "list_agents": _no_arguments,
+    "standby": _standby,
+    "batch": _batch,
+    "get_server_metrics": _no_arguments,
+    "profile_tool_calls": _no_arguments,
+}
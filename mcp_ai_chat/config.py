@@ -2,17 +2,62 @@
 MCP AI Chat Group - 配置管理
 """
 
+import os
 from pathlib import Path
 
 # 数据存储目录
 MESSAGES_DIR = Path.home() / ".mcp_ai_chat"
-MESSAGES_FILE = MESSAGES_DIR / "messages.json"
+MESSAGES_FILE = MESSAGES_DIR / "messages.json"  # 旧格式，首次启动时迁移到消息日志
+MESSAGES_LOG_FILE = MESSAGES_DIR / "messages.jsonl"  # 私聊消息分片（群组消息按群组分片，见 GROUP_SHARDS_DIR）
+MESSAGES_INDEX_FILE = MESSAGES_DIR / "messages.idx"
+MESSAGES_SEQUENCE_FILE = MESSAGES_DIR / "messages.seq"  # 全局序列号目录：seq → (分片, 偏移)
+MESSAGES_SEQUENCE_HIGH_FILE = MESSAGES_DIR / "messages.seq.high"  # 移出分片前分配过的最大序列号
+MESSAGES_TIME_INDEX_FILE = MESSAGES_DIR / "messages.tidx"  # 按序列号顺序的时间水位，用于按时间二分定位
+MESSAGES_PATCH_FILE = MESSAGES_DIR / "messages.patch"  # 私聊分片中已修改消息的新版本（群组分片在各自目录下）
+MESSAGES_ID_INDEX_FILE = MESSAGES_DIR / "messages.ids"  # 消息ID → 序列号（按ID哈希排序）
+MESSAGES_ID_TAIL_FILE = MESSAGES_DIR / "messages.ids.tail"  # 尚未并入 messages.ids 的ID索引项
+MESSAGES_REPLY_INDEX_FILE = MESSAGES_DIR / "messages.replies"  # 被回复消息的ID → 回复的序列号
+MESSAGES_REPLY_TAIL_FILE = MESSAGES_DIR / "messages.replies.tail"  # 尚未并入 messages.replies 的回复索引项
+GROUP_SHARDS_DIR = MESSAGES_DIR / "groups"  # 群组消息分片：groups/<群组ID>/messages.jsonl
+MESSAGE_SHARDS_FILE = MESSAGES_DIR / "message_shards.json"  # 群组ID → 分片编号
+MAILBOX_DIR = MESSAGES_DIR / "mailboxes"  # 接收者 → 消息的索引
 AGENTS_FILE = MESSAGES_DIR / "agents.json"
 SESSIONS_FILE = MESSAGES_DIR / "sessions.json"
 TASKS_FILE = MESSAGES_DIR / "tasks.json"
 GROUPS_FILE = MESSAGES_DIR / "groups.json"
 STANDBY_FILE = MESSAGES_DIR / "standby.json"
 EMPLOYEE_CONFIG_FILE = MESSAGES_DIR / "employee_config.json"
+READ_STATE_FILE = MESSAGES_DIR / "read_state.json"  # 每个代理的已读水位
+UNREAD_COUNTERS_FILE = MESSAGES_DIR / "unread_counters.json"  # 每个代理在各群组的未读计数
+MESSAGE_ROLLUPS_DIR = MESSAGES_DIR / "rollups"  # 各群组按小时/按天汇总的消息统计：rollups/<群组ID>.json
+MESSAGE_ROLLUPS_WATERMARK_FILE = MESSAGE_ROLLUPS_DIR / "watermark"  # 已计入汇总的最大序列号
+NOTIFY_DIR = MESSAGES_DIR / "notify"  # 等待中的 standby 调用的通知套接字
+SQLITE_DB_FILE = MESSAGES_DIR / "ai_chat.db"
+METRICS_DIR = MESSAGES_DIR / "metrics"  # 各服务器进程的 Prometheus 文本指标（见 core/metrics）
+PROFILES_DIR = MESSAGES_DIR / "profiles"  # 按需采集的工具调用剖析结果（见 core/profiling）
+SEARCH_INDEX_FILE = MESSAGES_DIR / "search_index.db"  # JSON 后端的全文索引（SQLite 后端存放在 ai_chat.db 中）
+
+# 存储后端："json"（默认，JSON文件 + 消息日志）或 "sqlite"（单个SQLite数据库，WAL模式）
+STORAGE_BACKEND = os.environ.get("MCP_AI_CHAT_STORAGE_BACKEND", "json").lower()
+
+# 执行存储读写等阻塞操作的线程数（见 core/io_executor）
+IO_WORKERS = int(os.environ.get("MCP_AI_CHAT_IO_WORKERS", "4"))
+
+# 是否把工具调用指标以 Prometheus 文本格式写入 METRICS_DIR（node-exporter textfile collector），
+# 以及两次写入的最小间隔（秒）
+METRICS_TEXTFILE = os.environ.get("MCP_AI_CHAT_METRICS_TEXTFILE", "").lower() in ("1", "true", "yes")
+METRICS_TEXTFILE_INTERVAL = float(os.environ.get("MCP_AI_CHAT_METRICS_TEXTFILE_INTERVAL", "15"))
+
+# 启动时开启工具调用剖析（见 core/profiling）：剖析接下来的 N 次调用 / 只保存慢于阈值的调用、
+# 只剖析指定工具、是否同时记录 tracemalloc 内存分配
+PROFILE_CALLS = int(os.environ["MCP_AI_CHAT_PROFILE_CALLS"]) if os.environ.get("MCP_AI_CHAT_PROFILE_CALLS") else None
+PROFILE_SLOWER_THAN_MS = (
+    float(os.environ["MCP_AI_CHAT_PROFILE_SLOWER_THAN_MS"])
+    if os.environ.get("MCP_AI_CHAT_PROFILE_SLOWER_THAN_MS")
+    else None
+)
+PROFILE_TOOL = os.environ.get("MCP_AI_CHAT_PROFILE_TOOL") or None
+PROFILE_TRACEMALLOC = os.environ.get("MCP_AI_CHAT_PROFILE_TRACEMALLOC", "").lower() in ("1", "true", "yes")
 
 # 工作区路径
 WORKSPACE_ROOT = Path(__file__).parent.parent
@@ -20,6 +65,8 @@ RULES_DIR = WORKSPACE_ROOT / ".cursor" / "rules"
 
 # 常量
 STANDBY_TIMEOUT_SECONDS = 300  # 5分钟
+STANDBY_RECHECK_SECONDS = 30  # 等待通知期间兜底重新检查的间隔（发现不发通知的写入方）
+STANDBY_POLL_SECONDS = 2  # 不支持通知套接字时的轮询间隔
 DEFAULT_MESSAGE_LIMIT = 20
 DEFAULT_MAX_CONTENT_LENGTH = 5000
 
@@ -0,0 +1,160 @@
+"""
+MCP AI Chat Group - 文件锁与原子写入模块
+
+每个代理运行独立的服务器进程，共同读写 ~/.mcp_ai_chat 下的数据文件：
+- file_lock：基于 fcntl.flock 的读写锁（共享锁供读者并发持有，排他锁用于读-改-写）。
+  锁加在数据文件旁的 .lock 文件上，数据文件被原子替换后锁依然有效；
+  同一线程内可重入，获取锁时阻塞等待而不是轮询重试
+- file_locks：一次获取多个排他锁（全部获取或全部不获取），持有部分锁时不阻塞等待
+- atomic_write：先写同目录临时文件并 fsync，再 rename 替换目标文件，
+  读者只会看到完整的旧文件或新文件
+
+不支持 fcntl 的平台（Windows）上锁为空操作，原子写入照常生效。
+"""
+
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 当前线程持有的锁：锁文件路径 → [文件描述符, 是否排他]
+_local = threading.local()
+
+
+def lock_path(file_path: Path) -> Path:
+    """数据文件对应的锁文件路径"""
+    return file_path.with_name(file_path.name + ".lock")
+
+
+def _held_locks() -> dict:
+    held = getattr(_local, "held", None)
+    if held is None:
+        held = _local.held = {}
+    return held
+
+
+@contextmanager
+def file_lock(file_path: Path, exclusive: bool = True, blocking: bool = True) -> Iterator[None]:
+    """
+    获取数据文件的读写锁
+
+    Args:
+        file_path: 要保护的数据文件
+        exclusive: True为排他锁（写），False为共享锁（读）
+        blocking: False时锁被其他进程（或线程）持有则立即抛出 BlockingIOError
+
+    同一线程已持有该锁时直接复用；已持有共享锁又请求排他锁时临时升级，
+    退出时恢复为共享锁。
+    """
+    if fcntl is None:
+        yield
+        return
+
+    path = lock_path(file_path)
+    held = _held_locks()
+    entry = held.get(path)
+    nonblocking = 0 if blocking else fcntl.LOCK_NB
+
+    if entry is not None:
+        fd, is_exclusive = entry
+        if is_exclusive or not exclusive:
+            yield
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX | nonblocking)
+        entry[1] = True
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            entry[1] = False
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | nonblocking)
+        held[path] = [fd, exclusive]
+        try:
+            yield
+        finally:
+            del held[path]
+    finally:
+        os.close(fd)  # 关闭描述符即释放 flock
+
+
+@contextmanager
+def file_locks(file_paths: Iterable[Path]) -> Iterator[None]:
+    """
+    同时获取多个数据文件的排他锁
+
+    逐个以非阻塞方式尝试；有锁被占用时释放已获取的锁，随机退避后整体重试。
+    持有部分锁时从不阻塞等待，因此与按任意顺序加锁的其他调用方都不会死锁。
+    """
+    file_paths = list(dict.fromkeys(file_paths))
+    while True:
+        with ExitStack() as stack:
+            try:
+                for file_path in file_paths:
+                    stack.enter_context(file_lock(file_path, blocking=False))
+            except BlockingIOError:
+                pass
+            else:
+                yield
+                return
+        time.sleep(random.uniform(0.001, 0.01))
+
+
+def _fsync_directory(directory: Path) -> None:
+    """把目录项的变更（rename）落盘"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_write(file_path: Path) -> Iterator[BinaryIO]:
+    """
+    原子写入文件
+
+    在目标文件所在目录创建临时文件，with 块正常结束后 fsync 并 rename 替换目标；
+    块内抛出异常时删除临时文件，目标文件保持不变。
+
+    Args:
+        file_path: 目标文件
+
+    Yields:
+        以二进制模式打开的临时文件
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(
+        prefix=f".{file_path.name}.", suffix=".tmp", dir=file_path.parent
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    _fsync_directory(file_path.parent)
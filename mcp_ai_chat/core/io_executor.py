@@ -0,0 +1,81 @@
+"""
+MCP AI Chat Group - I/O 线程池模块
+
+存储读写、JSON 编解码、附件读取和文件锁等待都是阻塞操作。处理器在事件循环上
+直接执行它们时，一次大文件写入会卡住所有并发的 MCP 请求和 stdio 传输。
+
+- run_io：在有界线程池（config.IO_WORKERS 个线程）中执行阻塞函数并等待结果
+- blocking_handler：把同步的处理函数包装为在线程池中执行的异步处理器
+
+run_io 把调用方的上下文（contextvars）带到工作线程，工作线程的读写字节数
+计入当前工具调用的指标（见 metrics），正在剖析的调用在工作线程中启用 cProfile
+（见 profiling），结束时丢弃工作线程的 JSON 缓存中修改了却没有写回的文件
+（见 storage.load_json）。
+
+线程池中的调用可以相互重叠；跨线程的互斥与跨进程一样依靠 file_lock
+（每个线程打开自己的锁文件描述符）。
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+
+from .. import config
+from . import metrics, profiling, storage
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.IO_WORKERS, thread_name_prefix="mcp_ai_chat_io"
+        )
+    return _executor
+
+
+def _reset_after_fork() -> None:
+    """fork 出的子进程中没有线程池的工作线程，需要重新创建"""
+    global _executor
+    _executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在 I/O 线程池中执行阻塞函数，返回其结果（异常原样抛出）"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _get_executor(),
+        functools.partial(
+            context.run,
+            metrics.call_with_io_tracking,
+            profiling.call_profiled,
+            storage.drop_unsaved_json_changes,
+            func,
+            *args,
+            **kwargs,
+        ),
+    )
+
+
+def blocking_handler(func: Callable[[dict], Any]) -> Callable[[dict], Awaitable[Any]]:
+    """
+    把同步处理函数包装为异步处理器
+
+    被包装的函数整体（包括 locked() 内的读-改-写）在同一个工作线程中执行，
+    file_lock 的同线程可重入语义保持不变。
+    """
+
+    @functools.wraps(func)
+    async def wrapper(arguments: dict) -> Any:
+        return await run_io(func, arguments)
+
+    return wrapper
@@ -0,0 +1,243 @@
+"""
+MCP AI Chat Group - 收件箱索引模块
+
+为 JSON 后端的消息日志维护"接收者 → 消息"索引（mailboxes/ 目录）：
+- 每个接收者一个追加写的索引文件，每项为 (seq, 分片日志内的字节偏移, 标志) 三个 64 位整数，
+  按序列号递增排列；读取某个接收者最新的 N 条消息只需读取其索引尾部 N 项。
+  标志的最低位表示群组消息，其余位是消息所在分片的编号（见 message_log）
+- 水位文件记录已建立索引的最大序列号，用于发现并补齐写入中途中断留下的缺口
+
+消息日志的全局序列号目录使用同样的索引项格式，下面的读写函数也用于目录文件。
+本模块只负责索引文件本身，记录的读取与一致性维护见 message_log。
+调用方负责持有消息日志的锁。
+"""
+
+import os
+import shutil
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional
+from urllib.parse import quote
+
+from .. import config
+from .file_lock import atomic_write
+
+# 索引项：seq、日志字节偏移、标志
+_ENTRY_TYPECODE = "Q"
+_ENTRY_FIELDS = 3
+_ENTRY_SIZE = array(_ENTRY_TYPECODE).itemsize * _ENTRY_FIELDS
+ENTRY_SIZE = _ENTRY_SIZE
+
+# 标志位：群组消息；更高的位保存分片编号
+FLAG_GROUP = 1
+_SHARD_SHIFT = 1
+
+# 倒序读取时每次读取的索引项数
+_REVERSE_READ_BATCH = 256
+
+_WATERMARK_NAME = "watermark"
+
+
+def message_flags(message: dict, shard: int = 0) -> int:
+    """计算消息的索引标志（shard 为消息所在分片的编号）"""
+    group = FLAG_GROUP if message.get("type", "private") == "group" else 0
+    return group | shard << _SHARD_SHIFT
+
+
+def shard_of(flags: int) -> int:
+    """索引标志中的分片编号"""
+    return flags >> _SHARD_SHIFT
+
+
+def mailbox_file(recipient: str) -> Path:
+    """接收者的索引文件（接收者名经过转义，可安全用作文件名）"""
+    return config.MAILBOX_DIR / f"{quote(recipient, safe='')}.idx"
+
+
+def append_entry(recipients: Iterable[str], seq: int, offset: int, flags: int) -> None:
+    """把一条消息追加到其所有接收者的索引"""
+    config.MAILBOX_DIR.mkdir(parents=True, exist_ok=True)
+    entry = array(_ENTRY_TYPECODE, [seq, offset, flags])
+    for recipient in dict.fromkeys(recipients):
+        with open(mailbox_file(recipient), "ab") as f:
+            entry.tofile(f)
+
+
+def last_entry_seq(recipient: str) -> int:
+    """接收者索引中最后一项的序列号（没有索引时为0）"""
+    path = mailbox_file(recipient)
+    if not path.exists():
+        return 0
+    with open(path, "rb") as f:
+        count = os.fstat(f.fileno()).st_size // _ENTRY_SIZE
+        if count == 0:
+            return 0
+        f.seek((count - 1) * _ENTRY_SIZE)
+        entry = array(_ENTRY_TYPECODE)
+        entry.frombytes(f.read(_ENTRY_SIZE))
+        return entry[0]
+
+
+def open_mailbox(recipient: str) -> Optional[BinaryIO]:
+    """打开接收者的索引文件用于读取，不存在时返回None"""
+    try:
+        return open(mailbox_file(recipient), "rb")
+    except FileNotFoundError:
+        return None
+
+
+def entry_count(f: BinaryIO) -> int:
+    """打开的索引文件中完整索引项的数量"""
+    return os.fstat(f.fileno()).st_size // _ENTRY_SIZE
+
+
+def read_entry(f: BinaryIO, position: int) -> tuple:
+    """读取第 position 个索引项 (seq, offset, flags)"""
+    f.seek(position * _ENTRY_SIZE)
+    item = array(_ENTRY_TYPECODE)
+    item.frombytes(f.read(_ENTRY_SIZE))
+    return tuple(item)
+
+
+def position_of(f: BinaryIO, count: int, seq: int) -> int:
+    """第一个序列号不小于 seq 的索引项的位置（索引项按序列号递增，二分查找）"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid * _ENTRY_SIZE)
+        item = array(_ENTRY_TYPECODE)
+        item.frombytes(f.read(_ENTRY_SIZE))
+        if item[0] < seq:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def iter_entries_reversed(f: BinaryIO, before_seq: Optional[int] = None) -> Iterator[tuple]:
+    """
+    从新到旧读取索引项 (seq, offset, flags)，只读取打开时已存在的项
+
+    before_seq：只读取序列号小于该值的项（二分查找起点，用于分页续读）
+    """
+    end = os.fstat(f.fileno()).st_size // _ENTRY_SIZE
+    if before_seq is not None:
+        end = position_of(f, end, before_seq)
+    while end > 0:
+        start = max(0, end - _REVERSE_READ_BATCH)
+        f.seek(start * _ENTRY_SIZE)
+        items = array(_ENTRY_TYPECODE)
+        items.frombytes(f.read((end - start) * _ENTRY_SIZE))
+        for i in range(len(items) - _ENTRY_FIELDS, -1, -_ENTRY_FIELDS):
+            yield items[i], items[i + 1], items[i + 2]
+        end = start
+
+
+def iter_entries(f: BinaryIO, start: int, end: int) -> Iterator[tuple]:
+    """按顺序读取第 start 到 end - 1 个索引项"""
+    while start < end:
+        stop = min(end, start + _REVERSE_READ_BATCH)
+        f.seek(start * _ENTRY_SIZE)
+        items = array(_ENTRY_TYPECODE)
+        items.frombytes(f.read((stop - start) * _ENTRY_SIZE))
+        for i in range(0, len(items), _ENTRY_FIELDS):
+            yield items[i], items[i + 1], items[i + 2]
+        start = stop
+
+
+def append_to(path: Path, entry: tuple) -> None:
+    """追加一个索引项"""
+    with open(path, "ab") as f:
+        array(_ENTRY_TYPECODE, entry).tofile(f)
+
+
+def write_entries(path: Path, entries: array) -> None:
+    """整体重写索引文件（entries 为按顺序展平的索引项）"""
+    with atomic_write(path) as f:
+        entries.tofile(f)
+
+
+def new_entries() -> array:
+    """空的展平索引项数组，用 extend((seq, offset, flags)) 追加"""
+    return array(_ENTRY_TYPECODE)
+
+
+def truncate_partial(path: Path) -> int:
+    """截掉写入中途中断留下的不完整索引项，返回完整索引项的数量"""
+    size = path.stat().st_size
+    if size % _ENTRY_SIZE:
+        os.truncate(path, size - size % _ENTRY_SIZE)
+    return size // _ENTRY_SIZE
+
+
+def read_all() -> dict:
+    """读取全部索引：接收者文件名 → [(seq, offset, flags), ...]"""
+    result = {}
+    if not config.MAILBOX_DIR.exists():
+        return result
+    for path in config.MAILBOX_DIR.glob("*.idx"):
+        items = array(_ENTRY_TYPECODE)
+        data = path.read_bytes()
+        items.frombytes(data[: len(data) - len(data) % _ENTRY_SIZE])
+        result[path.name] = [
+            tuple(items[i : i + _ENTRY_FIELDS]) for i in range(0, len(items), _ENTRY_FIELDS)
+        ]
+    return result
+
+
+def write_all(entries: dict, watermark: int) -> None:
+    """
+    整体重写全部索引
+
+    Args:
+        entries: 接收者 → [(seq, offset, flags), ...]（按 seq 递增）
+        watermark: 已建立索引的最大序列号
+    """
+    if config.MAILBOX_DIR.exists():
+        shutil.rmtree(config.MAILBOX_DIR)
+    config.MAILBOX_DIR.mkdir(parents=True, exist_ok=True)
+    for recipient, items in entries.items():
+        flat = array(_ENTRY_TYPECODE)
+        for item in items:
+            flat.extend(item)
+        with atomic_write(mailbox_file(recipient)) as f:
+            flat.tofile(f)
+    write_watermark(watermark)
+
+
+def drop_entries(shard: int) -> int:
+    """从全部收件箱索引中删除指向该分片的索引项，返回删除的项数"""
+    dropped = 0
+    for name, items in read_all().items():
+        kept = [item for item in items if shard_of(item[2]) != shard]
+        if len(kept) == len(items):
+            continue
+        dropped += len(items) - len(kept)
+        flat = array(_ENTRY_TYPECODE)
+        for item in kept:
+            flat.extend(item)
+        write_entries(config.MAILBOX_DIR / name, flat)
+    return dropped
+
+
+def read_watermark() -> Optional[int]:
+    """已建立索引的最大序列号；索引从未建立时返回None"""
+    try:
+        data = (config.MAILBOX_DIR / _WATERMARK_NAME).read_bytes()
+    except FileNotFoundError:
+        return None
+    if len(data) < array(_ENTRY_TYPECODE).itemsize:
+        return None
+    value = array(_ENTRY_TYPECODE)
+    value.frombytes(data[: value.itemsize])
+    return value[0]
+
+
+def write_watermark(seq: int) -> None:
+    """记录已建立索引的最大序列号（原地覆盖8个字节）"""
+    config.MAILBOX_DIR.mkdir(parents=True, exist_ok=True)
+    fd = os.open(config.MAILBOX_DIR / _WATERMARK_NAME, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, array(_ENTRY_TYPECODE, [seq]).tobytes())
+    finally:
+        os.close(fd)
@@ -0,0 +1,166 @@
+"""
+MCP AI Chat Group - 消息ID索引模块
+
+为 JSON 后端的消息日志维护两个"键 → 序列号"索引，按键查找时不再扫描历史：
+- ID索引（by_id）：消息ID → 该消息的 seq，用于回复、置顶、标记已读时按ID查找
+- 回复索引（by_parent）：被回复消息的ID → 回复它的消息的 seq，用于按会话串读取
+
+两个索引格式相同：
+- 每项为 (键哈希, seq) 两个 64 位整数；哈希取 blake2b 的前 8 个字节（跨进程稳定），
+  不同的键可能冲突，调用方按序列号读出记录后核对
+- 主体文件按 (哈希, seq) 排序，查找时二分
+- 尾部文件（.tail）保存之后追加的项（按写入顺序），查找时整体读取；
+  超过 MERGE_THRESHOLD 项时并入主体
+
+本模块只负责索引文件本身，与消息日志的一致性维护见 message_log。
+调用方负责持有消息日志的锁。
+"""
+
+import hashlib
+import os
+from array import array
+from pathlib import Path
+from typing import Iterable
+
+from .. import config
+from .file_lock import atomic_write
+
+# 索引项：键哈希、seq
+_ENTRY_TYPECODE = "Q"
+_ENTRY_FIELDS = 2
+_ENTRY_SIZE = array(_ENTRY_TYPECODE).itemsize * _ENTRY_FIELDS
+
+# 尾部超过该项数时并入主体
+MERGE_THRESHOLD = 8192
+
+
+def key_hash(key: str) -> int:
+    """键（消息ID）的 64 位哈希"""
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _read_items(path: Path) -> array:
+    items = array(_ENTRY_TYPECODE)
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return items
+    items.frombytes(data[: len(data) - len(data) % _ENTRY_SIZE])
+    return items
+
+
+class HashIndex:
+    """一个"键 → 序列号"索引：排序的主体文件和追加写的尾部文件"""
+
+    def __init__(self, main: Path, tail: Path) -> None:
+        self.main = main
+        self.tail = tail
+
+    def exists(self) -> bool:
+        """索引是否已建立"""
+        return self.main.exists()
+
+    def _write_sorted(self, pairs: Iterable[tuple]) -> int:
+        """写入主体并清空尾部，返回项数"""
+        flat = array(_ENTRY_TYPECODE)
+        for pair in pairs:
+            flat.extend(pair)
+        with atomic_write(self.main) as f:
+            flat.tofile(f)
+        with atomic_write(self.tail):
+            pass
+        return len(flat) // _ENTRY_FIELDS
+
+    def write(self, pairs: Iterable[tuple]) -> int:
+        """
+        整体重写索引
+
+        Args:
+            pairs: 全部 (键, seq)
+
+        Returns:
+            索引项数
+        """
+        return self._write_sorted(sorted((key_hash(key), seq) for key, seq in pairs))
+
+    def append(self, pairs: Iterable[tuple]) -> int:
+        """把 (键, seq) 追加到尾部，返回尾部的项数"""
+        items = array(_ENTRY_TYPECODE)
+        for key, seq in pairs:
+            items.extend((key_hash(key), seq))
+        with open(self.tail, "ab") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % _ENTRY_SIZE:
+                # 写入中途中断留下的不完整项
+                f.truncate(size - size % _ENTRY_SIZE)
+            items.tofile(f)
+            return f.tell() // _ENTRY_SIZE
+
+    def append_and_merge(self, pairs: Iterable[tuple]) -> None:
+        """追加到尾部，尾部过长时并入主体"""
+        if self.append(pairs) >= MERGE_THRESHOLD:
+            self.merge()
+
+    def merge(self) -> int:
+        """把尾部并入主体（主体已有序，timsort 只需排序尾部再归并），返回索引项数"""
+        main = _read_items(self.main)
+        tail = _read_items(self.tail)
+        pairs = list(zip(main[0::2], main[1::2]))
+        pairs.extend(zip(tail[0::2], tail[1::2]))
+        pairs.sort()
+        return self._write_sorted(pairs)
+
+    def lookup(self, key: str) -> list:
+        """可能属于该键的序列号（按序列号递增，可能包含哈希冲突和已删除的消息）"""
+        target = key_hash(key)
+        seqs = set()
+
+        tail = _read_items(self.tail)
+        hashes = tail[0::2]
+        position = 0
+        while True:
+            try:
+                position = hashes.index(target, position)
+            except ValueError:
+                break
+            seqs.add(tail[position * _ENTRY_FIELDS + 1])
+            position += 1
+
+        try:
+            f = open(self.main, "rb")
+        except FileNotFoundError:
+            return sorted(seqs)
+        with f:
+            count = os.fstat(f.fileno()).st_size // _ENTRY_SIZE
+
+            def read_item(position: int) -> array:
+                f.seek(position * _ENTRY_SIZE)
+                item = array(_ENTRY_TYPECODE)
+                item.frombytes(f.read(_ENTRY_SIZE))
+                return item
+
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if read_item(mid)[0] < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            while lo < count:
+                item = read_item(lo)
+                if item[0] != target:
+                    break
+                seqs.add(item[1])
+                lo += 1
+        return sorted(seqs)
+
+
+def by_id() -> HashIndex:
+    """消息ID → 消息的序列号"""
+    return HashIndex(config.MESSAGES_ID_INDEX_FILE, config.MESSAGES_ID_TAIL_FILE)
+
+
+def by_parent() -> HashIndex:
+    """被回复消息的ID → 回复的序列号"""
+    return HashIndex(config.MESSAGES_REPLY_INDEX_FILE, config.MESSAGES_REPLY_TAIL_FILE)
@@ -0,0 +1,1314 @@
+"""
+MCP AI Chat Group - 消息日志存储模块
+
+消息按分片保存为追加写的 JSON Lines 日志，每行一条消息：
+- 私聊分片：messages.jsonl（群组消息以外的全部消息）
+- 群组分片：groups/<群组ID>/messages.jsonl，每个群组一个；分片编号记录在 message_shards.json
+每个分片有自己的偏移索引（.idx），为每一行记录一个 8 字节的字节偏移，
+用于从分片尾部倒序读取而无需解析全部历史。
+
+- 全局序列号目录（messages.seq）：每条消息一项 (seq, 分片内偏移, 标志)，按序列号递增，
+  标志中带有分片编号（格式同收件箱索引，见 mailbox）。全局倒序/顺序读取、按序列号读取
+  都经由目录定位到各分片；目录项写入即代表消息已提交，分片尾部没有进入目录的记录
+  （写入中途崩溃）在下次检查该分片时截掉
+- 群组读取只打开这些群组的分片，不读取其他群组和私聊的消息；
+  已归档的群组可以用 detach_group 把整个分片移出数据目录
+- 发送消息：只追加一行分片日志、一个分片索引项、一个目录项、一个时间索引项和一个ID索引项
+- 修改消息（置顶等）：update_messages 把新版本追加到所在分片的修改记录（messages.patch），
+  读取时按序列号替换日志中的版本，不改写日志；compact_messages 重写全部分片时并入
+- 按ID查找：find_message 由ID索引（见 message_ids）定位序列号，再经目录读取；
+  find_replies 由回复索引取出回复某条消息的全部消息，读取会话串时不扫描群组的其他消息
+- 首次启动：自动把旧的 messages.json 和未分片的旧日志迁移为分片格式
+- 序列号：每条消息带有严格递增的整数 seq，追加时在日志锁内取目录最后一项的 seq + 1；
+  seq 也可作为读者的续读游标
+- 收件箱索引：每次追加同时写入各接收者的索引（见 mailbox），按接收者查询时
+  只读取该接收者的索引项，不扫描其他消息
+- 时间索引（messages.tidx）：写入时把 timestamp 规范化为整数毫秒 timestamp_ms，
+  并与目录逐项对应记录截至该项的最大时间（单调不减），按时间窗口查询时二分查找起点，
+  不需要逐条解析时间字符串；时间无法解析的消息总在时间窗口内，其后的水位为最大值
+
+多个服务器进程共享同一组文件：追加、重建索引、压缩都在 messages.jsonl 的排他锁内进行，
+重写通过临时文件 + rename 完成（见 file_lock）。
+"""
+
+import heapq
+import json
+import os
+import shutil
+from array import array
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from urllib.parse import quote
+
+from .. import config
+from ..utils.time_utils import to_epoch_ms
+from . import mailbox, message_ids
+from .file_lock import atomic_write, file_lock
+
+# 偏移索引项格式（无符号 64 位整数）
+_INDEX_TYPECODE = "Q"
+_INDEX_ITEM_SIZE = array(_INDEX_TYPECODE).itemsize
+
+# 时间索引项格式（有符号 64 位整数，毫秒），与目录逐项对应
+_TIME_INDEX_TYPECODE = "q"
+
+# 时间无法解析的消息在时间索引中的时间：晚于任何时间窗口的起点
+_UNTIMED_MS = 2**63 - 1
+
+# 倒序读取时每次从偏移索引读取的项数
+_REVERSE_READ_BATCH = 1024
+
+# 私聊分片的编号（群组分片从 1 开始编号）
+_PRIVATE_SHARD = 0
+
+
+class _Shard:
+    """一个消息分片：日志文件、偏移索引和修改记录"""
+
+    __slots__ = ("number", "group_id", "log", "index", "patch")
+
+    def __init__(
+        self, number: int, group_id: Optional[str], log: Path, index: Path, patch: Path
+    ) -> None:
+        self.number = number
+        self.group_id = group_id
+        self.log = log
+        self.index = index
+        self.patch = patch
+
+
+class _StaleSnapshot(Exception):
+    """读取期间消息被整体改写（压缩或移出分片），需要在新版本上继续读取"""
+
+
+def _encode_record(message: dict) -> bytes:
+    """把一条消息编码为一行日志"""
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _decode_record(line: bytes) -> Optional[dict]:
+    """解析一行日志，损坏或不完整的行返回None"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def _index_size(index_file: Path) -> int:
+    """返回偏移索引（或时间索引）中的项数"""
+    if not index_file.exists():
+        return 0
+    return index_file.stat().st_size // _INDEX_ITEM_SIZE
+
+
+def _read_index_item(index_file: Path, position: int, typecode: str = _INDEX_TYPECODE) -> int:
+    """读取偏移索引（或时间索引）中第 position 项"""
+    with open(index_file, "rb") as f:
+        f.seek(position * _INDEX_ITEM_SIZE)
+        item = array(typecode)
+        item.frombytes(f.read(_INDEX_ITEM_SIZE))
+        return item[0]
+
+
+def _stamp_time(message: dict) -> None:
+    """补上规范化的毫秒时间戳 timestamp_ms（时间无法解析时为None）"""
+    if "timestamp_ms" not in message:
+        message["timestamp_ms"] = to_epoch_ms(message.get("timestamp"))
+
+
+def _time_of(record: Optional[dict]) -> int:
+    """
+    记录的毫秒时间，用于时间索引（没有 timestamp_ms 的旧记录现场解析）
+
+    时间无法解析的记录返回 _UNTIMED_MS：按时间窗口查询时这些消息总是返回，
+    时间索引的水位在其后保持最大值，窗口起点不会越过它们。
+    """
+    if record is None:
+        return 0
+    timestamp_ms = record.get("timestamp_ms")
+    if not isinstance(timestamp_ms, int):
+        timestamp_ms = to_epoch_ms(record.get("timestamp"))
+    return _UNTIMED_MS if timestamp_ms is None else timestamp_ms
+
+
+# 分片
+_registry_cache: dict = {"signature": None, "groups": {}, "numbers": {}}
+
+
+def _load_registry() -> dict:
+    """群组ID → 分片编号（按文件签名缓存）"""
+    path = config.MESSAGE_SHARDS_FILE
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {}
+    signature = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _registry_cache["signature"] != signature:
+        try:
+            data = json.loads(path.read_bytes())
+        except ValueError:
+            data = {}
+        groups = {
+            group_id: number
+            for group_id, number in (data.items() if isinstance(data, dict) else ())
+            if isinstance(number, int) and number > _PRIVATE_SHARD
+        }
+        _registry_cache.update(
+            signature=signature,
+            groups=groups,
+            numbers={number: group_id for group_id, number in groups.items()},
+        )
+    return _registry_cache["groups"]
+
+
+def _save_registry(groups: dict) -> None:
+    with atomic_write(config.MESSAGE_SHARDS_FILE) as f:
+        f.write(json.dumps(groups, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def _group_shard_dir(group_id: str) -> Path:
+    """群组分片目录（群组ID经过转义，可安全用作目录名）"""
+    name = quote(group_id, safe="")
+    if name in (".", ".."):
+        name = name.replace(".", "%2E")
+    return config.GROUP_SHARDS_DIR / name
+
+
+def _private_shard() -> _Shard:
+    return _Shard(
+        _PRIVATE_SHARD,
+        None,
+        config.MESSAGES_LOG_FILE,
+        config.MESSAGES_INDEX_FILE,
+        config.MESSAGES_PATCH_FILE,
+    )
+
+
+def _group_shard(number: int, group_id: str) -> _Shard:
+    directory = _group_shard_dir(group_id)
+    return _Shard(
+        number,
+        group_id,
+        directory / "messages.jsonl",
+        directory / "messages.idx",
+        directory / "messages.patch",
+    )
+
+
+def _shard_by_number(number: int) -> Optional[_Shard]:
+    """按编号取分片（已移出的分片返回None）"""
+    if number == _PRIVATE_SHARD:
+        return _private_shard()
+    _load_registry()
+    group_id = _registry_cache["numbers"].get(number)
+    return _group_shard(number, group_id) if group_id is not None else None
+
+
+def _shard_of_group(group_id: str) -> Optional[_Shard]:
+    """群组的分片，群组还没有消息时返回None"""
+    number = _load_registry().get(group_id)
+    return _group_shard(number, group_id) if number is not None else None
+
+
+def _all_shards() -> list:
+    return [_private_shard()] + [
+        _group_shard(number, group_id) for group_id, number in _load_registry().items()
+    ]
+
+
+def _sharded_group(message: dict) -> Optional[str]:
+    """消息所属的群组分片（不是群组消息或没有群组ID时为None，存入私聊分片）"""
+    group_id = message.get("group_id")
+    if message.get("type") == "group" and isinstance(group_id, str) and group_id:
+        return group_id
+    return None
+
+
+def _shard_number(registry: dict, group_id: Optional[str]) -> int:
+    """群组的分片编号，没有时在 registry 中分配新编号"""
+    if group_id is None:
+        return _PRIVATE_SHARD
+    number = registry.get(group_id)
+    if number is None:
+        number = registry[group_id] = max(registry.values(), default=_PRIVATE_SHARD) + 1
+    return number
+
+
+def shard_log_files() -> list:
+    """全部分片的日志文件（私聊分片在前）"""
+    return [shard.log for shard in _all_shards()]
+
+
+# 修改记录：每行是一条已修改消息的完整新版本，同一序列号以最后一行为准
+_patch_cache: dict = {}
+
+
+def _load_patches(shard: _Shard) -> dict:
+    """分片的修改记录：seq → 最新版本（按文件签名缓存；没有修改时为空）"""
+    path = shard.patch
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        _patch_cache.pop(path, None)
+        return {}
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _patch_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, "rb") as f:
+        data = f.read(stat.st_size)
+    patches = {}
+    # 只读取完整的行（最后一行可能还在写入）
+    for line in data[: data.rfind(b"\n") + 1].splitlines():
+        record = _decode_record(line)
+        if record is not None and isinstance(record.get("seq"), int):
+            patches[record["seq"]] = record
+    _patch_cache[path] = (signature, patches)
+    return patches
+
+
+# 分片的偏移索引与提交检查
+def _index_is_valid(log_file: Path, index_file: Path) -> bool:
+    """检查偏移索引是否恰好覆盖日志的全部行（只读取最后一个索引项）"""
+    log_size = log_file.stat().st_size if log_file.exists() else 0
+    if index_file.exists() and index_file.stat().st_size % _INDEX_ITEM_SIZE:
+        return False
+    count = _index_size(index_file)
+    if count == 0:
+        return log_size == 0
+    last_offset = _read_index_item(index_file, count - 1)
+    if last_offset >= log_size:
+        return False
+    with open(log_file, "rb") as f:
+        f.seek(last_offset)
+        f.readline()
+        return f.tell() == log_size
+
+
+def _rebuild_shard_index(shard: _Shard) -> int:
+    """扫描分片日志重建偏移索引，返回索引的行数（调用方持有日志的排他锁）"""
+    offsets = array(_INDEX_TYPECODE)
+    if shard.log.exists():
+        with open(shard.log, "rb") as f:
+            offset = 0
+            for line in f:
+                offsets.append(offset)
+                offset += len(line)
+    with atomic_write(shard.index) as f:
+        offsets.tofile(f)
+    return len(offsets)
+
+
+def _directory_position(f, count: int, seq: int) -> int:
+    """
+    第一个序列号不小于 seq 的目录项的位置
+
+    序列号通常与位置一一对应（seq = 位置 + 1），先直接验证，不符时二分查找。
+    """
+    guess = seq - 1
+    if 0 <= guess < count and mailbox.read_entry(f, guess)[0] == seq:
+        return guess
+    return mailbox.position_of(f, count, seq)
+
+
+def _directory_entry(seq: int) -> Optional[tuple]:
+    """序列号对应的目录项 (seq, offset, flags)，不在目录中时返回None"""
+    try:
+        f = open(config.MESSAGES_SEQUENCE_FILE, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        count = mailbox.entry_count(f)
+        position = _directory_position(f, count, seq)
+        if position < count:
+            entry = mailbox.read_entry(f, position)
+            if entry[0] == seq:
+                return entry
+    return None
+
+
+def _tail_is_committed(shard: _Shard) -> bool:
+    """分片最后一条记录是否已进入目录"""
+    count = _index_size(shard.index)
+    if count == 0:
+        return True
+    offset = _read_index_item(shard.index, count - 1)
+    with open(shard.log, "rb") as f:
+        f.seek(offset)
+        record = _decode_record(f.readline())
+    if record is None or not isinstance(record.get("seq"), int):
+        return False
+    entry = _directory_entry(record["seq"])
+    return (
+        entry is not None
+        and entry[1] == offset
+        and mailbox.shard_of(entry[2]) == shard.number
+    )
+
+
+def _shard_is_valid(shard: _Shard) -> bool:
+    return _index_is_valid(shard.log, shard.index) and _tail_is_committed(shard)
+
+
+def _repair_shard(shard: _Shard) -> None:
+    """重建不一致的偏移索引，截掉尾部未提交的记录（调用方持有日志的排他锁）"""
+    if not _index_is_valid(shard.log, shard.index):
+        _rebuild_shard_index(shard)
+    while not _tail_is_committed(shard):
+        count = _index_size(shard.index)
+        offset = _read_index_item(shard.index, count - 1)
+        os.truncate(shard.log, offset)
+        os.truncate(shard.index, (count - 1) * _INDEX_ITEM_SIZE)
+
+
+def _check_shard(shard: _Shard) -> None:
+    """分片的偏移索引与日志不一致、或尾部有未提交的记录时（写入中途崩溃）自动修复"""
+    if not shard.log.exists():
+        return
+    if not _shard_is_valid(shard):
+        with file_lock(config.MESSAGES_LOG_FILE):
+            # 等锁期间可能已被其他进程修复（或写入已完成提交）
+            if not _shard_is_valid(shard):
+                _repair_shard(shard)
+
+
+# 目录与时间索引
+def _directory_is_valid() -> bool:
+    directory = config.MESSAGES_SEQUENCE_FILE
+    size = directory.stat().st_size if directory.exists() else 0
+    return size % mailbox.ENTRY_SIZE == 0 and _index_size(
+        config.MESSAGES_TIME_INDEX_FILE
+    ) == size // mailbox.ENTRY_SIZE
+
+
+def _repair_directory() -> None:
+    """截掉目录和时间索引中未写完的项，时间索引缺项时重建（调用方持有日志的排他锁）"""
+    directory = config.MESSAGES_SEQUENCE_FILE
+    count = mailbox.truncate_partial(directory) if directory.exists() else 0
+    time_index = config.MESSAGES_TIME_INDEX_FILE
+    if _index_size(time_index) > count:
+        os.truncate(time_index, count * _INDEX_ITEM_SIZE)
+    if not _directory_is_valid():
+        rebuild_time_index()
+
+
+def _check_directory() -> None:
+    """目录或时间索引不完整时（写入中途崩溃）自动修复"""
+    if not _directory_is_valid():
+        with file_lock(config.MESSAGES_LOG_FILE):
+            if not _directory_is_valid():
+                _repair_directory()
+
+
+def rebuild_time_index() -> int:
+    """按目录顺序读取消息重建时间索引，返回项数"""
+    with file_lock(config.MESSAGES_LOG_FILE):
+        marks = array(_TIME_INDEX_TYPECODE)
+        high = 0
+        for _, record in _iter_committed(check=False):
+            high = max(high, _time_of(record))
+            marks.append(high)
+        with atomic_write(config.MESSAGES_TIME_INDEX_FILE) as f:
+            marks.tofile(f)
+    return len(marks)
+
+
+class _Snapshot:
+    """
+    一次读取所用的文件
+
+    目录（和收件箱索引）在共享锁内一起打开，属于同一版本；分片日志按需打开，
+    打开时确认目录没有被整体替换，否则抛出 _StaleSnapshot。
+    """
+
+    def __init__(self, stack: ExitStack) -> None:
+        self._stack = stack
+        self.directory = stack.enter_context(open(config.MESSAGES_SEQUENCE_FILE, "rb"))
+        self.count = mailbox.entry_count(self.directory)
+        self.boxes: list = []
+        self._logs: dict = {}
+        self._patches: dict = {}
+
+    def _open_log(self, number: int):
+        with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+            current = os.stat(config.MESSAGES_SEQUENCE_FILE).st_ino
+            if current != os.fstat(self.directory.fileno()).st_ino:
+                raise _StaleSnapshot
+            shard = _shard_by_number(number)
+            if shard is None:
+                return None
+            try:
+                log = self._stack.enter_context(open(shard.log, "rb"))
+            except FileNotFoundError:
+                return None
+            self._patches[number] = _load_patches(shard)
+            return log
+
+    def has_shard(self, flags: int) -> bool:
+        """索引项指向的分片是否存在（已移出的分片返回False）"""
+        number = mailbox.shard_of(flags)
+        if number not in self._logs:
+            self._logs[number] = self._open_log(number)
+        return self._logs[number] is not None
+
+    def read(self, seq: int, offset: int, flags: int) -> Optional[dict]:
+        """读取索引项指向的记录，分片不存在或记录与序列号不符时返回None"""
+        if not self.has_shard(flags):
+            return None
+        number = mailbox.shard_of(flags)
+        f = self._logs[number]
+        f.seek(offset)
+        record = _decode_record(f.readline())
+        if record is None or record.get("seq") != seq:
+            return None
+        return self._patches[number].get(seq, record)
+
+
+@contextmanager
+def _open_snapshot(
+    recipients: Iterable[str] = (), check: bool = True
+) -> Iterator[Optional[_Snapshot]]:
+    """打开目录（和这些接收者的收件箱索引），没有任何消息时为None；check 为False时不检查目录"""
+    ensure_message_log()
+    if not config.MESSAGES_SEQUENCE_FILE.exists():
+        yield None
+        return
+    if check:
+        _check_directory()
+    with ExitStack() as stack:
+        with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+            snapshot = _Snapshot(stack)
+            snapshot.boxes = [
+                stack.enter_context(box)
+                for box in map(mailbox.open_mailbox, dict.fromkeys(recipients))
+                if box is not None
+            ]
+        yield snapshot
+
+
+def _iter_committed(after_seq: int = 0, check: bool = True) -> Iterator[tuple]:
+    """按序列号顺序读取目录中序列号大于 after_seq 的 (目录项, 消息)"""
+    while True:
+        try:
+            with _open_snapshot(check=check) as snapshot:
+                if snapshot is None:
+                    return
+                f = snapshot.directory
+                start = _directory_position(f, snapshot.count, after_seq + 1)
+                for entry in mailbox.iter_entries(f, start, snapshot.count):
+                    record = snapshot.read(*entry)
+                    if record is not None:
+                        after_seq = entry[0]
+                        yield entry, record
+            return
+        except _StaleSnapshot:
+            continue  # 读取期间消息被整体改写：从读到的位置在新版本上继续
+
+
+def _iter_committed_reversed(
+    before_seq: Optional[int] = None, after_seq: int = 0, group_only: bool = False
+) -> Iterator[dict]:
+    """从新到旧读取目录中序列号在 (after_seq, before_seq) 之间的消息"""
+    while True:
+        try:
+            with _open_snapshot() as snapshot:
+                if snapshot is None:
+                    return
+                for entry in mailbox.iter_entries_reversed(snapshot.directory, before_seq):
+                    if entry[0] <= after_seq:
+                        return
+                    if group_only and not entry[2] & mailbox.FLAG_GROUP:
+                        continue
+                    record = snapshot.read(*entry)
+                    if record is not None:
+                        before_seq = entry[0]
+                        yield record
+            return
+        except _StaleSnapshot:
+            continue
+
+
+# 写入与迁移
+def _with_sequences(messages: Iterable[dict]) -> Iterator[dict]:
+    """为缺少序列号的消息（旧数据）按顺序补上 seq"""
+    last_seq = 0
+    for message in messages:
+        seq = message.get("seq")
+        if not isinstance(seq, int) or seq <= last_seq:
+            message["seq"] = last_seq + 1
+        last_seq = message["seq"]
+        yield message
+
+
+def _write_log(messages: Iterable[dict]) -> int:
+    """
+    重写全部分片、偏移索引、目录、时间索引、收件箱索引和ID索引（调用方持有日志的排他锁）
+
+    消息应已包含修改记录中的新版本（load_messages 读到的就是），重写后删除修改记录。
+
+    Returns:
+        写入的消息数量
+    """
+    registry = dict(_load_registry())
+    shards = {_PRIVATE_SHARD: _private_shard()}
+    offsets: dict = {}
+    writers: dict = {}
+    directory = mailbox.new_entries()
+    marks = array(_TIME_INDEX_TYPECODE)
+    boxes: dict = {}
+    ids: list = []
+    replies: list = []
+    high = last_seq = 0
+    with ExitStack() as stack:
+        for message in _with_sequences(messages):
+            _stamp_time(message)
+            group_id = _sharded_group(message)
+            number = _shard_number(registry, group_id)
+            if number not in writers:
+                shard = shards.get(number) or _group_shard(number, group_id)
+                shards[number] = shard
+                writers[number] = [stack.enter_context(atomic_write(shard.log)), 0]
+                offsets[number] = array(_INDEX_TYPECODE)
+            writer = writers[number]
+            record = _encode_record(message)
+            offset = writer[1]
+            writer[0].write(record)
+            writer[1] += len(record)
+            offsets[number].append(offset)
+
+            last_seq = message["seq"]
+            entry = (last_seq, offset, mailbox.message_flags(message, number))
+            directory.extend(entry)
+            high = max(high, _time_of(message))
+            marks.append(high)
+            for recipient in dict.fromkeys(message.get("recipients", [])):
+                boxes.setdefault(recipient, []).append(entry)
+            _collect_keys(message, last_seq, ids, replies)
+
+        # 没有消息的分片（包括以前有消息的群组）写为空分片
+        for group_id, number in registry.items():
+            shards.setdefault(number, _group_shard(number, group_id))
+        for number, shard in shards.items():
+            if number not in writers:
+                writers[number] = [stack.enter_context(atomic_write(shard.log)), 0]
+                offsets[number] = array(_INDEX_TYPECODE)
+
+    for number, shard in shards.items():
+        with atomic_write(shard.index) as f:
+            offsets[number].tofile(f)
+        # 新日志已包含修改后的版本（中途中断时重复应用同样的版本，结果不变）
+        shard.patch.unlink(missing_ok=True)
+    _save_registry(registry)
+    with atomic_write(config.MESSAGES_TIME_INDEX_FILE) as f:
+        marks.tofile(f)
+    mailbox.write_entries(config.MESSAGES_SEQUENCE_FILE, directory)
+    mailbox.write_all(boxes, last_seq)
+    message_ids.by_id().write(ids)
+    message_ids.by_parent().write(replies)
+    return len(marks)
+
+
+def _load_from_shards() -> list:
+    """
+    直接读取全部分片日志中的消息（目录缺失时使用），按序列号排序
+
+    未分片的旧日志中群组消息也在私聊分片里，没有序列号的旧记录保持写入顺序。
+    """
+    messages = [record for _, record in _iter_log_forward(_private_shard())]
+    group_messages = [
+        record
+        for shard in _all_shards()[1:]
+        for _, record in _iter_log_forward(shard)
+    ]
+    if group_messages:
+        messages = sorted(
+            messages + group_messages,
+            key=lambda m: m["seq"] if isinstance(m.get("seq"), int) else 0,
+        )
+    return messages
+
+
+def migrate_legacy_messages() -> int:
+    """
+    把旧的 messages.json 迁移为消息日志
+
+    只在日志尚不存在时执行，迁移后旧文件重命名为 messages.json.migrated。
+
+    Returns:
+        迁移的消息数量
+    """
+    legacy_file = config.MESSAGES_FILE
+    if config.MESSAGES_LOG_FILE.exists() or not legacy_file.exists():
+        return 0
+
+    with file_lock(config.MESSAGES_LOG_FILE):
+        # 等锁期间可能已被其他进程迁移
+        if config.MESSAGES_LOG_FILE.exists() or not legacy_file.exists():
+            return 0
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                messages = json.load(f)
+        except Exception:
+            messages = []
+        if not isinstance(messages, list):
+            messages = []
+
+        _write_log([m for m in messages if isinstance(m, dict)])
+        legacy_file.replace(legacy_file.with_name(legacy_file.name + ".migrated"))
+    return len(messages)
+
+
+# 已完成迁移检查的日志路径
+_checked_logs: set = set()
+
+
+def ensure_message_log() -> None:
+    """
+    确保消息日志可用（每个日志路径首次使用时执行一次）
+
+    迁移旧的 messages.json；没有目录时（未分片的旧日志，或目录丢失）由分片日志重写全部数据，
+    同时补齐序列号和毫秒时间戳；否则补齐收件箱索引，ID索引或回复索引不存在时建立。
+    """
+    log_file = config.MESSAGES_LOG_FILE
+    if log_file in _checked_logs:
+        return
+    migrate_legacy_messages()
+    _checked_logs.add(log_file)
+    with file_lock(log_file):
+        if config.MESSAGES_SEQUENCE_FILE.exists():
+            _check_directory()
+            if not (message_ids.by_id().exists() and message_ids.by_parent().exists()):
+                rebuild_id_indexes()
+            _sync_mailboxes()
+        elif any(shard.log.exists() for shard in _all_shards()):
+            _write_log(_load_from_shards())
+
+
+# 读取
+def _sequence_high_water() -> int:
+    """移出分片时记录的已分配过的最大序列号（从未移出过分片时为0）"""
+    try:
+        text = config.MESSAGES_SEQUENCE_HIGH_FILE.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return 0
+    return int(text) if text.isdigit() else 0
+
+
+def last_sequence() -> int:
+    """
+    最近分配的消息序列号（没有消息时为0）
+
+    通常是目录最后一项的序列号；移出的分片中有更新的消息时，取移出前记录的最大值，
+    序列号不会因移出分片而回退（否则新消息会重用已分配过的序列号，被已读水位等误判）。
+    """
+    high = _sequence_high_water()
+    with _open_snapshot() as snapshot:
+        if snapshot is None or snapshot.count == 0:
+            return high
+        return max(high, mailbox.read_entry(snapshot.directory, snapshot.count - 1)[0])
+
+
+def count_messages() -> int:
+    """返回消息条数（读取目录大小，不解析日志）"""
+    with _open_snapshot() as snapshot:
+        return snapshot.count if snapshot is not None else 0
+
+
+def load_messages() -> list:
+    """按序列号顺序读取全部消息"""
+    return [record for _, record in _iter_committed()]
+
+
+def _iter_log_forward(shard: _Shard) -> Iterator[tuple]:
+    """按写入顺序读取分片日志中的 (偏移, 消息)"""
+    if not shard.log.exists():
+        return
+    patches = _load_patches(shard)
+    with open(shard.log, "rb") as f:
+        offset = 0
+        for line in f:
+            record = _decode_record(line)
+            if record is not None:
+                yield offset, patches.get(record.get("seq"), record)
+            offset += len(line)
+
+
+def iter_messages_reversed(
+    before_seq: Optional[int] = None, after_seq: int = 0, group_only: bool = False
+) -> Iterator[dict]:
+    """
+    从最新到最旧逐条读取全部消息
+
+    借助目录从尾部向前定位到各分片中的记录，调用方取够数量后即可停止，
+    不需要解析全部历史。
+
+    Args:
+        before_seq: 只读取序列号小于该值的消息（二分查找起点，用于分页续读）
+        after_seq: 读到序列号不大于该值的消息时停止
+        group_only: 只读取群组消息（按目录项的标志跳过私聊消息，不读取其记录）
+    """
+    return _iter_committed_reversed(before_seq, after_seq, group_only)
+
+
+def iter_private_messages_reversed(before_seq: Optional[int] = None) -> Iterator[dict]:
+    """从最新到最旧读取私聊分片中的消息（不读取任何群组分片）"""
+    ensure_message_log()
+    return _iter_shard_reversed(_private_shard(), before_seq)
+
+
+def iter_group_messages_reversed(
+    group_ids: Iterable[str], before_seq: Optional[int] = None
+) -> Iterator[dict]:
+    """
+    从最新到最旧读取这些群组的消息
+
+    只打开这些群组的分片，多个群组按序列号归并；不读取其他群组和私聊的消息。
+    """
+    ensure_message_log()
+    shards = [
+        shard for shard in map(_shard_of_group, dict.fromkeys(group_ids)) if shard is not None
+    ]
+    if len(shards) == 1:
+        return _iter_shard_reversed(shards[0], before_seq)
+    return heapq.merge(
+        *(_iter_shard_reversed(shard, before_seq) for shard in shards),
+        key=lambda record: record.get("seq", 0),
+        reverse=True,
+    )
+
+
+def _iter_shard_reversed(shard: _Shard, before_seq: Optional[int] = None) -> Iterator[dict]:
+    """从最新到最旧读取一个分片中的消息，before_seq 同 iter_messages_reversed"""
+    if not shard.log.exists():
+        return
+    _check_shard(shard)
+    # 在共享锁内同时打开索引和日志，保证二者属于同一版本（压缩会整体替换文件）
+    with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+        try:
+            idx = open(shard.index, "rb")
+        except FileNotFoundError:
+            return  # 分片已被移出
+        f = open(shard.log, "rb")
+        end = os.fstat(idx.fileno()).st_size // _INDEX_ITEM_SIZE
+        patches = _load_patches(shard)
+    with idx, f:
+        if before_seq is not None:
+            end = _find_position(idx, f, end, before_seq)
+        while end > 0:
+            start = max(0, end - _REVERSE_READ_BATCH)
+            idx.seek(start * _INDEX_ITEM_SIZE)
+            offsets = array(_INDEX_TYPECODE)
+            offsets.frombytes(idx.read((end - start) * _INDEX_ITEM_SIZE))
+            for offset in reversed(offsets):
+                f.seek(offset)
+                record = _decode_record(f.readline())
+                if record is not None:
+                    yield patches.get(record.get("seq"), record)
+            end = start
+
+
+def _record_at(idx, f, position: int) -> Optional[dict]:
+    """读取偏移索引第 position 项指向的记录"""
+    idx.seek(position * _INDEX_ITEM_SIZE)
+    item = array(_INDEX_TYPECODE)
+    item.frombytes(idx.read(_INDEX_ITEM_SIZE))
+    f.seek(item[0])
+    return _decode_record(f.readline())
+
+
+def _find_position(idx, f, count: int, seq: int) -> int:
+    """第一条序列号不小于 seq 的记录在分片偏移索引中的位置（分片内序列号递增，二分查找）"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        record = _record_at(idx, f, mid)
+        if record is None or record.get("seq", 0) < seq:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def iter_messages_after(after_seq: int) -> Iterator[dict]:
+    """按序列号顺序读取序列号大于 after_seq 的消息（在目录上定位起点后顺序读取）"""
+    for _, record in _iter_committed(after_seq):
+        yield record
+
+
+def last_sequence_before(timestamp_ms: int) -> int:
+    """
+    在时间索引上二分查找时间窗口的起点
+
+    Returns:
+        序列号 S：序列号不大于 S 的消息，时间都早于 timestamp_ms
+        （可直接作为 after_seq 使用，之后的消息仍需逐条比较 timestamp_ms）
+    """
+    ensure_message_log()
+    if not config.MESSAGES_SEQUENCE_FILE.exists():
+        return 0
+    _check_directory()
+    with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+        marks = open(config.MESSAGES_TIME_INDEX_FILE, "rb")
+        directory = open(config.MESSAGES_SEQUENCE_FILE, "rb")
+    with marks, directory:
+        count = min(
+            mailbox.entry_count(directory),
+            os.fstat(marks.fileno()).st_size // _INDEX_ITEM_SIZE,
+        )
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            marks.seek(mid * _INDEX_ITEM_SIZE)
+            item = array(_TIME_INDEX_TYPECODE)
+            item.frombytes(marks.read(_INDEX_ITEM_SIZE))
+            if item[0] < timestamp_ms:
+                lo = mid + 1
+            else:
+                hi = mid
+        # 位置 lo 之前的时间水位都早于 timestamp_ms
+        return mailbox.read_entry(directory, lo - 1)[0] if lo else 0
+
+
+def iter_messages_by_seq(seqs: Iterable[int]) -> Iterator[dict]:
+    """按给定顺序读取这些序列号的消息（不存在的序列号跳过）"""
+    pending = iter(seqs)
+    seq = None
+    while True:
+        try:
+            with _open_snapshot() as snapshot:
+                if snapshot is None:
+                    return
+                f, count = snapshot.directory, snapshot.count
+                while True:
+                    if seq is None:
+                        seq = next(pending, None)
+                        if seq is None:
+                            return
+                    position = _directory_position(f, count, seq)
+                    if position < count:
+                        entry = mailbox.read_entry(f, position)
+                        record = snapshot.read(*entry) if entry[0] == seq else None
+                        if record is not None:
+                            yield record
+                    seq = None
+        except _StaleSnapshot:
+            continue
+
+
+# 收件箱索引
+def rebuild_mailboxes() -> int:
+    """
+    按目录读取全部消息重建收件箱索引
+
+    Returns:
+        建立索引的消息数量
+    """
+    ensure_message_log()
+    with file_lock(config.MESSAGES_LOG_FILE):
+        entries: dict = {}
+        count = last_seq = 0
+        for entry, message in _iter_committed():
+            count += 1
+            last_seq = entry[0]
+            for recipient in dict.fromkeys(message.get("recipients", [])):
+                entries.setdefault(recipient, []).append(entry)
+        mailbox.write_all(entries, last_seq)
+    return count
+
+
+def _sync_mailboxes() -> None:
+    """
+    补齐收件箱索引、ID索引和回复索引（调用方持有日志的排他锁）
+
+    写入中途中断时，目录中可能有尚未进入收件箱索引的消息：
+    取出序列号高于水位的消息补写索引（ID和回复索引项在水位之前写入，可能重复，查找时去重）；
+    收件箱索引从未建立时整体重建。
+    """
+    watermark = mailbox.read_watermark()
+    if watermark is None:
+        rebuild_mailboxes()
+        return
+    last_seq = None
+    ids: list = []
+    replies: list = []
+    for entry, message in _iter_committed(watermark):
+        seq = entry[0]
+        recipients = [
+            r for r in message.get("recipients", []) if mailbox.last_entry_seq(r) < seq
+        ]
+        mailbox.append_entry(recipients, *entry)
+        _collect_keys(message, seq, ids, replies)
+        last_seq = seq
+    if ids:
+        message_ids.by_id().append(ids)
+    if replies:
+        message_ids.by_parent().append(replies)
+    if last_seq is not None:
+        mailbox.write_watermark(last_seq)
+
+
+def _collect_keys(message: dict, seq: int, ids: list, replies: list) -> None:
+    """把消息的ID索引项和回复索引项加入列表"""
+    if message.get("id") is not None:
+        ids.append((message["id"], seq))
+    if message.get("reply_to"):
+        replies.append((message["reply_to"], seq))
+
+
+def rebuild_id_indexes() -> int:
+    """按目录读取全部消息重建ID索引和回复索引，返回索引的消息数量"""
+    with file_lock(config.MESSAGES_LOG_FILE):
+        ids: list = []
+        replies: list = []
+        for entry, record in _iter_committed():
+            _collect_keys(record, entry[0], ids, replies)
+        message_ids.by_parent().write(replies)
+        return message_ids.by_id().write(ids)
+
+
+def check_mailboxes() -> dict:
+    """
+    检查收件箱索引与目录是否一致
+
+    Returns:
+        检查结果：ok、消息数、缺失/多余的索引项数、水位与最新序列号
+    """
+    ensure_message_log()
+    expected: dict = {}
+    count = last_seq = 0
+    with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+        for entry, message in _iter_committed():
+            count += 1
+            last_seq = entry[0]
+            for recipient in dict.fromkeys(message.get("recipients", [])):
+                expected.setdefault(mailbox.mailbox_file(recipient).name, []).append(entry)
+        actual = mailbox.read_all()
+        watermark = mailbox.read_watermark()
+    missing = extra = 0
+    for name in expected.keys() | actual.keys():
+        want = set(expected.get(name, []))
+        have = set(actual.get(name, []))
+        missing += len(want - have)
+        extra += len(have - want)
+    return {
+        "ok": missing == 0 and extra == 0 and watermark == last_seq,
+        "messages": count,
+        "missing": missing,
+        "extra": extra,
+        "watermark": watermark,
+        "last_seq": last_seq,
+    }
+
+
+def _merge_entries(boxes: list, before_seq: Optional[int] = None) -> Iterator[tuple]:
+    """合并多个收件箱的索引项，按序列号从新到旧，同一条消息只出现一次"""
+    entries = heapq.merge(
+        *(mailbox.iter_entries_reversed(box, before_seq) for box in boxes),
+        key=itemgetter(0),
+        reverse=True,
+    )
+    last_seq = None
+    for entry in entries:
+        if entry[0] != last_seq:
+            last_seq = entry[0]
+            yield entry
+
+
+def _prepare_mailboxes() -> bool:
+    """读取收件箱索引前补齐缺口，没有任何消息时返回False"""
+    ensure_message_log()
+    if not config.MESSAGES_SEQUENCE_FILE.exists():
+        return False
+    if (mailbox.read_watermark() or 0) < last_sequence():
+        with file_lock(config.MESSAGES_LOG_FILE):
+            _sync_mailboxes()
+    return True
+
+
+def iter_mailbox_seqs_reversed(
+    recipients: Iterable[str], after_seq: int = 0
+) -> Iterator[int]:
+    """只读取收件箱索引，从新到旧返回发给任一接收者、序列号大于 after_seq 的消息序列号"""
+    if not _prepare_mailboxes():
+        return
+    with ExitStack() as stack:
+        with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+            boxes = [
+                stack.enter_context(box)
+                for box in map(mailbox.open_mailbox, dict.fromkeys(recipients))
+                if box is not None
+            ]
+        for seq, _, _ in _merge_entries(boxes):
+            if seq <= after_seq:
+                return
+            yield seq
+
+
+def iter_mailbox_reversed(
+    recipients: Iterable[str],
+    msg_type: Optional[str] = None,
+    before_seq: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    按收件箱索引读取发给任一接收者的消息，最新的在前
+
+    Args:
+        recipients: 接收者列表
+        msg_type: 消息类型（"private" 或 "group"），按索引标志过滤，不读取不相关的消息
+        before_seq: 只读取序列号小于该值的消息（在各收件箱索引上二分查找起点）
+    """
+    if not _prepare_mailboxes():
+        return
+    recipients = list(recipients)
+    want_group = None if msg_type is None else msg_type == "group"
+    while True:
+        try:
+            with _open_snapshot(recipients) as snapshot:
+                if snapshot is None:
+                    return
+                for seq, offset, flags in _merge_entries(snapshot.boxes, before_seq):
+                    if want_group is not None and bool(flags & mailbox.FLAG_GROUP) != want_group:
+                        continue
+                    if not snapshot.has_shard(flags):
+                        continue  # 分片已被移出
+                    record = snapshot.read(seq, offset, flags)
+                    if record is None:
+                        break  # 索引与日志不一致，改为重建后扫描
+                    before_seq = seq
+                    yield record
+                else:
+                    return
+            break
+        except _StaleSnapshot:
+            continue
+
+    rebuild_mailboxes()
+    wanted = set(recipients)
+    for record in iter_messages_reversed(before_seq):
+        if want_group is not None and (record.get("type", "private") == "group") != want_group:
+            continue
+        if not wanted.isdisjoint(record.get("recipients", [])):
+            yield record
+
+
+def append_message(message: dict) -> dict:
+    """
+    追加一条消息到所属分片
+
+    在日志锁内分配序列号 seq（写入 message），未提供 id 时生成
+    "<时间戳>_<seq>" 格式的消息ID；补上毫秒时间戳 timestamp_ms。
+    依次追加分片日志、分片偏移索引、时间索引项和目录项（写入目录即提交），
+    最后写入ID索引、回复索引和收件箱索引。
+
+    Args:
+        message: 消息字典
+
+    Returns:
+        写入的消息
+    """
+    ensure_message_log()
+    log_file = config.MESSAGES_LOG_FILE
+
+    with file_lock(log_file):
+        _check_directory()
+        seq = last_sequence() + 1
+        if mailbox.read_watermark() != seq - 1:
+            _sync_mailboxes()
+        message["seq"] = seq
+        if not message.get("id"):
+            timestamp = message.get("timestamp") or datetime.now().isoformat()
+            message["id"] = f"{timestamp}_{seq}"
+        _stamp_time(message)
+
+        group_id = _sharded_group(message)
+        registry = _load_registry()
+        if group_id is not None and group_id not in registry:
+            registry = dict(registry)
+            _shard_number(registry, group_id)
+            _save_registry(registry)
+        number = registry.get(group_id, _PRIVATE_SHARD)
+        shard = _shard_by_number(number)
+        _check_shard(shard)
+
+        record = _encode_record(message)
+        shard.log.parent.mkdir(parents=True, exist_ok=True)
+        with open(shard.log, "ab+") as f:
+            offset = f.tell()
+            if offset > 0:
+                # 上次写入中途中断留下的半行：先补换行，避免与新记录粘连
+                f.seek(offset - 1)
+                if f.read(1) != b"\n":
+                    record = b"\n" + record
+                    offset += 1
+            f.write(record)
+        with open(shard.index, "ab") as f:
+            array(_INDEX_TYPECODE, [offset]).tofile(f)
+
+        time_index = config.MESSAGES_TIME_INDEX_FILE
+        count = _index_size(time_index)
+        high = max(
+            _read_index_item(time_index, count - 1, _TIME_INDEX_TYPECODE) if count else 0,
+            _time_of(message),
+        )
+        with open(time_index, "ab") as f:
+            array(_TIME_INDEX_TYPECODE, [high]).tofile(f)
+        entry = (seq, offset, mailbox.message_flags(message, number))
+        mailbox.append_to(config.MESSAGES_SEQUENCE_FILE, entry)
+
+        ids: list = []
+        replies: list = []
+        _collect_keys(message, seq, ids, replies)
+        message_ids.by_id().append_and_merge(ids)
+        if replies:
+            message_ids.by_parent().append_and_merge(replies)
+        mailbox.append_entry(message.get("recipients", []), *entry)
+        mailbox.write_watermark(seq)
+    return message
+
+
+def find_message(message_id: str) -> Optional[dict]:
+    """按ID查找消息（由ID索引定位序列号；同一ID有多条消息时返回最新的）"""
+    if not _prepare_mailboxes():
+        return None
+    with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+        seqs = message_ids.by_id().lookup(message_id)
+    for record in iter_messages_by_seq(reversed(seqs)):
+        if record.get("id") == message_id:
+            return record
+    return None
+
+
+def find_replies(message_id: str) -> list:
+    """回复该消息的全部消息（由回复索引定位，按序列号顺序）"""
+    if not _prepare_mailboxes():
+        return []
+    with file_lock(config.MESSAGES_LOG_FILE, exclusive=False):
+        seqs = message_ids.by_parent().lookup(message_id)
+    return [
+        record for record in iter_messages_by_seq(seqs) if record.get("reply_to") == message_id
+    ]
+
+
+# 修改消息时必须保持不变的字段（决定消息所在的分片以及各索引中的项）
+_INDEXED_FIELDS = ("id", "type", "group_id", "recipients", "timestamp_ms", "reply_to")
+
+
+def update_messages(messages: Iterable[dict]) -> list:
+    """
+    原地修改已有消息：把新版本追加到所在分片的修改记录，不改写日志
+
+    按 seq 定位消息，读取时以修改记录中的最新版本为准。
+
+    Args:
+        messages: 修改后的完整消息（带有原来的 seq）
+
+    Returns:
+        不能原地修改的消息（不存在，或改动了ID、类型、群组、接收者、时间、回复对象），由调用方通过
+        compact_messages 整体重写
+    """
+    ensure_message_log()
+    rejected = []
+    lines: dict = {}
+    with file_lock(config.MESSAGES_LOG_FILE):
+        with _open_snapshot() as snapshot:
+            if snapshot is None:
+                return list(messages)
+            for message in messages:
+                seq = message.get("seq")
+                entry = None
+                if isinstance(seq, int):
+                    position = _directory_position(snapshot.directory, snapshot.count, seq)
+                    if position < snapshot.count:
+                        entry = mailbox.read_entry(snapshot.directory, position)
+                current = snapshot.read(*entry) if entry and entry[0] == seq else None
+                if current is None or any(
+                    current.get(field) != message.get(field) for field in _INDEXED_FIELDS
+                ):
+                    rejected.append(message)
+                    continue
+                shard = _shard_by_number(mailbox.shard_of(entry[2]))
+                lines.setdefault(shard.patch, []).append(_encode_record(message))
+        for path, records in lines.items():
+            with open(path, "ab+") as f:
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        records.insert(0, b"\n")
+                f.write(b"".join(records))
+    return rejected
+
+
+def compact_messages(messages: Optional[Iterable[dict]] = None) -> int:
+    """
+    压缩消息日志：丢弃损坏的行，重写全部分片并重建索引
+
+    Args:
+        messages: 要写入的完整消息（按序列号顺序，可以是迭代器）；为None时使用现有消息
+
+    Returns:
+        压缩后的消息数量
+    """
+    ensure_message_log()
+    with file_lock(config.MESSAGES_LOG_FILE):
+        if messages is None:
+            messages = load_messages()
+        return _write_log(messages)
+
+
+def detach_group(group_id: str, destination: Path) -> int:
+    """
+    把群组的分片整体移出数据目录（用于已归档的群组）
+
+    先记录当前的最大序列号（之后分配的序列号不会回退），分片目录移动到
+    destination/<群组ID>/ 后，再从目录、时间索引和收件箱索引中删除指向它的项；
+    中途中断时指向已移走分片的项在读取时跳过，重新执行即可完成。
+
+    Returns:
+        移出的消息数量
+    """
+    ensure_message_log()
+    with file_lock(config.MESSAGES_LOG_FILE):
+        registry = dict(_load_registry())
+        number = registry.get(group_id)
+        if number is None:
+            return 0
+        with atomic_write(config.MESSAGES_SEQUENCE_HIGH_FILE) as f:
+            f.write(str(last_sequence()).encode("utf-8"))
+        source = _group_shard_dir(group_id)
+        if source.exists():
+            target = Path(destination) / source.name
+            if target.exists():
+                raise FileExistsError(str(target))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(source), str(target))
+
+        _check_directory()
+        kept = mailbox.new_entries()
+        kept_marks = array(_TIME_INDEX_TYPECODE)
+        removed = 0
+        with open(config.MESSAGES_SEQUENCE_FILE, "rb") as f, open(
+            config.MESSAGES_TIME_INDEX_FILE, "rb"
+        ) as marks_file:
+            marks = array(_TIME_INDEX_TYPECODE)
+            marks.frombytes(marks_file.read())
+            for position, entry in enumerate(mailbox.iter_entries(f, 0, mailbox.entry_count(f))):
+                if mailbox.shard_of(entry[2]) == number:
+                    removed += 1
+                    continue
+                kept.extend(entry)
+                # 去掉部分项后水位仍单调不减，且不小于剩余消息的实际时间，二分查找依然正确
+                kept_marks.append(marks[position])
+        with atomic_write(config.MESSAGES_TIME_INDEX_FILE) as f:
+            kept_marks.tofile(f)
+        mailbox.write_entries(config.MESSAGES_SEQUENCE_FILE, kept)
+        mailbox.drop_entries(number)
+        del registry[group_id]
+        _save_registry(registry)
+    return removed
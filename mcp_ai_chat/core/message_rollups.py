@@ -0,0 +1,116 @@
+"""
+MCP AI Chat Group - 群组消息统计汇总模块
+
+按时间桶汇总每个群组的消息统计（按发送者、话题、重要性的消息数和被@的次数），
+summarize_group_messages 合并时间窗口内的桶，不再逐条读取窗口内的消息：
+- 最近 HOURLY_DAYS 天的消息按小时分桶，更早的合并为按天（UTC）的桶；
+  同一天只会有小时桶或天桶中的一种，桶之间不重叠
+- 每个桶记录其中消息的序列号范围 min_seq..max_seq；窗口起点落在某个桶中间时，
+  调用方只需按序列号读取该范围内的消息，计入该桶中不早于起点的那些
+
+汇总结构：{"hours": {桶起点毫秒: 桶}, "days": {桶起点毫秒: 桶}}（键为字符串，便于保存为JSON），
+桶：{"count": n, "senders": {...}, "topics": {...}, "importance": {...}, "mentions": {...},
+"min_seq": n, "max_seq": n}
+
+本模块只处理汇总数据本身，补计新消息和保存见 storage。
+"""
+
+from typing import Optional
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+# 保留小时桶的天数，更早的合并为天桶
+HOURLY_DAYS = 2
+
+# 按键计数的统计项
+_COUNTED_FIELDS = ("senders", "topics", "importance", "mentions")
+
+
+def empty_stats() -> dict:
+    """空的统计"""
+    return {"count": 0, **{field: {} for field in _COUNTED_FIELDS}}
+
+
+def _empty_bucket() -> dict:
+    return {**empty_stats(), "min_seq": 0, "max_seq": 0}
+
+
+def _extend_seq_range(bucket: dict, min_seq: int, max_seq: int) -> None:
+    """在计入新消息之前扩展桶的序列号范围"""
+    if not bucket["count"]:
+        bucket["min_seq"], bucket["max_seq"] = min_seq, max_seq
+    else:
+        bucket["min_seq"] = min(bucket["min_seq"], min_seq)
+        bucket["max_seq"] = max(bucket["max_seq"], max_seq)
+
+
+def _bump(counts: dict, key: str, n: int = 1) -> None:
+    counts[key] = counts.get(key, 0) + n
+
+
+def add_message(stats: dict, message: dict) -> None:
+    """把一条消息计入统计"""
+    stats["count"] += 1
+    _bump(stats["senders"], message.get("sender", "未知"))
+    if message.get("topic"):
+        _bump(stats["topics"], message["topic"])
+    _bump(stats["importance"], message.get("importance") or "normal")
+    for agent in message.get("mentions", []):
+        _bump(stats["mentions"], agent)
+
+
+def merge(stats: dict, other: dict) -> None:
+    """把另一份统计（或桶）合并进 stats"""
+    stats["count"] += other["count"]
+    for field in _COUNTED_FIELDS:
+        for key, n in other[field].items():
+            _bump(stats[field], key, n)
+
+
+def empty_rollup() -> dict:
+    """没有消息的群组的汇总"""
+    return {"hours": {}, "days": {}}
+
+
+def fold(rollup: dict, message: dict, timestamp_ms: int) -> None:
+    """把一条消息计入群组汇总中所在的桶"""
+    day = str(timestamp_ms - timestamp_ms % DAY_MS)
+    if day in rollup["days"]:
+        bucket = rollup["days"][day]
+    else:
+        hour = str(timestamp_ms - timestamp_ms % HOUR_MS)
+        bucket = rollup["hours"].setdefault(hour, _empty_bucket())
+    _extend_seq_range(bucket, message.get("seq", 0), message.get("seq", 0))
+    add_message(bucket, message)
+
+
+def compact(rollup: dict, now_ms: int) -> None:
+    """把 HOURLY_DAYS 天之前（按整天）的小时桶合并为天桶"""
+    cutoff = now_ms - now_ms % DAY_MS - HOURLY_DAYS * DAY_MS
+    for start in [s for s in rollup["hours"] if int(s) < cutoff]:
+        bucket = rollup["hours"].pop(start)
+        day_start = int(start) - int(start) % DAY_MS
+        day = rollup["days"].setdefault(str(day_start), _empty_bucket())
+        _extend_seq_range(day, bucket["min_seq"], bucket["max_seq"])
+        merge(day, bucket)
+
+
+def window(rollup: dict, since_ms: int) -> tuple[dict, Optional[tuple]]:
+    """
+    合并起点不早于 since_ms 的桶
+
+    Returns:
+        (统计, 跨越 since_ms 的桶的 (终点毫秒, min_seq, max_seq)，没有时为None)；
+        该桶中不早于 since_ms 的消息由调用方逐条计入
+    """
+    stats = empty_stats()
+    head = None
+    for buckets, span in ((rollup["hours"], HOUR_MS), (rollup["days"], DAY_MS)):
+        for start, bucket in buckets.items():
+            start_ms = int(start)
+            if start_ms >= since_ms:
+                merge(stats, bucket)
+            elif start_ms + span > since_ms:
+                head = (start_ms + span, bucket["min_seq"], bucket["max_seq"])
+    return stats, head
@@ -0,0 +1,232 @@
+"""
+MCP AI Chat Group - 工具调用指标模块
+
+handle_tool_call 对每次工具调用记录（仅本服务器进程，重启后清零）：
+- 调用次数、错误次数（抛出异常或返回"错误"开头的结果）
+- 延迟直方图（Prometheus 风格的累计分桶）、总耗时和最大耗时
+- 输出字符数
+- 读写字节数：处理器在 I/O 线程池中执行期间本线程的 rchar/wchar 增量
+  （/proc/thread-self/io，包括存储文件、SQLite 和通知套接字；非 Linux 平台不统计）
+
+get_server_metrics 工具展示这些指标；设置 MCP_AI_CHAT_METRICS_TEXTFILE=1 时还会定期以
+Prometheus 文本格式写入 METRICS_DIR，供 node-exporter 的 textfile collector 采集。
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from .. import config
+from .file_lock import atomic_write
+
+# 延迟直方图的分桶上界（秒），最后隐含 +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_ERROR_PREFIXES = ("错误", "❌")
+
+_lock = threading.Lock()
+_tools: dict = {}
+_started_at = time.time()
+_last_textfile_write = 0.0
+
+# 当前正在执行的工具调用（run_io 把上下文带到 I/O 线程，读写字节计入该调用）
+_current_call: contextvars.ContextVar = contextvars.ContextVar("mcp_ai_chat_tool_call", default=None)
+
+
+class _Call:
+    """一次工具调用的统计"""
+
+    def __init__(self) -> None:
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.output_chars = 0
+        self.error = False
+
+
+def _new_stats() -> dict:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "seconds_total": 0.0,
+        "seconds_max": 0.0,
+        "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+        "output_chars": 0,
+        "bytes_read": 0,
+        "bytes_written": 0,
+    }
+
+
+def _thread_io() -> Optional[tuple]:
+    """当前线程累计读写的字节数 (rchar, wchar)，不可用时返回None"""
+    try:
+        with open("/proc/thread-self/io", "rb") as f:
+            values = dict(line.split(b":", 1) for line in f if b":" in line)
+        return int(values[b"rchar"]), int(values[b"wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def call_with_io_tracking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """执行阻塞函数，把本线程在执行期间读写的字节数计入当前工具调用"""
+    call = _current_call.get()
+    before = _thread_io() if call is not None else None
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if before is not None:
+            after = _thread_io()
+            if after is not None:
+                call.bytes_read += after[0] - before[0]
+                call.bytes_written += after[1] - before[1]
+
+
+def is_error_result(contents: Any) -> bool:
+    """处理器返回的结果是否为错误信息"""
+    try:
+        first = contents[0].text
+    except (IndexError, AttributeError, TypeError):
+        return False
+    return first.lstrip().startswith(_ERROR_PREFIXES)
+
+
+@contextmanager
+def track_call(tool: str) -> Iterator[_Call]:
+    """
+    统计一次工具调用：计时、记录读写字节数，结束后计入该工具的指标
+
+    调用方设置 call.output_chars 和 call.error；块内抛出异常时计为错误。
+    """
+    call = _Call()
+    token = _current_call.set(call)
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.error = True
+        raise
+    finally:
+        _current_call.reset(token)
+        _record(tool, time.perf_counter() - started, call)
+
+
+def _record(tool: str, seconds: float, call: _Call) -> None:
+    with _lock:
+        stats = _tools.get(tool)
+        if stats is None:
+            stats = _tools[tool] = _new_stats()
+        stats["calls"] += 1
+        stats["errors"] += int(call.error)
+        stats["seconds_total"] += seconds
+        stats["seconds_max"] = max(stats["seconds_max"], seconds)
+        bucket = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+            len(LATENCY_BUCKETS),
+        )
+        stats["buckets"][bucket] += 1
+        stats["output_chars"] += call.output_chars
+        stats["bytes_read"] += call.bytes_read
+        stats["bytes_written"] += call.bytes_written
+
+
+def snapshot() -> dict:
+    """全部工具指标的副本：工具名 → 统计"""
+    with _lock:
+        return {
+            tool: {**stats, "buckets": list(stats["buckets"])} for tool, stats in _tools.items()
+        }
+
+
+def uptime_seconds() -> float:
+    return time.time() - _started_at
+
+
+def reset() -> None:
+    """清空全部指标"""
+    global _started_at
+    with _lock:
+        _tools.clear()
+        _started_at = time.time()
+
+
+def quantile(stats: dict, fraction: float) -> Optional[float]:
+    """由直方图估计分位数：返回所在分桶的上界（秒），落在 +Inf 桶时返回最大耗时"""
+    if not stats["calls"]:
+        return None
+    rank = fraction * stats["calls"]
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+        seen += count
+        if seen >= rank:
+            return bound
+    return stats["seconds_max"]
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    """以 Prometheus 文本格式输出全部指标（带 pid 标签，区分各代理的服务器进程）"""
+    pid = os.getpid()
+    tools = snapshot()
+    lines = []
+
+    def family(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP mcp_ai_chat_{name} {help_text}")
+        lines.append(f"# TYPE mcp_ai_chat_{name} {kind}")
+
+    def sample(name: str, tool: str, value: Any, extra: str = "") -> None:
+        lines.append(f'mcp_ai_chat_{name}{{pid="{pid}",tool="{_label(tool)}"{extra}}} {value}')
+
+    family("tool_calls_total", "counter", "Tool calls handled by this server process.")
+    for tool, stats in tools.items():
+        sample("tool_calls_total", tool, stats["calls"])
+    family("tool_errors_total", "counter", "Tool calls that raised or returned an error.")
+    for tool, stats in tools.items():
+        sample("tool_errors_total", tool, stats["errors"])
+    family("tool_latency_seconds", "histogram", "Tool call latency.")
+    for tool, stats in tools.items():
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+            cumulative += count
+            sample("tool_latency_seconds_bucket", tool, cumulative, f',le="{bound}"')
+        sample("tool_latency_seconds_bucket", tool, stats["calls"], ',le="+Inf"')
+        sample("tool_latency_seconds_sum", tool, repr(stats["seconds_total"]))
+        sample("tool_latency_seconds_count", tool, stats["calls"])
+    family("tool_output_chars_total", "counter", "Characters returned by tool calls.")
+    for tool, stats in tools.items():
+        sample("tool_output_chars_total", tool, stats["output_chars"])
+    family("tool_read_bytes_total", "counter", "Bytes read while handling tool calls.")
+    for tool, stats in tools.items():
+        sample("tool_read_bytes_total", tool, stats["bytes_read"])
+    family("tool_written_bytes_total", "counter", "Bytes written while handling tool calls.")
+    for tool, stats in tools.items():
+        sample("tool_written_bytes_total", tool, stats["bytes_written"])
+    return "\n".join(lines) + "\n"
+
+
+def textfile_path() -> Path:
+    """本进程的 Prometheus 文本文件路径"""
+    return config.METRICS_DIR / f"mcp_ai_chat_{os.getpid()}.prom"
+
+
+def write_textfile() -> Path:
+    """把指标原子写入本进程的 .prom 文件"""
+    global _last_textfile_write
+    path = textfile_path()
+    with atomic_write(path) as f:
+        f.write(render_prometheus().encode("utf-8"))
+    _last_textfile_write = time.monotonic()
+    return path
+
+
+def textfile_due() -> bool:
+    """启用了 textfile 输出且距上次写入已超过间隔"""
+    return (
+        config.METRICS_TEXTFILE
+        and time.monotonic() - _last_textfile_write >= config.METRICS_TEXTFILE_INTERVAL
+    )
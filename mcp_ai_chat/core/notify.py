@@ -0,0 +1,126 @@
+"""
+MCP AI Chat Group - 变更通知模块
+
+写入新消息或任务后唤醒正在等待的 standby 调用，使其不必反复轮询：
+- 每个等待者在 config.NOTIFY_DIR 下绑定一个 Unix 数据报套接字
+- 写入方提交数据后向目录中的每个套接字发送一个字节（非阻塞，失败忽略；
+  等待者进程已退出时顺便删除残留的套接字文件）
+- 等待者收到通知或超时后返回，由调用方重新查询数据
+
+通知只是提示，不携带内容：丢失的通知最多使等待者延迟到超时才重新检查。
+不支持 AF_UNIX 的平台（Windows）上等待退化为按 config.STANDBY_POLL_SECONDS 轮询。
+"""
+
+import asyncio
+import itertools
+import os
+import socket
+from pathlib import Path
+from typing import Optional
+
+from .. import config
+
+_SOCKET_SUFFIX = ".sock"
+
+# 本进程内等待者编号
+_listener_ids = itertools.count(1)
+
+
+def notify_change() -> None:
+    """通知所有等待者：消息或任务有变化"""
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    try:
+        paths = list(config.NOTIFY_DIR.glob(f"*{_SOCKET_SUFFIX}"))
+    except OSError:
+        return
+    if not paths:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for path in paths:
+            try:
+                sock.sendto(b"\x01", str(path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                _remove_stale(path)
+            except OSError:
+                pass  # 接收缓冲区已满等：等待者已有未处理的通知
+
+
+def _remove_stale(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+class ChangeListener:
+    """
+    变更通知的接收端
+
+    应在检查数据之前创建，这样检查与等待之间发生的写入也会唤醒等待：
+
+        with ChangeListener() as listener:
+            while not check():
+                if not await listener.wait(remaining):
+                    break
+    """
+
+    def __init__(self) -> None:
+        self._sock: Optional[socket.socket] = None
+        self._path: Optional[Path] = None
+
+    def __enter__(self) -> "ChangeListener":
+        if not hasattr(socket, "AF_UNIX"):
+            return self
+        path = config.NOTIFY_DIR / f"{os.getpid()}_{next(_listener_ids)}{_SOCKET_SUFFIX}"
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            config.NOTIFY_DIR.mkdir(parents=True, exist_ok=True)
+            _remove_stale(path)
+            sock.bind(str(path))
+        except OSError:  # 路径过长、目录不可写等：退化为轮询
+            sock.close()
+            return self
+        sock.setblocking(False)
+        self._sock, self._path = sock, path
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            _remove_stale(self._path)
+            self._sock = self._path = None
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        等待下一次变更通知
+
+        Args:
+            timeout: 最长等待秒数
+
+        Returns:
+            收到通知时为True，超时为False（轮询模式下每个轮询间隔返回True）
+        """
+        if timeout <= 0:
+            return False
+        if self._sock is None:
+            interval = config.STANDBY_POLL_SECONDS
+            await asyncio.sleep(min(timeout, interval))
+            return timeout > interval
+
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.sock_recv(self._sock, 64), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._drain()
+        return True
+
+    def _drain(self) -> None:
+        """丢弃已积压的通知，一次唤醒对应一次重新检查"""
+        while True:
+            try:
+                self._sock.recv(64)
+            except OSError:  # 含 BlockingIOError：已读空
+                return
@@ -0,0 +1,201 @@
+"""
+MCP AI Chat Group - 按需性能剖析模块
+
+大数据目录上某个工具变慢时，在本地复现很困难。开启剖析后 server_modular.call_tool
+对之后的工具调用采集 cProfile 统计（可选 tracemalloc 内存分配），保存到
+PROFILES_DIR 下带时间戳的文件：
+- <时间>_<工具>_<耗时>ms_<pid>.prof：pstats 格式，用 `python -m pstats` 或 snakeviz 查看
+- 同名 .alloc.txt：开启 tracemalloc 时，调用结束时分配内存最多的代码行
+
+开启方式：环境变量 MCP_AI_CHAT_PROFILE_CALLS / MCP_AI_CHAT_PROFILE_SLOWER_THAN_MS，
+或 profile_tool_calls 工具。两种限制可以组合：
+- calls：最多再保存 N 份剖析结果，保存完自动关闭
+- slower_than_ms：只保存耗时超过阈值的调用（不满足的调用照常剖析但丢弃结果）
+
+处理器在 I/O 线程池中执行：begin 把采集对象放进 contextvars，run_io 经由
+call_profiled 在工作线程中剖析并合并到该调用的结果。同一时间只剖析一个调用。
+Python 3.11 及以前 cProfile 只统计启用它的线程，结果只包含被剖析的调用；
+Python 3.12+ 的 cProfile 是进程级的，同时在其他 I/O 线程中执行的工具调用的
+函数也会计入同一份 .prof。tracemalloc 总是进程级的，并发调用的分配也会计入。
+需要干净的结果时，在没有其他并发调用时采集（或设置 MCP_AI_CHAT_IO_WORKERS=1）。
+"""
+
+import contextvars
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from .. import config
+
+# 不剖析的工具：配置剖析的工具本身
+_UNPROFILED = {"profile_tool_calls"}
+
+# .alloc.txt 中列出的分配位置数
+TOP_ALLOCATIONS = 30
+
+_lock = threading.Lock()
+# 同一时间只有一个调用在剖析
+_active = threading.Lock()
+
+_settings = {
+    "enabled": config.PROFILE_CALLS is not None or config.PROFILE_SLOWER_THAN_MS is not None,
+    "remaining": config.PROFILE_CALLS,
+    "slower_than_ms": config.PROFILE_SLOWER_THAN_MS or 0.0,
+    "tool": config.PROFILE_TOOL,
+    "tracemalloc": config.PROFILE_TRACEMALLOC,
+}
+
+_current_capture: contextvars.ContextVar = contextvars.ContextVar(
+    "mcp_ai_chat_profile_capture", default=None
+)
+
+
+class Capture:
+    """一次工具调用的剖析结果"""
+
+    def __init__(self, tool: str, with_tracemalloc: bool) -> None:
+        self.tool = tool
+        self.stats: Optional[pstats.Stats] = None
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.keep = False
+        self.allocations: Optional[list] = None
+        self._stats_lock = threading.Lock()
+        self._token = None
+        self._owns_tracemalloc = False
+        if with_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+
+    def add(self, profiler: cProfile.Profile) -> None:
+        with self._stats_lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+
+    def save(self) -> Path:
+        """保存 .prof（以及 .alloc.txt），返回 .prof 路径"""
+        config.PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        tool = re.sub(r"[^\w-]", "_", self.tool)
+        base = config.PROFILES_DIR / f"{stamp}_{tool}_{self.seconds * 1000:.0f}ms_{os.getpid()}"
+        path = base.with_suffix(".prof")
+        if self.stats is not None:
+            self.stats.dump_stats(str(path))
+        else:
+            # 没有在 I/O 线程中执行任何代码（例如参数校验直接返回）
+            profiler = cProfile.Profile()
+            profiler.create_stats()
+            profiler.dump_stats(str(path))
+        if self.allocations is not None:
+            lines = [f"# {self.tool} 耗时 {self.seconds * 1000:.1f}ms，分配内存最多的 {TOP_ALLOCATIONS} 处"]
+            lines.extend(str(stat) for stat in self.allocations)
+            base.with_suffix(".alloc.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return path
+
+
+def configure(
+    calls: Optional[int] = None,
+    slower_than_ms: Optional[float] = None,
+    tool: Optional[str] = None,
+    with_tracemalloc: bool = False,
+) -> None:
+    """开启剖析（calls 为 None 时不限份数）"""
+    with _lock:
+        _settings.update(
+            enabled=True,
+            remaining=calls,
+            slower_than_ms=slower_than_ms or 0.0,
+            tool=tool,
+            tracemalloc=with_tracemalloc,
+        )
+
+
+def disable() -> None:
+    with _lock:
+        _settings["enabled"] = False
+
+
+def settings() -> dict:
+    with _lock:
+        return dict(_settings)
+
+
+def begin(tool: str) -> Optional[Capture]:
+    """开始剖析一次工具调用；不需要剖析（或另一个调用正在剖析）时返回None"""
+    with _lock:
+        if (
+            not _settings["enabled"]
+            or tool in _UNPROFILED
+            or _settings["tool"] not in (None, tool)
+            or _settings["remaining"] == 0
+        ):
+            return None
+        with_tracemalloc = _settings["tracemalloc"]
+    if not _active.acquire(blocking=False):
+        return None
+    capture = Capture(tool, with_tracemalloc)
+    capture._token = _current_capture.set(capture)
+    return capture
+
+
+def end(capture: Capture) -> None:
+    """结束剖析，决定是否保存结果（capture.keep）并扣减剩余份数"""
+    capture.seconds = time.perf_counter() - capture.started
+    _current_capture.reset(capture._token)
+    try:
+        if capture._owns_tracemalloc:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                )
+            )
+            tracemalloc.stop()
+            capture.allocations = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+    finally:
+        _active.release()
+
+    with _lock:
+        if not _settings["enabled"] or capture.seconds * 1000 < _settings["slower_than_ms"]:
+            return
+        if _settings["remaining"] is not None:
+            if _settings["remaining"] <= 0:
+                return
+            _settings["remaining"] -= 1
+            if _settings["remaining"] == 0:
+                _settings["enabled"] = False
+        capture.keep = True
+
+
+def call_profiled(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """执行阻塞函数；当前工具调用正在剖析时，在本线程启用 cProfile 并合并结果"""
+    capture = _current_capture.get()
+    if capture is None:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 已有其他剖析器在运行（Python 3.12+ 的 cProfile 是进程级的）
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        capture.add(profiler)
+
+
+def recent_profiles(limit: int = 10) -> list:
+    """最近保存的 .prof 文件（新的在前）"""
+    if not config.PROFILES_DIR.exists():
+        return []
+    return sorted(config.PROFILES_DIR.glob("*.prof"), reverse=True)[:limit]
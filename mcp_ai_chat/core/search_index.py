@@ -0,0 +1,574 @@
+"""
+MCP AI Chat Group - 全文索引模块
+
+为消息内容、话题和发送者维护倒排索引（词项 → 按序列号排列的倒排表），关键词查询只需
+求倒排表交集，不必逐条扫描消息内容：
+- 分词：中日韩文字按相邻两字切分（二元组），英文、数字按单词切分，统一转为小写
+- 倒排表：(词项, seq, 词频)，按 (词项, seq) 聚簇，可从最新的消息开始倒序读取
+- 相关度排序：按 BM25 为 search() 的结果打分（文档长度、词项的文档频率随索引一起维护）
+- 范围词项：群组、消息类型、私聊接收者也作为词项写入倒排表（带 "#" 前缀，分词不会产生），
+  按群组/接收者过滤的关键词查询与内容词项一起求交集，不必读取范围外的候选消息
+- 关键词过滤保持子串语义：关键词两端的英文单词可能只是消息中某个单词的一部分，
+  在词表中展开为以它开头、结尾或包含它的全部词项（展开过多时由调用方改为扫描）
+- 增量维护：记录已建立索引的最大序列号，查询前补齐其后的新消息，发送消息不做额外写入
+
+索引保存在 SQLite 数据库中：SQLite 后端与消息同库，JSON 后端使用独立的
+search_index.db（可随时删除，下次查询时重建）。消息内容写入后不再修改，
+整体替换消息（save_messages）时由调用方 reset()。
+"""
+
+import heapq
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from .. import config
+from ..utils.time_utils import to_epoch_ms
+
+# 索引格式版本，分词或存储格式变化时递增（旧索引自动清空重建）
+_INDEX_VERSION = "2"
+
+# 补齐索引时每个写事务处理的消息数（避免长时间占用写锁）
+_SYNC_BATCH = 2000
+
+# BM25 参数
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS search_postings (
+    term TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_docs (
+    seq INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL,
+    ts REAL,
+    group_id TEXT,
+    sender TEXT
+);
+"""
+
+# 中日韩文字（统一表意文字及扩展A、兼容表意文字、假名、谚文）连续片段，或英文/数字单词
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK_CHARS}]+|[^\W{_CJK_CHARS}]+")
+_CJK_RE = re.compile(rf"[{_CJK_CHARS}]")
+
+# 关键词两端的英文单词在词表中最多展开的词项数，超过时无法使用索引
+MAX_EXPANDED_TERMS = 64
+
+_local = threading.local()
+
+
+def tokenize(text: str) -> list:
+    """
+    把文本切分为词项（保留重复，用于计算词频）
+
+    中日韩文字片段切分为相邻两字的二元组（"性能测试" → 性能、能测、测试），
+    只有一个字的片段不产生词项；其余字母数字按单词切分。
+    """
+    terms = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            terms.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def keyword_terms(keyword: str) -> Optional[list]:
+    """
+    关键词对应的词项及其匹配方式 [(词项, 匹配方式), ...]（去重）
+
+    包含关键词的消息一定含有与每一项匹配的词项，反之不一定（由调用方再做子串确认）：
+    中日韩文字的二元组和关键词中间的英文单词原样匹配（"exact"）；位于关键词开头或结尾的
+    英文单词可能只是消息中某个单词的一部分，匹配以它开头（"prefix"）、以它结尾（"suffix"）
+    或包含它（"infix"）的词项。
+    关键词中有单个中日韩文字的片段、或没有任何词项时无法使用索引，返回None。
+    """
+    keyword = keyword.lower()
+    terms = []
+    for match in _TOKEN_RE.finditer(keyword):
+        run = match.group()
+        if _CJK_RE.match(run):
+            if len(run) < 2:
+                return None
+            terms.extend((run[i : i + 2], "exact") for i in range(len(run) - 1))
+            continue
+        open_start, open_end = match.start() == 0, match.end() == len(keyword)
+        if open_start:
+            terms.append((run, "infix" if open_end else "suffix"))
+        else:
+            terms.append((run, "prefix" if open_end else "exact"))
+    return list(dict.fromkeys(terms)) or None
+
+
+def _expand_term(conn: sqlite3.Connection, term: str, match: str) -> Optional[list]:
+    """
+    索引中按匹配方式与 term 匹配的词项（见 keyword_terms）
+
+    前缀匹配按主键范围查找，后缀和子串匹配扫描词表（范围词项除外）；
+    超过 MAX_EXPANDED_TERMS 个时返回None。
+    """
+    if match == "exact":
+        return [term]
+    if match == "prefix":
+        sql = "SELECT term FROM search_terms WHERE term >= ? AND term < ?"
+        params: tuple = (term, term + "\U0010ffff")
+    elif match == "suffix":
+        sql = "SELECT term FROM search_terms WHERE substr(term, -length(?)) = ?"
+        params = (term, term)
+    else:
+        sql = "SELECT term FROM search_terms WHERE instr(term, ?) > 0"
+        params = (term,)
+    rows = conn.execute(
+        f"{sql} AND substr(term, 1, 1) != '#' LIMIT ?", (*params, MAX_EXPANDED_TERMS + 1)
+    ).fetchall()
+    return [row[0] for row in rows] if len(rows) <= MAX_EXPANDED_TERMS else None
+
+
+def _document_text(message: dict) -> str:
+    """建立索引的消息文本：内容、话题和发送者"""
+    return "\n".join(
+        message.get(field) or "" for field in ("content", "topic", "sender")
+    )
+
+
+def to_epoch(timestamp: Optional[str]) -> Optional[float]:
+    """ISO 格式时间戳转为 Unix 时间（不带时区的按本地时间），无法解析时返回None"""
+    timestamp_ms = to_epoch_ms(timestamp)
+    return timestamp_ms / 1000 if timestamp_ms is not None else None
+
+
+def group_term(group_id: str) -> str:
+    """群组范围词项"""
+    return f"#group:{group_id}"
+
+
+def type_term(msg_type: str) -> str:
+    """消息类型范围词项（未设置 type 的消息视为 private）"""
+    return f"#type:{msg_type}"
+
+
+def recipient_term(recipient: str) -> str:
+    """私聊接收者范围词项（群组消息的接收者是全体成员，不写入）"""
+    return f"#to:{recipient}"
+
+
+def _scope_terms(message: dict) -> list:
+    msg_type = message.get("type", "private")
+    terms = [type_term(msg_type)]
+    if message.get("group_id"):
+        terms.append(group_term(message["group_id"]))
+    if msg_type == "private":
+        terms.extend(recipient_term(r) for r in dict.fromkeys(message.get("recipients", [])))
+    return terms
+
+
+def _index_file() -> Path:
+    if config.STORAGE_BACKEND == "sqlite":
+        return config.SQLITE_DB_FILE
+    return config.SEARCH_INDEX_FILE
+
+
+def _connection() -> sqlite3.Connection:
+    """当前线程的索引数据库连接（首次使用时建表，格式版本不符时清空）"""
+    db_file = _index_file()
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_file)
+    if conn is None:
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        if _get_meta(conn, "version") != _INDEX_VERSION:
+            with _transaction(conn):
+                if _get_meta(conn, "version") != _INDEX_VERSION:
+                    _clear(conn)
+                    _set_meta(conn, "version", _INDEX_VERSION)
+        connections[db_file] = conn
+    return conn
+
+
+def close_connections() -> None:
+    """关闭当前线程的所有索引连接"""
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """写事务（BEGIN IMMEDIATE）"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM search_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO search_meta (key, value) VALUES (?, ?)", (key, str(value))
+    )
+
+
+def _indexed_seq(conn: sqlite3.Connection) -> int:
+    return int(_get_meta(conn, "indexed_seq") or 0)
+
+
+def _clear(conn: sqlite3.Connection) -> None:
+    """清空索引（在写事务内调用）"""
+    conn.execute("DELETE FROM search_postings")
+    conn.execute("DELETE FROM search_terms")
+    conn.execute("DELETE FROM search_docs")
+    _set_meta(conn, "indexed_seq", 0)
+    _set_meta(conn, "doc_count", 0)
+    _set_meta(conn, "total_length", 0)
+
+
+def reset() -> None:
+    """清空索引，下次查询时从头重建"""
+    conn = _connection()
+    with _transaction(conn):
+        _clear(conn)
+
+
+def indexed_sequence() -> int:
+    """已建立索引的最大消息序列号"""
+    return _indexed_seq(_connection())
+
+
+def _index_messages(conn: sqlite3.Connection, messages: Iterable[dict]) -> None:
+    """把消息加入倒排表（在写事务内调用）"""
+    postings = []
+    docs = []
+    document_frequency: Counter = Counter()
+    for message in messages:
+        terms = tokenize(_document_text(message))
+        docs.append(
+            (
+                message["seq"],
+                len(terms),
+                to_epoch(message.get("timestamp")),
+                message.get("group_id") if message.get("type") == "group" else None,
+                message.get("sender"),
+            )
+        )
+        counts = Counter(terms)
+        counts.update(_scope_terms(message))
+        postings.extend((term, message["seq"], tf) for term, tf in counts.items())
+        document_frequency.update(counts.keys())
+    conn.executemany(
+        "INSERT OR IGNORE INTO search_docs (seq, length, ts, group_id, sender) "
+        "VALUES (?, ?, ?, ?, ?)",
+        docs,
+    )
+    _set_meta(conn, "doc_count", int(_get_meta(conn, "doc_count") or 0) + len(docs))
+    _set_meta(
+        conn,
+        "total_length",
+        int(_get_meta(conn, "total_length") or 0) + sum(doc[1] for doc in docs),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO search_postings (term, seq, tf) VALUES (?, ?, ?)", postings
+    )
+    conn.executemany(
+        "INSERT INTO search_terms (term, df) VALUES (?, ?) "
+        "ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+        document_frequency.items(),
+    )
+
+
+def sync(last_seq: int, iter_after: Callable[[int], Iterator[dict]]) -> int:
+    """
+    把索引补齐到 last_seq
+
+    Args:
+        last_seq: 最新的消息序列号
+        iter_after: iter_after(seq) 按序列号递增返回序列号大于 seq 的消息
+
+    Returns:
+        本次新加入索引的消息数
+    """
+    conn = _connection()
+    if _indexed_seq(conn) == last_seq:
+        return 0
+
+    added = 0
+    while True:
+        with _transaction(conn):
+            indexed = _indexed_seq(conn)
+            if indexed > last_seq:
+                # 消息存储被整体替换（例如删除了数据文件），索引已过期
+                _clear(conn)
+                indexed = 0
+            if indexed == last_seq:
+                return added
+            batch = []
+            with closing(iter_after(indexed)) as messages:
+                for message in messages:
+                    if message.get("seq", 0) > last_seq:
+                        break
+                    batch.append(message)
+                    if len(batch) >= _SYNC_BATCH:
+                        break
+            _index_messages(conn, batch)
+            _set_meta(conn, "indexed_seq", batch[-1]["seq"] if batch else last_seq)
+            added += len(batch)
+
+
+def _iter_keyword_seqs(
+    conn: sqlite3.Connection, groups: list, before_seq: Optional[int] = None
+) -> Iterator[int]:
+    """
+    每组词项中至少含有一个的消息序列号，从新到旧（before_seq：只返回更小的序列号）
+
+    groups 的每一项是可互相替代的词项（关键词单词展开后的词项，或单个词项）。
+    从合计文档频率最小的一组出发，组内每个词项各查询一次再归并（结果可能重复，
+    由调用方去重）；其余的组按主键确认。
+    """
+    if any(not group for group in groups):
+        return  # 有关键词单词在词表中没有匹配的词项
+    terms = list(dict.fromkeys(term for group in groups for term in group))
+    frequencies = dict(
+        conn.execute(
+            f"SELECT term, df FROM search_terms WHERE term IN ({', '.join('?' for _ in terms)})",
+            terms,
+        )
+    )
+    groups = [[term for term in group if term in frequencies] for group in groups]
+    if any(not group for group in groups):
+        return  # 有一组词项从未出现
+    groups.sort(key=lambda group: sum(map(frequencies.__getitem__, group)))
+    yield from heapq.merge(
+        *(_iter_term_seqs(conn, term, groups[1:], before_seq) for term in groups[0]),
+        reverse=True,
+    )
+
+
+def _iter_term_seqs(
+    conn: sqlite3.Connection, term: str, groups: list, before_seq: Optional[int]
+) -> Iterator[int]:
+    """含有 term 且每组词项中至少含有一个的消息序列号，从新到旧"""
+    joins, join_params, conditions, params = "", [], "", [term]
+    for i, group in enumerate(groups, 1):
+        if len(group) == 1:
+            joins += f" JOIN search_postings p{i} ON p{i}.term = ? AND p{i}.seq = p0.seq"
+            join_params.append(group[0])
+        else:
+            conditions += (
+                f" AND EXISTS (SELECT 1 FROM search_postings p{i} WHERE p{i}.term IN "
+                f"({', '.join('?' for _ in group)}) AND p{i}.seq = p0.seq)"
+            )
+            params.extend(group)
+    sql = f"SELECT p0.seq FROM search_postings p0{joins} WHERE p0.term = ?{conditions}"
+    params = [*join_params, *params]
+    if before_seq is not None:
+        sql += " AND p0.seq < ?"
+        params.append(before_seq)
+    cursor = conn.execute(sql + " ORDER BY p0.seq DESC", params)
+    try:
+        for (seq,) in cursor:
+            yield seq
+    finally:
+        cursor.close()
+
+
+def iter_matching_seqs(
+    keywords: Iterable[str],
+    required_terms: Iterable[str] = (),
+    before_seq: Optional[int] = None,
+) -> Optional[Iterator[int]]:
+    """
+    可能包含任一关键词的消息序列号，从新到旧（结果是候选集，需再确认子串）
+
+    Args:
+        keywords: 关键词（任一匹配即可）
+        required_terms: 候选消息还必须包含的范围词项（见 group_term 等）
+        before_seq: 只返回小于该值的序列号（分页续读）
+
+    Returns:
+        序列号迭代器；有关键词无法使用索引时返回None（调用方改为扫描）
+    """
+    term_lists = [keyword_terms(keyword) for keyword in keywords]
+    if not term_lists or any(terms is None for terms in term_lists):
+        return None
+    conn = _connection()
+    required = [[term] for term in dict.fromkeys(required_terms)]
+    keyword_groups = []
+    for terms in term_lists:
+        groups = [_expand_term(conn, term, match) for term, match in terms]
+        if any(group is None for group in groups):
+            return None
+        keyword_groups.append(groups + required)
+    merged = heapq.merge(
+        *(_iter_keyword_seqs(conn, groups, before_seq) for groups in keyword_groups),
+        reverse=True,
+    )
+
+    def _dedupe() -> Iterator[int]:
+        last = None
+        for seq in merged:
+            if seq != last:
+                last = seq
+                yield seq
+
+    return _dedupe()
+
+
+def _bm25_top(
+    conn: sqlite3.Connection,
+    idf: dict,
+    driver_terms: list,
+    filters: tuple,
+    avgdl: float,
+    limit: int,
+) -> list:
+    """为包含任一 driver_terms 的消息计算 BM25 得分（全部查询词项参与），返回前 limit 个"""
+    conditions, filter_params = filters
+    k1, b = _BM25_K1, _BM25_B
+    sql = (
+        f"WITH q(term, idf) AS (VALUES {', '.join('(?, ?)' for _ in idf)}), "
+        f"c(seq) AS (SELECT DISTINCT seq FROM search_postings "
+        f"WHERE term IN ({', '.join('?' for _ in driver_terms)})) "
+        f"SELECT c.seq, SUM(q.idf * p.tf * {k1 + 1} / "
+        f"(p.tf + {k1} * (1 - {b} + {b} * d.length / {avgdl!r}))) AS score "
+        f"FROM c CROSS JOIN search_docs d ON d.seq = c.seq "
+        f"CROSS JOIN q CROSS JOIN search_postings p ON p.term = q.term AND p.seq = c.seq"
+    )
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " GROUP BY c.seq ORDER BY score DESC, c.seq DESC LIMIT ?"
+    params = [value for pair in idf.items() for value in pair]
+    return conn.execute(sql, [*params, *driver_terms, *filter_params, limit]).fetchall()
+
+
+def search(
+    query: str,
+    limit: int = 10,
+    group_id: Optional[str] = None,
+    sender: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    viewer: Optional[str] = None,
+    viewer_groups: Iterable[str] = (),
+) -> list:
+    """
+    按 BM25 相关度检索消息（包含任一查询词项即参与排序）
+
+    采用 MaxScore 剪枝：按词项得分上限从高到低（即从稀有到常见）逐步扩大候选集，
+    其余常见词项得分上限之和已不足以进入前 limit 名时，只含这些词项的消息不必计算。
+
+    Args:
+        query: 查询文本，分词方式与索引相同
+        limit: 返回的结果数
+        group_id: 只检索该群组的消息
+        sender: 只检索该发送者的消息
+        since: 只返回该 Unix 时间及之后的消息
+        until: 只返回该 Unix 时间之前的消息
+        viewer: 只返回该代理能看到的消息：viewer_groups 中群组的消息，
+            以及他发送的、发给他或所有人的私聊
+        viewer_groups: viewer 所在的群组
+
+    Returns:
+        [(seq, 得分), ...]，得分从高到低
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or limit <= 0:
+        return []
+    conn = _connection()
+    doc_count = int(_get_meta(conn, "doc_count") or 0)
+    if doc_count == 0:
+        return []
+    avgdl = int(_get_meta(conn, "total_length") or 0) / doc_count or 1.0
+    frequencies = dict(
+        conn.execute(
+            f"SELECT term, df FROM search_terms WHERE term IN ({', '.join('?' for _ in terms)})",
+            terms,
+        )
+    )
+    if not frequencies:
+        return []
+    idf = {
+        term: math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        for term, df in frequencies.items()
+    }
+
+    conditions = []
+    params: list = []
+    if group_id is not None:
+        conditions.append("d.group_id = ?")
+        params.append(group_id)
+    if sender is not None:
+        conditions.append("d.sender = ?")
+        params.append(sender)
+    if since is not None:
+        conditions.append("d.ts >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("d.ts < ?")
+        params.append(until)
+    if viewer is not None:
+        viewer_groups = list(viewer_groups)
+        conditions.append(
+            f"(d.group_id IN ({', '.join('?' for _ in viewer_groups)}) OR (d.group_id IS NULL "
+            "AND (d.sender = ? OR EXISTS (SELECT 1 FROM search_postings v "
+            "WHERE v.term IN (?, ?) AND v.seq = c.seq))))"
+        )
+        params.extend([*viewer_groups, viewer, recipient_term(viewer), recipient_term("*")])
+    filters = (conditions, params)
+
+    # 单个词项的得分上限为 idf * (k1 + 1)
+    ordered = sorted(idf, key=idf.__getitem__, reverse=True)
+    bounds = [idf[term] * (_BM25_K1 + 1) for term in ordered]
+    essential = 1
+    while True:
+        results = _bm25_top(conn, idf, ordered[:essential], filters, avgdl, limit)
+        remaining_bound = sum(bounds[essential:])
+        if essential == len(ordered) or (
+            len(results) == limit and results[-1][1] >= remaining_bound
+        ):
+            return results
+        # 扩大候选集，直到剩余词项的得分上限之和不超过当前第 limit 名的得分
+        threshold = results[-1][1] if len(results) == limit else 0.0
+        essential += 1
+        while essential < len(ordered) and sum(bounds[essential:]) > threshold:
+            essential += 1
+
+
+def snippet(text: str, query: str, width: int = 80) -> str:
+    """截取文本中第一个查询词项附近的片段（找不到时取开头）"""
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in tokenize(query)]
+    positions = [p for p in positions if p >= 0]
+    start = max(0, min(positions) - width // 4) if positions else 0
+    end = start + width
+    fragment = " ".join(text[start:end].split())
+    return ("…" if start > 0 else "") + fragment + ("…" if end < len(text) else "")
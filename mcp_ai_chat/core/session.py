@@ -54,21 +54,22 @@ def get_current_agent_role() -> str:
 
 def create_session(agent_name: str, role: str, description: str) -> str:
     """创建新会话"""
-    from .storage import load_sessions, save_sessions
+    from .storage import load_sessions, locked, save_sessions
 
-    sessions = load_sessions()
-    session_id = f"{agent_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
-    session_info = {
-        "agent_name": agent_name,
-        "role": role,
-        "description": description,
-        "created_at": datetime.now().isoformat(),
-        "active": True,
-    }
-
-    sessions[session_id] = session_info
-    save_sessions(sessions)
+    with locked("sessions"):
+        sessions = load_sessions()
+        session_id = f"{agent_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+        session_info = {
+            "agent_name": agent_name,
+            "role": role,
+            "description": description,
+            "created_at": datetime.now().isoformat(),
+            "active": True,
+        }
+
+        sessions[session_id] = session_info
+        save_sessions(sessions)
 
     # 设置为当前会话
     set_current_session_id(session_id)
@@ -0,0 +1,595 @@
+"""
+MCP AI Chat Group - SQLite 存储后端
+
+所有数据保存在同一个 SQLite 数据库中（WAL 模式）：
+- messages / message_recipients：消息及其接收者，按接收者、群组、时间建立索引；
+  seq 列即消息序列号（AUTOINCREMENT，严格递增、不复用）；
+  timestamp_ms 列是写入时规范化的毫秒时间戳，按时间窗口查询走该列的索引
+- tasks：任务，按负责人、状态建立索引
+- documents：代理、会话、群组、待命状态、员工配置等键值型数据
+
+每个线程使用独立连接，WAL 模式下读写互不阻塞。
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+from .. import config
+from ..utils.time_utils import to_epoch_ms
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT,
+    type TEXT NOT NULL DEFAULT 'private',
+    group_id TEXT,
+    sender TEXT,
+    timestamp TEXT,
+    timestamp_ms INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_id ON messages(id);
+CREATE INDEX IF NOT EXISTS idx_messages_group ON messages(group_id, seq);
+CREATE INDEX IF NOT EXISTS idx_messages_type ON messages(type, seq);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_reply_to ON messages(json_extract(data, '$.reply_to'))
+    WHERE json_extract(data, '$.reply_to') IS NOT NULL;
+CREATE TABLE IF NOT EXISTS message_recipients (
+    recipient TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (recipient, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    assignee TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_assignee ON tasks(assignee, status);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+CREATE INDEX IF NOT EXISTS idx_tasks_position ON tasks(position);
+CREATE TABLE IF NOT EXISTS message_rollups (
+    group_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    store TEXT NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (store, key)
+);
+"""
+
+_local = threading.local()
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+def get_connection() -> sqlite3.Connection:
+    """获取当前线程的数据库连接（首次使用时建表）"""
+    db_file: Path = config.SQLITE_DB_FILE
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_file)
+    if conn is None:
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _migrate_timestamp_ms(conn)
+        connections[db_file] = conn
+    return conn
+
+
+def _migrate_timestamp_ms(conn: sqlite3.Connection) -> None:
+    """旧数据库补充 timestamp_ms 列，并由 timestamp 回填已有消息"""
+    if not _has_timestamp_ms(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 等锁期间可能已被其他进程迁移
+            if not _has_timestamp_ms(conn):
+                conn.execute("ALTER TABLE messages ADD COLUMN timestamp_ms INTEGER")
+                rows = conn.execute("SELECT seq, timestamp FROM messages").fetchall()
+                conn.executemany(
+                    "UPDATE messages SET timestamp_ms = ? WHERE seq = ?",
+                    [(to_epoch_ms(timestamp), seq) for seq, timestamp in rows],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp_ms ON messages(timestamp_ms)"
+    )
+
+
+def _has_timestamp_ms(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "timestamp_ms" for row in conn.execute("PRAGMA table_info(messages)"))
+
+
+def close_connections() -> None:
+    """关闭当前线程的所有连接"""
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+class _Transaction:
+    """
+    写事务（BEGIN IMMEDIATE，提前获取写锁，避免升级死锁）
+
+    已在事务中时（见 transaction）改用保存点，出错只回滚本层的修改。
+    """
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn = get_connection()
+        self.nested = self.conn.in_transaction
+        self.conn.execute("SAVEPOINT nested" if self.nested else "BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.nested:
+            if exc_type is not None:
+                self.conn.execute("ROLLBACK TO nested")
+            self.conn.execute("RELEASE nested")
+        elif exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+
+
+def transaction() -> _Transaction:
+    """开启一个写事务，其中的所有写入一起提交（出错时整体回滚）"""
+    return _Transaction()
+
+
+def get_meta(key: str) -> Optional[str]:
+    """读取元数据"""
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(key: str, value: str) -> None:
+    """写入元数据"""
+    get_connection().execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+# 消息相关
+def _next_sequence(conn: sqlite3.Connection) -> int:
+    """下一个消息序列号（包括已删除消息用过的序列号，保证不复用）"""
+    return conn.execute(
+        "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0), "
+        "COALESCE((SELECT MAX(seq) FROM messages), 0)) + 1"
+    ).fetchone()[0]
+
+
+def _insert_message(conn: sqlite3.Connection, message: dict) -> int:
+    """插入一条消息（在写事务内调用），没有 seq/id/timestamp_ms 时补上"""
+    seq = message.get("seq")
+    if not isinstance(seq, int):
+        seq = message["seq"] = _next_sequence(conn)
+    if not message.get("id"):
+        timestamp = message.get("timestamp") or datetime.now().isoformat()
+        message["id"] = f"{timestamp}_{seq}"
+    if "timestamp_ms" not in message:
+        message["timestamp_ms"] = to_epoch_ms(message.get("timestamp"))
+    conn.execute(
+        "INSERT INTO messages (seq, id, type, group_id, sender, timestamp, timestamp_ms, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            seq,
+            message.get("id"),
+            message.get("type", "private"),
+            message.get("group_id"),
+            message.get("sender"),
+            message.get("timestamp"),
+            message["timestamp_ms"],
+            _dumps(message),
+        ),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO message_recipients (recipient, seq) VALUES (?, ?)",
+        [(recipient, seq) for recipient in message.get("recipients", [])],
+    )
+    return seq
+
+
+def _row_to_message(seq: int, data: str) -> dict:
+    message = json.loads(data)
+    message["seq"] = seq  # 早期导入的数据中没有 seq 字段
+    return message
+
+
+def load_messages() -> list:
+    """按写入顺序读取全部消息"""
+    rows = get_connection().execute("SELECT seq, data FROM messages ORDER BY seq")
+    return [_row_to_message(seq, data) for seq, data in rows]
+
+
+def save_messages(messages: list) -> None:
+    """整体替换全部消息"""
+    with _Transaction() as conn:
+        conn.execute("DELETE FROM message_recipients")
+        conn.execute("DELETE FROM messages")
+        for message in messages:
+            _insert_message(conn, message)
+
+
+def append_message(message: dict) -> dict:
+    """追加一条消息（分配序列号，未提供 id 时生成 "<时间戳>_<seq>"）"""
+    with _Transaction() as conn:
+        _insert_message(conn, message)
+    return message
+
+
+def last_sequence() -> int:
+    """最近分配的消息序列号（没有消息时为0）"""
+    return _next_sequence(get_connection()) - 1
+
+
+def count_messages() -> int:
+    """消息总数"""
+    return get_connection().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def compact_messages() -> int:
+    """执行 WAL 检查点，把日志合并回主数据库"""
+    conn = get_connection()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return count_messages()
+
+
+def query_messages(
+    recipients: Optional[Iterable[str]] = None,
+    msg_type: Optional[str] = None,
+    group_ids: Optional[Iterable[str]] = None,
+    after_seq: Optional[int] = None,
+    since_ms: Optional[int] = None,
+    before_seq: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    按接收者、类型、群组查询消息，最新的在前（after_seq：只返回序列号更大的消息；
+    since_ms：只返回 timestamp_ms 不早于该值或为NULL的消息；before_seq：只返回序列号更小的消息）
+
+    结果按需逐行读取，调用方取够数量后即可停止。
+    """
+    recipients = list(recipients) if recipients is not None else None
+    group_ids = list(group_ids) if group_ids is not None else None
+    if recipients == [] or group_ids == []:
+        return
+
+    conditions = []
+    params: list = []
+    if recipients is not None:
+        # 从 (recipient, seq) 主键出发，只访问这些接收者的消息
+        placeholders = ", ".join("?" for _ in recipients)
+        sql = (
+            "SELECT m.seq, m.data FROM message_recipients r JOIN messages m ON m.seq = r.seq"
+        )
+        conditions.append(f"r.recipient IN ({placeholders})")
+        params.extend(recipients)
+    else:
+        sql = "SELECT m.seq, m.data FROM messages m"
+    if msg_type is not None:
+        conditions.append("m.type = ?")
+        params.append(msg_type)
+    if group_ids is not None:
+        conditions.append(f"m.group_id IN ({', '.join('?' for _ in group_ids)})")
+        params.extend(group_ids)
+    if after_seq is not None:
+        conditions.append("m.seq > ?")
+        params.append(after_seq)
+    if since_ms is not None:
+        conditions.append("(m.timestamp_ms >= ? OR m.timestamp_ms IS NULL)")
+        params.append(since_ms)
+    if before_seq is not None:
+        conditions.append("m.seq < ?")
+        params.append(before_seq)
+
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if recipients is not None and len(recipients) > 1:
+        sql += " GROUP BY m.seq"
+    sql += " ORDER BY m.seq DESC"
+
+    cursor = get_connection().execute(sql, params)
+    try:
+        for seq, data in cursor:
+            yield _row_to_message(seq, data)
+    finally:
+        cursor.close()
+
+
+def _expected_recipients(conn: sqlite3.Connection) -> set:
+    """由消息数据计算应有的 (recipient, seq) 索引项"""
+    expected = set()
+    for seq, data in conn.execute("SELECT seq, data FROM messages"):
+        for recipient in json.loads(data).get("recipients", []):
+            expected.add((recipient, seq))
+    return expected
+
+
+def rebuild_recipient_index() -> int:
+    """由消息数据重建接收者索引，返回消息数量"""
+    with _Transaction() as conn:
+        expected = _expected_recipients(conn)
+        conn.execute("DELETE FROM message_recipients")
+        conn.executemany(
+            "INSERT INTO message_recipients (recipient, seq) VALUES (?, ?)", sorted(expected)
+        )
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def check_recipient_index() -> dict:
+    """检查接收者索引与消息数据是否一致"""
+    conn = get_connection()
+    expected = _expected_recipients(conn)
+    actual = set(conn.execute("SELECT recipient, seq FROM message_recipients"))
+    missing = len(expected - actual)
+    extra = len(actual - expected)
+    last_seq = last_sequence()
+    return {
+        "ok": missing == 0 and extra == 0,
+        "messages": count_messages(),
+        "missing": missing,
+        "extra": extra,
+        "watermark": last_seq,
+        "last_seq": last_seq,
+    }
+
+
+def iter_recipient_seqs_reversed(recipients: Iterable[str], after_seq: int = 0) -> Iterator[int]:
+    """只读取接收者索引，从新到旧返回发给任一接收者、序列号大于 after_seq 的消息序列号"""
+    recipients = list(recipients)
+    if not recipients:
+        return
+    placeholders = ", ".join("?" for _ in recipients)
+    cursor = get_connection().execute(
+        f"SELECT DISTINCT seq FROM message_recipients WHERE recipient IN ({placeholders}) "
+        "AND seq > ? ORDER BY seq DESC",
+        [*recipients, after_seq],
+    )
+    try:
+        for (seq,) in cursor:
+            yield seq
+    finally:
+        cursor.close()
+
+
+def last_sequence_before(timestamp_ms: int) -> int:
+    """
+    序列号 S：序列号不大于 S 的消息时间都早于 timestamp_ms（由 timestamp_ms 索引求得；
+    timestamp_ms 为NULL的消息视为在窗口内）
+    """
+    conn = get_connection()
+    firsts = [
+        conn.execute(sql, params).fetchone()[0]
+        for sql, params in (
+            ("SELECT MIN(seq) FROM messages WHERE timestamp_ms >= ?", (timestamp_ms,)),
+            ("SELECT MIN(seq) FROM messages WHERE timestamp_ms IS NULL", ()),
+        )
+    ]
+    firsts = [seq for seq in firsts if seq is not None]
+    return min(firsts) - 1 if firsts else last_sequence()
+
+
+def iter_messages_after(after_seq: int) -> Iterator[dict]:
+    """按序列号递增读取序列号大于 after_seq 的消息"""
+    cursor = get_connection().execute(
+        "SELECT seq, data FROM messages WHERE seq > ? ORDER BY seq", (after_seq,)
+    )
+    try:
+        for seq, data in cursor:
+            yield _row_to_message(seq, data)
+    finally:
+        cursor.close()
+
+
+def iter_messages_by_seq(seqs: Iterable[int]) -> Iterator[dict]:
+    """按给定顺序读取这些序列号的消息（不存在的序列号跳过）"""
+    conn = get_connection()
+    for seq in seqs:
+        row = conn.execute("SELECT data FROM messages WHERE seq = ?", (seq,)).fetchone()
+        if row:
+            yield _row_to_message(seq, row[0])
+
+
+def find_message(message_id: str) -> Optional[dict]:
+    """按ID查找消息（同一ID有多条消息时返回最新的）"""
+    row = (
+        get_connection()
+        .execute(
+            "SELECT seq, data FROM messages WHERE id = ? ORDER BY seq DESC LIMIT 1",
+            (message_id,),
+        )
+        .fetchone()
+    )
+    return _row_to_message(*row) if row else None
+
+
+def find_replies(message_id: str) -> list:
+    """回复该消息的全部消息，按序列号顺序（使用 reply_to 的表达式索引）"""
+    rows = get_connection().execute(
+        "SELECT seq, data FROM messages WHERE json_extract(data, '$.reply_to') = ? ORDER BY seq",
+        (message_id,),
+    )
+    return [_row_to_message(seq, data) for seq, data in rows]
+
+
+def update_messages(messages: list) -> None:
+    """写回已修改的消息（带 seq 时按 seq 定位，同一ID的其他消息不受影响）"""
+    with _Transaction() as conn:
+        for message in messages:
+            if isinstance(message.get("seq"), int):
+                conn.execute(
+                    "UPDATE messages SET data = ? WHERE seq = ?", (_dumps(message), message["seq"])
+                )
+            else:
+                conn.execute(
+                    "UPDATE messages SET data = ? WHERE id = ?",
+                    (_dumps(message), message.get("id")),
+                )
+
+
+# 群组消息统计汇总
+def load_rollup(group_id: str) -> Optional[dict]:
+    """读取一个群组的消息统计汇总"""
+    row = (
+        get_connection()
+        .execute("SELECT data FROM message_rollups WHERE group_id = ?", (group_id,))
+        .fetchone()
+    )
+    return json.loads(row[0]) if row else None
+
+
+def save_rollups(rollups: dict, seq: int) -> None:
+    """写入若干群组的汇总，并把已计入的序列号记为 seq（同一事务）"""
+    with _Transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO message_rollups (group_id, data) VALUES (?, ?)",
+            [(group_id, _dumps(rollup)) for group_id, rollup in rollups.items()],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_seq', ?)", (str(seq),)
+        )
+
+
+# 任务相关
+def _insert_task(conn: sqlite3.Connection, task: dict, position: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO tasks (id, position, assignee, status, data) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (task.get("id"), position, task.get("assignee"), task.get("status"), _dumps(task)),
+    )
+
+
+def load_tasks() -> list:
+    """按创建顺序读取全部任务"""
+    rows = get_connection().execute("SELECT data FROM tasks ORDER BY position")
+    return [json.loads(row[0]) for row in rows]
+
+
+def save_tasks(tasks: list) -> None:
+    """整体替换全部任务"""
+    with _Transaction() as conn:
+        conn.execute("DELETE FROM tasks")
+        for position, task in enumerate(tasks):
+            _insert_task(conn, task, position)
+
+
+def count_tasks() -> int:
+    """任务总数"""
+    return get_connection().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+
+def query_tasks(
+    assignee: Optional[str] = None, statuses: Optional[Iterable[str]] = None
+) -> list:
+    """按负责人、状态查询任务"""
+    conditions = []
+    params: list = []
+    if assignee is not None:
+        conditions.append("assignee = ?")
+        params.append(assignee)
+    if statuses is not None:
+        statuses = list(statuses)
+        conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+        params.extend(statuses)
+
+    sql = "SELECT data FROM tasks"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY position"
+    return [json.loads(row[0]) for row in get_connection().execute(sql, params)]
+
+
+def get_task(task_id: str) -> Optional[dict]:
+    """按ID获取任务"""
+    row = (
+        get_connection()
+        .execute("SELECT data FROM tasks WHERE id = ?", (task_id,))
+        .fetchone()
+    )
+    return json.loads(row[0]) if row else None
+
+
+def add_task(task: dict) -> None:
+    """新增任务"""
+    with _Transaction() as conn:
+        position = conn.execute(
+            "SELECT COALESCE(MAX(position), -1) + 1 FROM tasks"
+        ).fetchone()[0]
+        _insert_task(conn, task, position)
+
+
+def update_task(task: dict) -> None:
+    """写回单个任务"""
+    get_connection().execute(
+        "UPDATE tasks SET assignee = ?, status = ?, data = ? WHERE id = ?",
+        (task.get("assignee"), task.get("status"), _dumps(task), task.get("id")),
+    )
+
+
+def delete_task(task_id: str) -> None:
+    """永久删除任务"""
+    get_connection().execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+
+# 键值型数据（代理、会话、群组、待命状态、员工配置）
+def load_store(store: str) -> dict:
+    """读取一个键值存储"""
+    rows = get_connection().execute(
+        "SELECT key, data FROM documents WHERE store = ? ORDER BY position", (store,)
+    )
+    return {key: json.loads(data) for key, data in rows}
+
+
+def save_store(store: str, data: dict) -> None:
+    """整体替换一个键值存储"""
+    with _Transaction() as conn:
+        conn.execute("DELETE FROM documents WHERE store = ?", (store,))
+        conn.executemany(
+            "INSERT INTO documents (store, key, position, data) VALUES (?, ?, ?, ?)",
+            [
+                (store, key, position, _dumps(value))
+                for position, (key, value) in enumerate(data.items())
+            ],
+        )
+
+
+def import_data(messages: list, tasks: list, stores: dict[str, dict]) -> None:
+    """从 JSON 存储导入数据（只在数据库为空时调用；其他线程/进程已导入时不做任何事）"""
+    with _Transaction() as conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+            return
+        for message in messages:
+            _insert_message(conn, message)
+        for position, task in enumerate(tasks):
+            _insert_task(conn, task, position)
+        for store, data in stores.items():
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents (store, key, position, data) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (store, key, position, _dumps(value))
+                    for position, (key, value) in enumerate(data.items())
+                ],
+            )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', '1')")
@@ -1,102 +1,1284 @@
 """
 MCP AI Chat Group - 数据存储模块
+
+存储后端由 config.STORAGE_BACKEND 选择：
+- json：JSON文件 + 追加写消息日志（默认）
+- sqlite：单个SQLite数据库（WAL模式），消息与任务按列建立索引
+
+处理器只调用本模块的函数，不关心具体后端。
+
+多个代理进程共享同一份数据：JSON 文件通过临时文件 + rename 原子写入，
+读-改-写过程用 locked() 获取排他锁（见 file_lock）。
 """
 
+import base64
 import json
+import marshal
+import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Iterable, Iterator, Optional
 from .. import config
+from ..utils.time_utils import to_epoch_ms
+from . import message_log, message_rollups, notify, search_index, sqlite_store
+from .file_lock import atomic_write, file_lock, file_locks
+
+# load_json 的解析结果缓存：文件路径 → (文件签名, 解析结果, 与文件内容一致的副本)
+# 调用方会原地修改返回的对象再写回，所以每个线程（见 core/io_executor）各有一份缓存，
+# 一个线程未提交的修改不会被其他线程读到；修改后没有写回（返回错误或抛出异常）时，
+# run_io 经由 drop_unsaved_json_changes 与副本比较，丢弃这些缓存项，之后重新读取文件
+_json_cache_local = threading.local()
+_json_cache_generation = 0
+_json_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _json_cache() -> dict:
+    """当前线程的 load_json 缓存（clear_json_cache 之后重新创建）"""
+    local = _json_cache_local
+    if getattr(local, "generation", None) != _json_cache_generation:
+        local.cache = {}
+        local.handed_out = set()
+        local.generation = _json_cache_generation
+    return local.cache
+
+
+def _handed_out() -> set:
+    """本线程当前调用中 load_json 返回过（或 save_json 写入过）的缓存文件"""
+    _json_cache()
+    return _json_cache_local.handed_out
+
+
+def _snapshot(data: Any) -> Any:
+    """解析结果的独立副本（用于发现未写回的原地修改，marshal 比重新解析JSON快）"""
+    return marshal.loads(marshal.dumps(data))
+
+
+def _file_signature(file_path: Path) -> Optional[tuple]:
+    """文件签名 (st_mtime_ns, st_size, st_ino)，文件不存在时返回None"""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
 
 def load_json(file_path: Path, default: Optional[Any] = None) -> Any:
-    """加载JSON文件"""
-    if file_path.exists():
-        try:
+    """
+    加载JSON文件
+
+    文件签名（修改时间、大小、inode）未变化时直接返回缓存的解析结果，
+    只需一次 stat() 而不必重新解析整个文件。返回的对象与本线程的缓存共享，
+    修改后应通过 save_json 写回；没有写回的修改在 run_io 调用结束时丢弃
+    （见 drop_unsaved_json_changes）。
+    批量操作中（见 batch）返回批内共享的对象：首次读取时把它移出缓存，
+    批量异常结束时批内的原地修改随之丢弃，不会留在缓存中。
+    """
+    documents = _batch_documents()
+    if documents is None:
+        data = _load_json_cached(file_path, default)
+        if file_path in _json_cache():
+            _handed_out().add(file_path)
+        return data
+    if file_path not in documents:
+        documents[file_path] = [_load_json_cached(file_path, default), False]
+        _json_cache().pop(file_path, None)
+    return documents[file_path][0]
+
+
+def _load_json_cached(file_path: Path, default: Optional[Any]) -> Any:
+    cache = _json_cache()
+    signature = _file_signature(file_path)
+    if signature is None:
+        cache.pop(file_path, None)
+        return default if default is not None else {}
+
+    cached = cache.get(file_path)
+    if cached is not None and cached[0] == signature:
+        _json_cache_stats["hits"] += 1
+        return cached[1]
+
+    _json_cache_stats["misses"] += 1
+    try:
+        with file_lock(file_path, exclusive=False):
+            signature = _file_signature(file_path)
             with open(file_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return default if default is not None else {}
-    return default if default is not None else {}
+                data = json.load(f)
+    except Exception:
+        cache.pop(file_path, None)
+        return default if default is not None else {}
+    cache[file_path] = (signature, data, _snapshot(data))
+    return data
 
 
 def save_json(file_path: Path, data: Any) -> None:
-    """保存JSON文件"""
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """保存JSON文件（原子替换，同时更新本线程的缓存；批量操作中推迟到批量结束时写入）"""
+    documents = _batch_documents()
+    if documents is not None:
+        documents[file_path] = [data, True]
+        return
+    encoded = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    with file_lock(file_path):
+        with atomic_write(file_path) as f:
+            f.write(encoded)
+        signature = _file_signature(file_path)
+    if signature is not None:
+        _json_cache()[file_path] = (signature, data, _snapshot(data))
+        _handed_out().add(file_path)
+
+
+# 当前线程正在执行的批量操作（见 batch）：JSON 文件路径 → [批内数据, 是否已修改]
+_batch_local = threading.local()
+
+
+def _batch_documents() -> Optional[dict]:
+    return getattr(_batch_local, "documents", None)
+
+
+def _in_sqlite_batch() -> bool:
+    return _batch_documents() is not None and _batch_local.sqlite
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    """
+    把一组读写作为一个整体执行（batch 工具使用）
+
+    - 一次获取全部存储的排他锁（见 file_locks），期间其他进程不能写入，
+      也读不到中间状态；批内的所有读取看到同一个一致的快照
+    - JSON 后端：每个文件只读取一次并在批内共享，save_json 只修改批内副本，
+      正常结束时一起写回；消息日志是追加写，每条消息仍立即写入
+    - SQLite 后端：整批在一个写事务中，正常结束时一起提交。全文索引使用另一个连接，
+      开始前先补齐，批内不再同步，关键词过滤改为扫描（search_messages 看不到批内新写入的消息）
+
+    抛出异常时丢弃尚未写回的修改（SQLite 整体回滚）。嵌套调用直接并入外层批量。
+    批内的每个工具调用用 batch_call 包裹，失败时只撤销该调用的修改。
+    """
+    if _batch_documents() is not None:
+        yield
+        return
+    with file_locks(getattr(config, attr) for attr in _LOCK_TARGETS.values()):
+        use_sqlite = _use_sqlite()
+        _batch_local.documents = {}
+        _batch_local.sqlite = use_sqlite
+        try:
+            if use_sqlite:
+                # 全文索引使用另一个连接，批内不能写入：先补齐，批内只读
+                search_index.sync(last_sequence(), iter_messages_after)
+                with sqlite_store.transaction():
+                    yield
+            else:
+                yield
+            documents = _batch_local.documents
+        finally:
+            _batch_local.documents = None
+        for file_path, (data, dirty) in documents.items():
+            if dirty:
+                save_json(file_path, data)
+
+
+@contextmanager
+def batch_call() -> Iterator[None]:
+    """
+    批量操作中的一个工具调用：抛出异常时撤销该调用的修改，之前调用的修改保留
+
+    - JSON 后端：恢复调用开始时批内各文件的数据（调用中才读取的文件直接丢弃，之后重新读取）；
+      已追加到消息日志的消息无法撤销
+    - SQLite 后端：调用在一个保存点中执行，出错时回滚到保存点
+
+    不在批量操作中时直接执行。
+    """
+    documents = _batch_documents()
+    if documents is None:
+        yield
+        return
+    saved = {path: [_snapshot(data), dirty] for path, (data, dirty) in documents.items()}
+    try:
+        if _batch_local.sqlite:
+            with sqlite_store.transaction():
+                yield
+        else:
+            yield
+    except BaseException:
+        documents.clear()
+        documents.update(saved)
+        raise
+
+
+def drop_unsaved_json_changes(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    执行阻塞函数；结束后丢弃本线程缓存中被原地修改却没有写回的文件
+
+    处理函数原地修改了读到的对象、没有 save_json 就返回（例如返回"错误: ..."）或抛出异常时，
+    缓存中的对象已被修改而文件没有变化（签名相同），不丢弃的话本线程之后会读到未保存的修改。
+    只比较本次调用读取或写入过的文件；未修改的缓存项保留，之后的调用仍然命中。
+    """
+    _handed_out().clear()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        cache = _json_cache()
+        for file_path in _handed_out():
+            entry = cache.get(file_path)
+            if entry is not None and entry[1] != entry[2]:
+                del cache[file_path]
+        _handed_out().clear()
+
+
+def get_json_cache_stats() -> dict:
+    """load_json 缓存统计：命中、未命中次数和当前线程缓存的文件数"""
+    return {**_json_cache_stats, "entries": len(_json_cache())}
+
+
+def clear_json_cache() -> None:
+    """清空所有线程的 load_json 缓存和统计"""
+    global _json_cache_generation
+    _json_cache_generation += 1
+    _json_cache_stats["hits"] = 0
+    _json_cache_stats["misses"] = 0
+
+
+# SQLite 后端中键值型数据的存储名 → 对应的 JSON 文件配置项
+_DOCUMENT_STORES = {
+    "agents": "AGENTS_FILE",
+    "sessions": "SESSIONS_FILE",
+    "groups": "GROUPS_FILE",
+    "standby": "STANDBY_FILE",
+    "employee_config": "EMPLOYEE_CONFIG_FILE",
+    "read_state": "READ_STATE_FILE",
+    "unread_counters": "UNREAD_COUNTERS_FILE",
+}
+
+# locked() 可用的存储名 → 对应数据文件的配置项（锁加在该文件旁的 .lock 文件上）
+_LOCK_TARGETS = {
+    **_DOCUMENT_STORES,
+    "tasks": "TASKS_FILE",
+    "messages": "MESSAGES_LOG_FILE",
+    "message_rollups": "MESSAGE_ROLLUPS_WATERMARK_FILE",
+}
+
+# 已检查过 JSON 数据导入的数据库路径
+_imported_databases: set = set()
+
+
+def _use_sqlite() -> bool:
+    """是否使用 SQLite 后端（首次使用时导入已有的 JSON 数据）"""
+    if config.STORAGE_BACKEND != "sqlite":
+        return False
+    db_file = config.SQLITE_DB_FILE
+    if db_file not in _imported_databases:
+        if sqlite_store.get_meta("imported") is None:
+            sqlite_store.import_data(
+                messages=message_log.load_messages(),
+                tasks=load_json(config.TASKS_FILE, []),
+                stores={
+                    store: load_json(getattr(config, attr), {})
+                    for store, attr in _DOCUMENT_STORES.items()
+                },
+            )
+        _imported_databases.add(db_file)
+    return True
+
+
+@contextmanager
+def locked(store: str) -> Iterator[None]:
+    """
+    跨进程独占一个存储，用于读-改-写
+
+    Args:
+        store: 存储名（agents、sessions、groups、standby、employee_config、read_state、
+            unread_counters、message_rollups、tasks、messages）
+
+    示例:
+        with locked("groups"):
+            groups = load_groups()
+            groups[group_id] = group
+            save_groups(groups)
+    """
+    with file_lock(getattr(config, _LOCK_TARGETS[store])):
+        yield
+
+
+def _load_document(store: str) -> dict:
+    """加载键值型数据"""
+    if _use_sqlite():
+        return sqlite_store.load_store(store)
+    return load_json(getattr(config, _DOCUMENT_STORES[store]), {})
+
 
+def _save_document(store: str, data: dict) -> None:
+    """保存键值型数据"""
+    if _use_sqlite():
+        sqlite_store.save_store(store, data)
+    else:
+        save_json(getattr(config, _DOCUMENT_STORES[store]), data)
 
-# 消息相关
+
+# 消息相关（JSON后端为追加写日志，见 message_log）
 def load_messages() -> list:
     """加载消息历史"""
-    return load_json(config.MESSAGES_FILE, [])
+    if _use_sqlite():
+        return sqlite_store.load_messages()
+    return message_log.load_messages()
 
 
 def save_messages(messages: list) -> None:
-    """保存消息历史"""
-    save_json(config.MESSAGES_FILE, messages)
+    """保存消息历史（整体重写）"""
+    if _use_sqlite():
+        sqlite_store.save_messages(messages)
+    else:
+        message_log.compact_messages(messages)
+    search_index.reset()
+
+
+def append_message(message: dict) -> dict:
+    """
+    追加一条消息（只写入这一条记录）
+
+    存储层在锁（或写事务）内分配严格递增的序列号 message["seq"]；
+    未提供 id 时生成兼容旧格式的 "<时间戳>_<seq>"；同时把 timestamp 规范化为
+    毫秒时间戳 message["timestamp_ms"]，按时间窗口查询时直接比较整数。
+
+    群组消息同时计入各成员的未读计数。写入后唤醒等待中的 standby（见 notify）。
+
+    Returns:
+        写入的消息（已带 seq、id 和 timestamp_ms）
+    """
+    if message.get("type") != "group":
+        stored = _append_message(message)
+    else:
+        with _counters_locked():
+            stored = _append_message(message)
+            _save_document("unread_counters", _load_unread_counters())
+    notify.notify_change()
+    return stored
+
+
+def _append_message(message: dict) -> dict:
+    if _use_sqlite():
+        return sqlite_store.append_message(message)
+    return message_log.append_message(message)
+
+
+def last_sequence() -> int:
+    """最近分配的消息序列号，可作为 query_messages(after_seq=...) 的续读游标"""
+    if _use_sqlite():
+        return sqlite_store.last_sequence()
+    return message_log.last_sequence()
+
+
+def iter_messages_reversed() -> Iterator[dict]:
+    """从最新到最旧逐条读取消息"""
+    if _use_sqlite():
+        return sqlite_store.query_messages()
+    return message_log.iter_messages_reversed()
+
+
+def count_messages() -> int:
+    """消息总数"""
+    if _use_sqlite():
+        return sqlite_store.count_messages()
+    return message_log.count_messages()
+
+
+def compact_messages() -> int:
+    """压缩消息存储"""
+    if _use_sqlite():
+        return sqlite_store.compact_messages()
+    return message_log.compact_messages()
+
+
+def iter_messages_after(after_seq: int) -> Iterator[dict]:
+    """按写入顺序读取序列号大于 after_seq 的消息"""
+    if _use_sqlite():
+        return sqlite_store.iter_messages_after(after_seq)
+    return message_log.iter_messages_after(after_seq)
+
+
+def _iter_messages_by_seq(seqs: Iterable[int]) -> Iterator[dict]:
+    if _use_sqlite():
+        return sqlite_store.iter_messages_by_seq(seqs)
+    return message_log.iter_messages_by_seq(seqs)
+
+
+def last_sequence_before(timestamp_ms: int) -> int:
+    """
+    时间窗口的起点：序列号不大于返回值的消息，时间都早于 timestamp_ms
+
+    JSON后端在时间索引上二分查找，SQLite后端使用 timestamp_ms 列的索引。
+    """
+    if _use_sqlite():
+        return sqlite_store.last_sequence_before(timestamp_ms)
+    return message_log.last_sequence_before(timestamp_ms)
+
+
+def message_time_ms(message: dict) -> Optional[int]:
+    """消息的毫秒时间戳（写入时规范化的 timestamp_ms，旧数据现场解析），无法解析时返回None"""
+    timestamp_ms = message.get("timestamp_ms")
+    if isinstance(timestamp_ms, int):
+        return timestamp_ms
+    return to_epoch_ms(message.get("timestamp"))
+
+
+def _contains_keyword(message: dict, keywords: list) -> bool:
+    content = message.get("content", "").lower()
+    return any(kw in content for kw in keywords)
+
+
+def query_messages(
+    recipients: Optional[Iterable[str]] = None,
+    msg_type: Optional[str] = None,
+    group_id: Optional[str] = None,
+    group_ids: Optional[Iterable[str]] = None,
+    after_seq: Optional[int] = None,
+    keywords: Optional[Iterable[str]] = None,
+    since_ms: Optional[int] = None,
+    before_seq: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    按条件查询消息，最新的在前
+
+    Args:
+        recipients: 只返回发给其中任一接收者的消息
+        msg_type: 消息类型（"private" 或 "group"，未设置type的消息视为private）
+        group_id: 只返回该群组的消息
+        group_ids: 只返回这些群组的消息（多个群组一次查询）
+        after_seq: 只返回序列号大于该值的消息（续读游标，见 last_sequence）
+        keywords: 只返回内容包含任一关键词的消息（不区分大小写）。
+            先由全文索引求出候选消息（见 search_index），与逐条检查内容的结果相同
+        since_ms: 只返回时间不早于该毫秒时间戳的消息（时间无法解析的消息总是返回）。
+            先由时间索引二分查找窗口起点（见 last_sequence_before），更早的消息不再读取
+        before_seq: 只返回序列号小于该值的消息（分页续读，见 encode_cursor）。
+            直接定位到该序列号开始读取，不重新读取已返回过的消息
+
+    Returns:
+        消息迭代器，调用方取够数量后即可停止
+    """
+    if group_id is not None:
+        group_ids = [group_id]
+    recipients = list(recipients) if recipients is not None else None
+    group_ids = list(group_ids) if group_ids is not None else None
+    if recipients == [] or group_ids == []:
+        return iter(())
+    keywords = [kw.lower() for kw in keywords] if keywords else None
+    if keywords and "" in keywords:
+        keywords = None  # 空关键词匹配任何内容
+    if since_ms is not None:
+        after_seq = max(after_seq or 0, last_sequence_before(since_ms))
+
+    if keywords and not _in_sqlite_batch():
+        sync_search_index()
+        # 单值的过滤条件作为范围词项参与倒排表求交集，其余条件读取后再过滤
+        required_terms = []
+        if msg_type is not None:
+            required_terms.append(search_index.type_term(msg_type))
+        if group_ids is not None and len(group_ids) == 1:
+            required_terms.append(search_index.group_term(group_ids[0]))
+        if msg_type == "private" and recipients is not None and len(recipients) == 1:
+            required_terms.append(search_index.recipient_term(recipients[0]))
+        seqs = search_index.iter_matching_seqs(keywords, required_terms, before_seq)
+        if seqs is not None:
+            return _filter_messages(
+                _iter_messages_by_seq(seqs),
+                recipients,
+                msg_type,
+                group_ids,
+                after_seq,
+                keywords,
+                since_ms,
+            )
+
+    if _use_sqlite():
+        found = sqlite_store.query_messages(
+            recipients, msg_type, group_ids, after_seq, since_ms, before_seq
+        )
+        if keywords:
+            found = (msg for msg in found if _contains_keyword(msg, keywords))
+        return found
+
+    if recipients is not None:
+        # 按收件箱索引只读取这些接收者的消息
+        source = message_log.iter_mailbox_reversed(recipients, msg_type, before_seq)
+    elif group_ids is not None:
+        # 只读取这些群组的分片
+        source = message_log.iter_group_messages_reversed(group_ids, before_seq)
+    elif msg_type == "private":
+        source = message_log.iter_private_messages_reversed(before_seq)
+    elif msg_type == "group":
+        # 全部群组的消息：按目录项的标志跳过私聊消息
+        source = message_log.iter_messages_reversed(
+            before_seq, after_seq=after_seq or 0, group_only=True
+        )
+    else:
+        source = message_log.iter_messages_reversed(before_seq)
+    return _filter_messages(
+        source, recipients, msg_type, group_ids, after_seq, keywords, since_ms
+    )
+
+
+def encode_cursor(seq: int) -> str:
+    """把上一页最后一条（最旧的）消息的序列号编码为不透明的分页游标"""
+    return base64.urlsafe_b64encode(f"seq:{seq}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[int]:
+    """解析分页游标，返回下一页的 before_seq；游标无效时返回None"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (ValueError, TypeError):
+        return None
+    prefix, _, seq = text.partition(":")
+    if prefix != "seq" or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+def _filter_messages(
+    source: Iterator[dict],
+    recipients: Optional[list],
+    msg_type: Optional[str],
+    group_ids: Optional[list],
+    after_seq: Optional[int],
+    keywords: Optional[list],
+    since_ms: Optional[int] = None,
+) -> Iterator[dict]:
+    """按查询条件过滤从新到旧排列的消息"""
+    wanted = set(recipients) if recipients is not None else None
+    wanted_groups = set(group_ids) if group_ids is not None else None
+    for msg in source:
+        if after_seq is not None and msg.get("seq", 0) <= after_seq:
+            break  # 按序列号从新到旧，更早的消息都不满足
+        if msg_type is not None and msg.get("type", "private") != msg_type:
+            continue
+        if wanted_groups is not None and msg.get("group_id") not in wanted_groups:
+            continue
+        if wanted is not None and wanted.isdisjoint(msg.get("recipients", [])):
+            continue
+        if keywords and not _contains_keyword(msg, keywords):
+            continue
+        if since_ms is not None:
+            timestamp_ms = message_time_ms(msg)
+            if timestamp_ms is not None and timestamp_ms < since_ms:
+                continue
+        yield msg
+
+
+def sync_search_index() -> int:
+    """把全文索引补齐到最新消息，返回新加入索引的消息数（SQLite 批量操作中推迟到下次查询）"""
+    if _in_sqlite_batch():
+        return 0
+    return search_index.sync(last_sequence(), iter_messages_after)
+
+
+def search_messages(
+    query: str,
+    limit: int = 10,
+    group_id: Optional[str] = None,
+    sender: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    visible_to: Optional[str] = None,
+) -> list:
+    """
+    按 BM25 相关度全文检索消息（内容、话题、发送者）
+
+    Args:
+        query: 查询文本
+        limit: 返回的结果数
+        group_id: 只检索该群组的消息
+        sender: 只检索该发送者的消息
+        since: 只检索该时间及之后的消息（ISO格式）
+        until: 只检索该时间之前的消息（ISO格式）
+        visible_to: 只检索该代理能看到的消息：发给他（或所有人）的私聊、
+            他发送的消息、他所在群组的消息
+
+    Returns:
+        [(消息, 得分), ...]，相关度从高到低
+    """
+    sync_search_index()
+    viewer_groups = ()
+    if visible_to is not None:
+        viewer_groups = groups_of(visible_to)
+    hits = search_index.search(
+        query,
+        limit,
+        group_id=group_id,
+        sender=sender,
+        since=search_index.to_epoch(since),
+        until=search_index.to_epoch(until),
+        viewer=visible_to,
+        viewer_groups=viewer_groups,
+    )
+    messages = {msg["seq"]: msg for msg in _iter_messages_by_seq(seq for seq, _ in hits)}
+    return [(messages[seq], score) for seq, score in hits if seq in messages]
+
+
+def rebuild_search_index() -> int:
+    """从头重建全文索引，返回建立索引的消息数量"""
+    search_index.reset()
+    return sync_search_index()
+
+
+def rebuild_mailboxes() -> int:
+    """重建"接收者 → 消息"索引，返回建立索引的消息数量"""
+    if _use_sqlite():
+        return sqlite_store.rebuild_recipient_index()
+    return message_log.rebuild_mailboxes()
+
+
+def check_mailboxes() -> dict:
+    """检查"接收者 → 消息"索引与消息数据是否一致（结果中 ok 为 False 时应重建）"""
+    if _use_sqlite():
+        return sqlite_store.check_recipient_index()
+    return message_log.check_mailboxes()
+
+
+def detach_group_messages(group_id: str, destination: Path) -> int:
+    """
+    把群组的消息分片整体移出数据目录（JSON 后端，用于已归档的群组）
+
+    移出后该群组的消息不再出现在任何查询中，未读计数随之重算。
+
+    Returns:
+        移出的消息数量
+    """
+    if _use_sqlite():
+        raise RuntimeError("SQLite 后端的消息保存在同一个数据库中，没有可移出的分片")
+    count = message_log.detach_group(group_id, destination)
+    if count:
+        rebuild_unread_counters()
+        with locked("message_rollups"):
+            _rollup_file(group_id).unlink(missing_ok=True)
+    return count
+
+
+def find_message(message_id: str) -> Optional[dict]:
+    """按ID查找消息（JSON 后端经由ID索引定位，不扫描历史）"""
+    if _use_sqlite():
+        return sqlite_store.find_message(message_id)
+    return message_log.find_message(message_id)
+
+
+def find_replies(message_id: str) -> list:
+    """回复该消息的全部消息，按序列号顺序（经由回复索引，不扫描群组的其他消息）"""
+    if _use_sqlite():
+        return sqlite_store.find_replies(message_id)
+    return message_log.find_replies(message_id)
+
+
+def update_messages(updated: list) -> None:
+    """
+    按ID写回已修改的消息（消息应来自 find_message 等读取，带有 seq）
+
+    JSON 后端只追加这些消息的新版本（见 message_log.update_messages）；
+    改动了ID、类型、群组、接收者、时间或回复对象的消息仍通过整体重写写回。
+    """
+    if not updated:
+        return
+    if _use_sqlite():
+        sqlite_store.update_messages(updated)
+        return
+    with locked("messages"):
+        rejected = message_log.update_messages(updated)
+        if not rejected:
+            return
+        by_id = {m.get("id"): m for m in rejected}
+        messages = message_log.load_messages()
+        for i, msg in enumerate(messages):
+            if msg.get("id") in by_id:
+                messages[i] = by_id[msg.get("id")]
+        message_log.compact_messages(messages)
+
+
+def iter_recipient_seqs_reversed(recipients: Iterable[str], after_seq: int = 0) -> Iterator[int]:
+    """从新到旧返回发给任一接收者、序列号大于 after_seq 的消息序列号（只读索引）"""
+    if _use_sqlite():
+        return sqlite_store.iter_recipient_seqs_reversed(recipients, after_seq)
+    return message_log.iter_mailbox_seqs_reversed(recipients, after_seq)
+
+
+# 已读状态
+# 每个代理一条记录 {"hwm": 高水位序列号, "read": [高于水位的已读序列号]}：
+# 序列号不超过水位的消息都已读，水位之上只记录少量例外。
+# 旧数据中消息自带的 read 字典仍然有效。
+def load_read_state(agent: str) -> dict:
+    """
+    加载代理的已读状态
+
+    Returns:
+        {"hwm": 高水位序列号, "read": 高于水位的已读序列号集合}
+    """
+    return _read_state_of(_load_document("read_state"), agent)
+
+
+def _read_state_of(states: dict, agent: str) -> dict:
+    state = states.get(agent, {})
+    return {"hwm": state.get("hwm", 0), "read": set(state.get("read", []))}
+
+
+def is_message_read(message: dict, read_state: dict, agent: str) -> bool:
+    """消息是否已被代理读过（O(1)）"""
+    seq = message.get("seq")
+    if isinstance(seq, int) and (seq <= read_state["hwm"] or seq in read_state["read"]):
+        return True
+    return message.get("read", {}).get(agent, False) is True
+
+
+def is_message_unread(message: dict, read_state: dict, agent: str) -> bool:
+    """消息是否发给了代理（或所有人）且尚未读过（O(1)）"""
+    recipients = message.get("recipients", [])
+    if agent not in recipients and "*" not in recipients:
+        return False
+    return not is_message_read(message, read_state, agent)
+
+
+def mark_messages_read(agent: str, messages: Iterable[dict]) -> None:
+    """
+    把消息标记为代理已读
+
+    只写入该代理的已读状态，不改动消息本身。所有发给该代理的消息
+    都已读到某个序列号时，水位前移并丢弃其下的例外。新读到的群组消息
+    从未读计数中扣除。
+    """
+    with _counters_locked():
+        counters = _load_unread_counters()
+        groups = load_groups()
+        states = _load_document("read_state")
+        old_state = _read_state_of(states, agent)
+        hwm = old_state["hwm"]
+        read = set(old_state["read"])
+        for m in {m["seq"]: m for m in messages if isinstance(m.get("seq"), int)}.values():
+            if not is_message_unread(m, old_state, agent):
+                continue
+            read.add(m["seq"])
+            if m.get("type") == "group" and _is_member(groups, m.get("group_id"), agent):
+                _apply_counts(counters["counts"], agent, m, -1)
+
+        pending = list(iter_recipient_seqs_reversed([agent, "*"], hwm))
+        for seq in reversed(pending):
+            if seq not in read:
+                break
+            hwm = seq
+
+        states[agent] = {"hwm": hwm, "read": sorted(s for s in read if s > hwm)}
+        _save_document("read_state", states)
+        _save_document("unread_counters", counters)
+
+
+# 未读计数
+# {"seq": 已计入的最大消息序列号,
+#  "counts": {代理: {群组ID: {"unread": n, "mentions": n, "important": n}}},
+#  "last": {群组ID: 最新消息摘要（见 _last_message_summary）}}
+# 只为群组的当前成员计数，计数全为0的项不保存。发送群组消息、标记已读和
+# 成员变化时增量更新；seq 落后于消息存储时（如写入中途中断或旧数据），
+# 下次访问时补计其后的消息。各群组的最新消息摘要随计数一起维护，
+# list_groups 显示预览时不再读取消息。
+_COUNTER_FIELDS = ("unread", "mentions", "important")
+
+# 最新消息摘要中保留的内容长度
+LAST_MESSAGE_PREVIEW_LENGTH = 100
+
+
+@contextmanager
+def _counters_locked() -> Iterator[None]:
+    """修改未读计数所需的全部锁（固定顺序获取，避免死锁）"""
+    with locked("groups"), locked("read_state"), locked("messages"), locked("unread_counters"):
+        yield
+
+
+def _is_member(groups: dict, group_id: Optional[str], agent: str) -> bool:
+    return group_index(groups).is_member(group_id, agent)
+
+
+def _apply_counts(counts: dict, agent: str, message: dict, delta: int) -> None:
+    """把一条未读群组消息计入（delta=1）或移出（delta=-1）代理的计数"""
+    agent_counts = counts.setdefault(agent, {})
+    entry = agent_counts.setdefault(message.get("group_id"), dict.fromkeys(_COUNTER_FIELDS, 0))
+    entry["unread"] += delta
+    if agent in message.get("mentions", []):
+        entry["mentions"] += delta
+    if message.get("importance") == "high":
+        entry["important"] += delta
+    if not any(entry.values()):
+        del agent_counts[message.get("group_id")]
+    if not agent_counts:
+        del counts[agent]
+
+
+def _last_message_summary(message: dict) -> dict:
+    return {
+        "seq": message.get("seq", 0),
+        "id": message.get("id"),
+        "sender": message.get("sender"),
+        "timestamp": message.get("timestamp", ""),
+        "preview": message.get("content", "")[:LAST_MESSAGE_PREVIEW_LENGTH],
+    }
+
+
+def _find_last_messages(groups: dict) -> dict:
+    """各群组的最新消息摘要（每个群组只读取最新的一条）"""
+    last = {}
+    for group_id in groups:
+        for msg in query_messages(msg_type="group", group_id=group_id):
+            last[group_id] = _last_message_summary(msg)
+            break
+    return last
+
+
+def _count_group_messages(
+    counts: dict,
+    groups: dict,
+    read_states: dict,
+    group_id: Optional[str] = None,
+    agent: Optional[str] = None,
+    after_seq: Optional[int] = None,
+    last: Optional[dict] = None,
+    before_seq: Optional[int] = None,
+) -> None:
+    """
+    把群组消息计入当前成员的未读计数（可只统计一个群组或一个代理）
+
+    提供 last 时同时用这些消息更新其中各群组的最新消息摘要。
+    """
+    index = group_index(groups)
+    for msg in query_messages(
+        msg_type="group", group_id=group_id, after_seq=after_seq, before_seq=before_seq
+    ):
+        if last is not None:
+            current = last.get(msg.get("group_id"))
+            if current is None or msg.get("seq", 0) > current["seq"]:
+                last[msg.get("group_id")] = _last_message_summary(msg)
+        members = index.members.get(msg.get("group_id"), frozenset())
+        for member in [agent] if agent is not None else members:
+            if member in members and is_message_unread(
+                msg, _read_state_of(read_states, member), member
+            ):
+                _apply_counts(counts, member, msg, 1)
+
+
+def _catch_up_counters(stored: dict) -> dict:
+    """补计保存的未读计数之后的群组消息，返回新的计数（不修改 stored）"""
+    groups = load_groups()
+    counters = {
+        "seq": stored.get("seq", 0),
+        "counts": json.loads(json.dumps(stored.get("counts", {}))),
+        # 旧数据没有最新消息摘要时逐个群组补齐
+        "last": dict(stored["last"]) if "last" in stored else _find_last_messages(groups),
+    }
+    last = last_sequence()
+    if counters["seq"] < last:
+        _count_group_messages(
+            counters["counts"],
+            groups,
+            _load_document("read_state"),
+            after_seq=counters["seq"],
+            last=counters["last"],
+            before_seq=last + 1,
+        )
+        counters["seq"] = last
+    return counters
+
+
+def _load_unread_counters() -> dict:
+    """加载未读计数并补计尚未计入的消息（调用方持有 _counters_locked）"""
+    return _catch_up_counters(_load_document("unread_counters"))
+
+
+def _compute_unread_counters() -> dict:
+    """由消息、已读状态和群组成员从头计算未读计数（调用方持有 _counters_locked）"""
+    seq = last_sequence()
+    counts: dict = {}
+    last: dict = {}
+    _count_group_messages(counts, load_groups(), _load_document("read_state"), last=last)
+    return {"seq": seq, "counts": counts, "last": last}
+
+
+def _current_counters() -> dict:
+    """
+    当前的未读计数
+
+    计数只由修改它的操作（群组消息、已读状态、成员变化）在锁内保存；私聊消息不影响计数，
+    保存的 seq 落后于消息存储时读者只在内存中补计（通常只需跳过之后的私聊消息），
+    不加锁也不写文件。旧数据还没有最新消息摘要时补齐并保存一次。
+    """
+    stored = _load_document("unread_counters")
+    if "last" not in stored:
+        with _counters_locked():
+            stored = _load_unread_counters()
+            _save_document("unread_counters", stored)
+    elif stored.get("seq", 0) < last_sequence():
+        stored = _catch_up_counters(stored)
+    return stored
+
+
+def load_unread_counts(agent: str) -> dict:
+    """
+    代理在各群组的未读计数
+
+    Returns:
+        群组ID → {"unread": 未读数, "mentions": @我的未读数, "important": 重要未读数}，
+        没有未读的群组不出现
+    """
+    return _current_counters().get("counts", {}).get(agent, {})
+
+
+def load_last_messages() -> dict:
+    """
+    各群组的最新消息摘要（随未读计数维护，不读取消息）
+
+    Returns:
+        群组ID → {"seq", "id", "sender", "timestamp", "preview": 内容的前100个字符}，
+        没有消息的群组不出现
+    """
+    return _current_counters().get("last", {})
+
+
+def refresh_unread_counts(agent: str, group_id: str) -> None:
+    """成员变化后重新统计代理在一个群组的未读计数（离开群组时清除）"""
+    with _counters_locked():
+        counters = _load_unread_counters()
+        agent_counts = counters["counts"].get(agent, {})
+        agent_counts.pop(group_id, None)
+        if not agent_counts:
+            counters["counts"].pop(agent, None)
+        groups = load_groups()
+        if _is_member(groups, group_id, agent):
+            read_states = _load_document("read_state")
+            _count_group_messages(
+                counters["counts"],
+                groups,
+                read_states,
+                group_id=group_id,
+                agent=agent,
+                after_seq=_read_state_of(read_states, agent)["hwm"],
+            )
+        _save_document("unread_counters", counters)
+
+
+def rebuild_unread_counters() -> int:
+    """从头重建未读计数，返回有未读的 (代理, 群组) 数量"""
+    with _counters_locked():
+        counters = _compute_unread_counters()
+        _save_document("unread_counters", counters)
+    return sum(len(groups) for groups in counters["counts"].values())
+
+
+def check_unread_counters() -> dict:
+    """
+    从头重新计算未读计数并与保存的计数比较
+
+    Returns:
+        {"ok": 是否一致, "checked": 比较的 (代理, 群组) 数量,
+         "drift": [{"agent", "group_id", "stored", "actual"}, ...],
+         "stale_last_messages": 最新消息摘要与实际不符的群组ID}
+    """
+    with _counters_locked():
+        stored_counters = _load_unread_counters()
+        actual_counters = _compute_unread_counters()
+    stored, actual = stored_counters["counts"], actual_counters["counts"]
+    zero = dict.fromkeys(_COUNTER_FIELDS, 0)
+    keys = {(a, g) for counts in (stored, actual) for a in counts for g in counts[a]}
+    drift = []
+    for agent, group_id in sorted(keys):
+        stored_entry = stored.get(agent, {}).get(group_id, zero)
+        actual_entry = actual.get(agent, {}).get(group_id, zero)
+        if stored_entry != actual_entry:
+            drift.append(
+                {
+                    "agent": agent,
+                    "group_id": group_id,
+                    "stored": stored_entry,
+                    "actual": actual_entry,
+                }
+            )
+    stale = sorted(
+        gid
+        for gid in set(stored_counters["last"]) | set(actual_counters["last"])
+        if stored_counters["last"].get(gid) != actual_counters["last"].get(gid)
+    )
+    return {
+        "ok": not drift and not stale,
+        "checked": len(keys),
+        "drift": drift,
+        "stale_last_messages": stale,
+    }
+
+
+# 群组消息统计汇总
+# 每个群组一份按时间分桶的汇总（见 message_rollups），另记录已全部计入的最大消息序列号。
+# 与全文索引一样在查询时补计其后的新消息，发送消息时不需要额外写入；每个群组的汇总
+# 也记录自己计入到的序列号（"seq"），补计中途中断时不会重复计入。
+def _rollup_file(group_id: str) -> Path:
+    return config.MESSAGE_ROLLUPS_DIR / f"{group_id}.json"
+
+
+def _rollup_seq() -> int:
+    if _use_sqlite():
+        return int(sqlite_store.get_meta("rollups_seq") or 0)
+    return load_json(config.MESSAGE_ROLLUPS_WATERMARK_FILE, {}).get("seq", 0)
+
+
+def _load_rollup(group_id: str) -> dict:
+    if _use_sqlite():
+        stored = sqlite_store.load_rollup(group_id)
+    else:
+        stored = load_json(_rollup_file(group_id))
+    return stored or {"seq": 0, **message_rollups.empty_rollup()}
+
+
+def _save_rollups(rollups: dict, seq: int) -> None:
+    if _use_sqlite():
+        sqlite_store.save_rollups(rollups, seq)
+        return
+    for group_id, rollup in rollups.items():
+        save_json(_rollup_file(group_id), rollup)
+    save_json(config.MESSAGE_ROLLUPS_WATERMARK_FILE, {"seq": seq})
+
+
+def _catch_up_rollups() -> None:
+    """把尚未计入的群组消息计入各群组的汇总（调用方持有 locked("message_rollups")）"""
+    seq = _rollup_seq()
+    last = last_sequence()
+    if seq >= last:
+        return
+    touched: dict = {}
+    folded: dict = {}  # 群组ID → 该群组汇总原先计入到的序列号
+    # 只计入到 last 为止：锁不阻止追加，之后的消息留给下次补计，否则会被计入两次
+    for msg in query_messages(msg_type="group", after_seq=seq, before_seq=last + 1):
+        group_id = msg.get("group_id")
+        timestamp_ms = message_time_ms(msg)
+        if not group_id or timestamp_ms is None:
+            continue
+        if group_id not in touched:
+            touched[group_id] = _load_rollup(group_id)
+            folded[group_id] = touched[group_id]["seq"]
+        if msg.get("seq", 0) > folded[group_id]:
+            message_rollups.fold(touched[group_id], msg, timestamp_ms)
+    now_ms = round(time.time() * 1000)
+    for rollup in touched.values():
+        rollup["seq"] = last
+        message_rollups.compact(rollup, now_ms)
+    _save_rollups(touched, last)
+
+
+def group_message_stats(group_id: str, since_ms: int) -> dict:
+    """
+    群组中不早于 since_ms 的消息统计
+
+    合并窗口内按小时/按天汇总的桶，只按序列号范围逐条读取跨越窗口起点的那个桶中的消息，
+    耗时与该群组的桶数而不是消息数成正比。时间无法解析的消息不计入。
+
+    Returns:
+        {"count": 消息数, "senders": {发送者: 消息数}, "topics": {话题: 消息数},
+         "importance": {重要性: 消息数}, "mentions": {被@的代理: 次数}}
+    """
+    if _rollup_seq() < last_sequence():
+        with locked("message_rollups"):
+            _catch_up_rollups()
+    stats, head = message_rollups.window(_load_rollup(group_id), since_ms)
+    if head is not None:
+        end_ms, min_seq, max_seq = head
+        for msg in query_messages(
+            msg_type="group", group_id=group_id, after_seq=min_seq - 1, before_seq=max_seq + 1
+        ):
+            timestamp_ms = message_time_ms(msg)
+            if timestamp_ms is not None and since_ms <= timestamp_ms < end_ms:
+                message_rollups.add_message(stats, msg)
+    return stats
 
 
 # 代理相关
 def load_agents() -> dict:
     """加载代理列表"""
-    return load_json(config.AGENTS_FILE, {})
+    return _load_document("agents")
 
 
 def save_agents(agents: dict) -> None:
     """保存代理列表"""
-    save_json(config.AGENTS_FILE, agents)
+    _save_document("agents", agents)
 
 
 # 会话相关
 def load_sessions() -> dict:
     """加载会话信息"""
-    return load_json(config.SESSIONS_FILE, {})
+    return _load_document("sessions")
 
 
 def save_sessions(sessions: dict) -> None:
     """保存会话信息"""
-    save_json(config.SESSIONS_FILE, sessions)
+    _save_document("sessions", sessions)
 
 
 # 任务相关
 def load_tasks() -> list:
     """加载任务列表"""
+    if _use_sqlite():
+        return sqlite_store.load_tasks()
     return load_json(config.TASKS_FILE, [])
 
 
 def save_tasks(tasks: list) -> None:
     """保存任务列表"""
-    save_json(config.TASKS_FILE, tasks)
+    if _use_sqlite():
+        sqlite_store.save_tasks(tasks)
+    else:
+        save_json(config.TASKS_FILE, tasks)
+
+
+def count_tasks() -> int:
+    """任务总数"""
+    if _use_sqlite():
+        return sqlite_store.count_tasks()
+    return len(load_tasks())
+
+
+def query_tasks(
+    assignee: Optional[str] = None, statuses: Optional[Iterable[str]] = None
+) -> list:
+    """
+    按负责人、状态查询任务
+
+    Args:
+        assignee: 负责人，None表示不限
+        statuses: 状态列表，None表示不限
+
+    Returns:
+        任务列表（按创建顺序）
+    """
+    if _use_sqlite():
+        return sqlite_store.query_tasks(assignee, statuses)
+    wanted = set(statuses) if statuses is not None else None
+    return [
+        t
+        for t in load_tasks()
+        if (assignee is None or t.get("assignee") == assignee)
+        and (wanted is None or t.get("status") in wanted)
+    ]
+
+
+def get_task(task_id: str) -> Optional[dict]:
+    """按ID获取任务"""
+    if _use_sqlite():
+        return sqlite_store.get_task(task_id)
+    return next((t for t in load_tasks() if t.get("id") == task_id), None)
+
+
+def add_task(task: dict) -> None:
+    """新增任务（写入后唤醒等待中的 standby）"""
+    if _use_sqlite():
+        sqlite_store.add_task(task)
+    else:
+        with locked("tasks"):
+            tasks = load_tasks()
+            tasks.append(task)
+            save_tasks(tasks)
+    notify.notify_change()
+
+
+def update_task(task: dict) -> None:
+    """按ID写回单个任务（写入后唤醒等待中的 standby）"""
+    if _use_sqlite():
+        sqlite_store.update_task(task)
+    else:
+        with locked("tasks"):
+            tasks = load_tasks()
+            for i, t in enumerate(tasks):
+                if t.get("id") == task.get("id"):
+                    tasks[i] = task
+                    break
+            save_tasks(tasks)
+    notify.notify_change()
+
+
+def delete_task(task_id: str) -> None:
+    """永久删除任务"""
+    if _use_sqlite():
+        sqlite_store.delete_task(task_id)
+        return
+    with locked("tasks"):
+        save_tasks([t for t in load_tasks() if t.get("id") != task_id])
 
 
 # 群组相关
+class GroupIndex:
+    """
+    群组成员索引（由群组数据构建，不持久化）
+
+    - members: 群组ID → 成员集合
+    - groups_of(agent): 代理所在的群组ID（按群组数据中的顺序）
+    """
+
+    def __init__(self, groups: dict) -> None:
+        self.members = {gid: frozenset(g.get("members", [])) for gid, g in groups.items()}
+        self._groups_of: dict = {}
+        for gid, members in self.members.items():
+            for agent in members:
+                self._groups_of.setdefault(agent, {})[gid] = None
+
+    def is_member(self, group_id: Optional[str], agent: str) -> bool:
+        return agent in self.members.get(group_id, ())
+
+    def groups_of(self, agent: str) -> list:
+        return list(self._groups_of.get(agent, ()))
+
+
+# 本线程最近一次构建的索引：(缓存代数, 群组数据, 索引)
+_group_index_local = threading.local()
+
+
+def group_index(groups: dict) -> GroupIndex:
+    """
+    群组数据的成员索引
+
+    JSON 后端的 load_groups 在文件未变化时返回同一个对象，索引随之复用，
+    save_groups 保存后立即按新数据重建；"我所在的群组"因此只是一次字典查找。
+    """
+    entry = getattr(_group_index_local, "entry", None)
+    if entry is not None and entry[0] == _json_cache_generation and entry[1] is groups:
+        return entry[2]
+    index = GroupIndex(groups)
+    _group_index_local.entry = (_json_cache_generation, groups, index)
+    return index
+
+
 def load_groups() -> dict:
     """加载群组信息"""
-    return load_json(config.GROUPS_FILE, {})
+    return _load_document("groups")
 
 
 def save_groups(groups: dict) -> None:
-    """保存群组信息"""
-    save_json(config.GROUPS_FILE, groups)
+    """保存群组信息（同时重建成员索引：create/join/leave/archive 都经由这里）"""
+    _save_document("groups", groups)
+    _group_index_local.entry = (_json_cache_generation, groups, GroupIndex(groups))
+
+
+def groups_of(agent: str, status: Optional[str] = None) -> list:
+    """代理所在的群组ID（status 不为 None 时只返回该状态的群组）"""
+    groups = load_groups()
+    group_ids = group_index(groups).groups_of(agent)
+    if status is None:
+        return group_ids
+    return [gid for gid in group_ids if groups[gid].get("status", "active") == status]
 
 
 # 待命相关
 def load_standby() -> dict:
     """加载待命状态"""
-    return load_json(config.STANDBY_FILE, {})
+    return _load_document("standby")
 
 
 def save_standby(standby_states: dict) -> None:
     """保存待命状态"""
-    save_json(config.STANDBY_FILE, standby_states)
+    _save_document("standby", standby_states)
 
 
 # 员工配置
 def load_employee_config() -> dict:
     """加载员工配置"""
-    return load_json(config.EMPLOYEE_CONFIG_FILE, {})
+    return _load_document("employee_config")
 
 
 def save_employee_config(config_data: dict) -> None:
     """保存员工配置"""
-    save_json(config.EMPLOYEE_CONFIG_FILE, config_data)
+    _save_document("employee_config", config_data)
@@ -6,6 +6,10 @@ MCP AI Chat Group - Handlers Module
 from typing import Any
 from mcp.types import TextContent
 
+from ..core import metrics
+from ..core.io_executor import run_io
+from ..core.storage import batch, batch_call
+
 # 导入所有处理器
 from .message_handler import (
     handle_send_message,
@@ -15,6 +19,7 @@ from .message_handler import (
     handle_request_review,
     handle_notify_completion,
     handle_share_code_snippet,
+    handle_search_messages,
 )
 
 from .task_handler import (
@@ -37,6 +42,7 @@ from .group_handler import (
     handle_archive_group,
     handle_pin_message,
     handle_unpin_message,
+    handle_get_thread,
 )
 
 from .system_handler import (
@@ -45,12 +51,76 @@ from .system_handler import (
     handle_get_current_session,
     handle_list_agents,
     handle_standby,
+    handle_get_server_metrics,
+    handle_profile_tool_calls,
 )
 
 
+# 一次批量调用最多包含的工具调用数
+MAX_BATCH_CALLS = 20
+
+# 不能放进批量调用的工具：standby 会长时间阻塞（批量执行期间持有全部存储锁），batch 不能嵌套
+_BATCH_EXCLUDED = {"standby", "batch"}
+
+
+async def handle_batch(arguments: dict[str, Any]) -> list[TextContent]:
+    """处理batch工具：在一次请求中按顺序执行多个工具调用"""
+    calls = arguments.get("calls", [])
+
+    if not isinstance(calls, list) or not calls:
+        return [TextContent(type="text", text="错误: 必须提供 calls 列表")]
+    if len(calls) > MAX_BATCH_CALLS:
+        return [
+            TextContent(
+                type="text", text=f"错误: 一次最多批量执行 {MAX_BATCH_CALLS} 个工具调用"
+            )
+        ]
+    for i, call in enumerate(calls, 1):
+        if not isinstance(call, dict) or not isinstance(call.get("arguments", {}), dict):
+            return [
+                TextContent(
+                    type="text", text=f"错误: 第 {i} 项必须是 {{tool, arguments}} 对象"
+                )
+            ]
+        tool = call.get("tool")
+        if tool in _BATCH_EXCLUDED:
+            return [TextContent(type="text", text=f"错误: {tool} 不能在 batch 中调用")]
+        if tool not in TOOL_HANDLERS:
+            return [TextContent(type="text", text=f"错误: 第 {i} 项是未知工具 '{tool}'")]
+
+    return await run_io(_run_batch, calls)
+
+
+def _run_batch(calls: list) -> list[TextContent]:
+    """
+    在同一个 I/O 线程中依次执行（见 storage.batch）：所有调用读取同一个快照，
+    写入在全部调用结束后一起提交。某个调用抛出异常时撤销该调用的修改
+    （见 storage.batch_call）并停止执行后续调用，之前的调用照常提交。
+    """
+    results = []
+    with batch():
+        for i, call in enumerate(calls, 1):
+            tool = call["tool"]
+            header = f"[{i}/{len(calls)}] {tool}"
+            try:
+                # 直接调用 blocking_handler 包装前的同步函数，不再为每个调用切换线程
+                with batch_call():
+                    contents = TOOL_HANDLERS[tool].__wrapped__(call.get("arguments") or {})
+            except Exception as e:
+                results.append(TextContent(type="text", text=f"{header}\n❌ 错误: {e}"))
+                if i < len(calls):
+                    results.append(
+                        TextContent(type="text", text=f"⏭️ 已跳过后续 {len(calls) - i} 个调用")
+                    )
+                break
+            text = "\n".join(content.text for content in contents)
+            results.append(TextContent(type="text", text=f"{header}\n{text}"))
+    return results
+
+
 # 工具名称 → 处理函数映射表
 TOOL_HANDLERS = {
-    # 消息工具 (7个)
+    # 消息工具 (8个)
     "send_message": handle_send_message,
     "receive_messages": handle_receive_messages,
     "mark_messages_read": handle_mark_messages_read,
@@ -58,13 +128,14 @@ TOOL_HANDLERS = {
     "request_review": handle_request_review,
     "notify_completion": handle_notify_completion,
     "share_code_snippet": handle_share_code_snippet,
+    "search_messages": handle_search_messages,
     # 任务工具 (5个)
     "create_task": handle_create_task,
     "assign_task": handle_assign_task,
     "update_task_status": handle_update_task_status,
     "get_tasks": handle_get_tasks,
     "delete_task": handle_delete_task,
-    # 群组工具 (11个)
+    # 群组工具 (12个)
     "create_group": handle_create_group,
     "send_group_message": handle_send_group_message,
     "receive_group_messages": handle_receive_group_messages,
@@ -76,12 +147,16 @@ TOOL_HANDLERS = {
     "archive_group": handle_archive_group,
     "pin_message": handle_pin_message,
     "unpin_message": handle_unpin_message,
-    # 系统工具 (5个)
+    "get_thread": handle_get_thread,
+    # 系统工具 (8个)
     "register_agent": handle_register_agent,
     "set_employee_config": handle_set_employee_config,
     "get_current_session": handle_get_current_session,
     "list_agents": handle_list_agents,
     "standby": handle_standby,
+    "batch": handle_batch,
+    "get_server_metrics": handle_get_server_metrics,
+    "profile_tool_calls": handle_profile_tool_calls,
 }
 
 
@@ -100,8 +175,17 @@ async def handle_tool_call(name: str, arguments: dict[str, Any]) -> list[TextCon
     handler = TOOL_HANDLERS.get(name)
 
     if handler:
-        # 调用处理函数
-        return await handler(arguments)
+        # 调用处理函数，记录调用次数、错误、延迟和读写字节数
+        with metrics.track_call(name) as call:
+            result = await handler(arguments)
+            call.output_chars = sum(len(getattr(content, "text", "")) for content in result)
+            call.error = metrics.is_error_result(result)
+        if metrics.textfile_due():
+            try:
+                await run_io(metrics.write_textfile)
+            except OSError:
+                pass
+        return result
     else:
         # 未找到处理器
         return [
@@ -112,4 +196,4 @@ async def handle_tool_call(name: str, arguments: dict[str, Any]) -> list[TextCon
         ]
 
 
-__all__ = ["handle_tool_call", "TOOL_HANDLERS"]
+__all__ = ["handle_tool_call", "handle_batch", "TOOL_HANDLERS"]
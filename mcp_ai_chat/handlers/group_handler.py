@@ -14,8 +14,10 @@ Group Handler
 - archive_group: 归档群组
 - pin_message: 置顶消息
 - unpin_message: 取消置顶
+- get_thread: 查看会话串（回复树）
 """
 
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
 from mcp.types import TextContent
@@ -25,14 +27,31 @@ from typing import Any
 from ..core.storage import (
     load_groups,
     save_groups,
-    load_messages,
-    save_messages,
+    group_index,
+    append_message,
+    query_messages,
+    find_message,
+    find_replies,
+    update_messages,
     load_sessions,
+    load_read_state,
+    is_message_read,
+    is_message_unread,
+    load_unread_counts,
+    load_last_messages,
+    group_message_stats,
+    refresh_unread_counts,
+    locked,
+    encode_cursor,
+    decode_cursor,
 )
+from ..core.io_executor import blocking_handler
 from ..core.session import get_current_agent, get_current_session_id
+from ..utils.time_utils import parse_time_range, to_epoch_ms
 
 
-async def handle_create_group(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_create_group(arguments: dict[str, Any]) -> list[TextContent]:
     """处理create_group工具"""
     name = arguments.get("name", "")
     description = arguments.get("description", "")
@@ -41,24 +60,26 @@ async def handle_create_group(arguments: dict[str, Any]) -> list[TextContent]:
     if not name or not members:
         return [TextContent(type="text", text="错误: 必须提供群组名称和成员列表")]
 
-    groups = load_groups()
-    group_id = f"GROUP_{datetime.now().strftime('%Y%m%d%H%M%S')}_{len(groups)}"
     creator = get_current_agent()
     session_id = get_current_session_id()
 
-    new_group = {
-        "name": name,
-        "description": description,
-        "creator": creator,
-        "creator_session_id": session_id,
-        "members": list(set(members)),  # 去重
-        "created_at": datetime.now().isoformat(),
-        "active": True,
-        "status": "active",  # P1新增
-    }
+    with locked("groups"):
+        groups = load_groups()
+        group_id = f"GROUP_{datetime.now().strftime('%Y%m%d%H%M%S')}_{len(groups)}"
+
+        new_group = {
+            "name": name,
+            "description": description,
+            "creator": creator,
+            "creator_session_id": session_id,
+            "members": list(set(members)),  # 去重
+            "created_at": datetime.now().isoformat(),
+            "active": True,
+            "status": "active",  # P1新增
+        }
 
-    groups[group_id] = new_group
-    save_groups(groups)
+        groups[group_id] = new_group
+        save_groups(groups)
 
     return [
         TextContent(
@@ -68,7 +89,8 @@ async def handle_create_group(arguments: dict[str, Any]) -> list[TextContent]:
     ]
 
 
-async def handle_send_group_message(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_send_group_message(arguments: dict[str, Any]) -> list[TextContent]:
     """处理send_group_message工具"""
     group_id = arguments.get("group_id", "")
     message = arguments.get("message", "")
@@ -110,8 +132,6 @@ async def handle_send_group_message(arguments: dict[str, Any]) -> list[TextConte
     # 创建群组消息
     sender = get_current_agent()
     session_id = get_current_session_id()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
 
     sessions = load_sessions()
     sender_role = "未知"
@@ -124,7 +144,7 @@ async def handle_send_group_message(arguments: dict[str, Any]) -> list[TextConte
     # 处理回复消息（P1新增）
     reply_info = {}
     if reply_to:
-        reply_msg = next((m for m in messages if m.get("id") == reply_to), None)
+        reply_msg = find_message(reply_to)
         if reply_msg:
             reply_info = {
                 "reply_to": reply_to,
@@ -133,7 +153,6 @@ async def handle_send_group_message(arguments: dict[str, Any]) -> list[TextConte
             }
 
     new_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": sender_role,
         "sender_session_id": session_id,
@@ -148,12 +167,10 @@ async def handle_send_group_message(arguments: dict[str, Any]) -> list[TextConte
         "importance": importance,  # P1新增
         "is_pinned": False,  # P1新增
         "timestamp": datetime.now().isoformat(),
-        "read": {member: False for member in members},
         **reply_info,
     }
 
-    messages.append(new_message)
-    save_messages(messages)
+    message_id = append_message(new_message)["id"]
 
     return [
         TextContent(
@@ -163,7 +180,8 @@ async def handle_send_group_message(arguments: dict[str, Any]) -> list[TextConte
     ]
 
 
-async def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextContent]:
     """处理receive_group_messages工具"""
     group_id = arguments.get("group_id", "")
     limit = arguments.get("limit", 20)
@@ -174,11 +192,18 @@ async def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextC
     mentions_me = arguments.get("mentions_me", False)  # P1新增
     importance = arguments.get("importance")  # P1新增
     show_pinned = arguments.get("show_pinned", False)  # P1新增
+    cursor = arguments.get("cursor")
     max_content_length = arguments.get("max_content_length", 5000)
 
     if not group_id:
         return [TextContent(type="text", text="错误: 必须提供群组ID")]
 
+    before_seq = None
+    if cursor:
+        before_seq = decode_cursor(cursor)
+        if before_seq is None:
+            return [TextContent(type="text", text="错误: 无效的分页游标")]
+
     groups = load_groups()
     group = groups.get(group_id)
 
@@ -189,40 +214,22 @@ async def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextC
     if current_agent not in group.get("members", []):
         return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
 
-    messages = load_messages()
+    read_state = load_read_state(current_agent)
 
-    # 解析时间过滤
-    since_time = None
-    if since:
-        try:
-            since_time = datetime.fromisoformat(since.replace("Z", "+00:00"))
-        except Exception:
-            pass
-
-    # 过滤消息
+    # 过滤消息（只查询本群组的消息，从最新开始，取够数量即停止；
+    # 关键词由全文索引过滤，时间窗口由时间索引定位）
     filtered_messages = []
-    for msg in reversed(messages):
-        if msg.get("type") != "group" or msg.get("group_id") != group_id:
+    for msg in query_messages(
+        msg_type="group",
+        group_id=group_id,
+        after_seq=read_state["hwm"] if unread_only else None,
+        keywords=keywords,
+        since_ms=to_epoch_ms(since),
+        before_seq=before_seq,
+    ):
+        if unread_only and not is_message_unread(msg, read_state, current_agent):
             continue
 
-        if unread_only and msg.get("read", {}).get(current_agent, True):
-            continue
-
-        if since_time:
-            try:
-                msg_time = datetime.fromisoformat(
-                    msg.get("timestamp", "").replace("Z", "+00:00")
-                )
-                if msg_time < since_time:
-                    continue
-            except Exception:
-                pass
-
-        if keywords:
-            content = msg.get("content", "").lower()
-            if not any(kw.lower() in content for kw in keywords):
-                continue
-
         if topic and msg.get("topic") != topic:
             continue
 
@@ -238,6 +245,13 @@ async def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextC
         if len(filtered_messages) >= limit:
             break
 
+    # 取满一页时从本页最旧的消息之前续读（在置顶重排之前确定）
+    next_cursor = (
+        encode_cursor(filtered_messages[-1]["seq"])
+        if len(filtered_messages) >= limit
+        else None
+    )
+
     # P1新增：置顶消息优先显示
     if show_pinned and filtered_messages:
         pinned_msgs = [m for m in filtered_messages if m.get("is_pinned")]
@@ -258,7 +272,7 @@ async def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextC
     ]
     for msg in filtered_messages:
         read_status = (
-            "✅ 已读" if msg.get("read", {}).get(current_agent, False) else "📩 未读"
+            "✅ 已读" if is_message_read(msg, read_state, current_agent) else "📩 未读"
         )
 
         # 消息头（P1新增置顶标记）
@@ -300,10 +314,14 @@ async def handle_receive_group_messages(arguments: dict[str, Any]) -> list[TextC
             content = content[:max_content_length] + "..."
         result_lines.append(f"\n内容:\n{content}")
 
+    if next_cursor:
+        result_lines.append(f"\n➡️ 还有更多消息，下一页请传入 cursor: {next_cursor}")
+
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_list_groups(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_list_groups(arguments: dict[str, Any]) -> list[TextContent]:
     """处理list_groups工具"""
     member_filter = arguments.get("member")
     status_filter = arguments.get("status", "active")  # P1新增
@@ -311,16 +329,19 @@ async def handle_list_groups(arguments: dict[str, Any]) -> list[TextContent]:
 
     current_agent = get_current_agent()
     groups = load_groups()
-    messages = load_messages() if include_preview else []
 
     if not groups:
         return [TextContent(type="text", text="📋 没有群组")]
 
+    # 按成员过滤时由成员索引直接取出该成员所在的群组
+    if member_filter:
+        candidates = group_index(groups).groups_of(member_filter)
+    else:
+        candidates = list(groups)
+
     filtered_groups = []
-    for group_id, group_info in groups.items():
-        if member_filter:
-            if member_filter not in group_info.get("members", []):
-                continue
+    for group_id in candidates:
+        group_info = groups[group_id]
 
         # P1新增：状态过滤
         group_status = group_info.get("status", "active")
@@ -333,6 +354,11 @@ async def handle_list_groups(arguments: dict[str, Any]) -> list[TextContent]:
     if not filtered_groups:
         return [TextContent(type="text", text=f"📋 没有找到符合条件的群组")]
 
+    # P1新增：消息预览（最新消息摘要和未读计数都随发送维护，不读取消息）
+    if include_preview:
+        last_messages = load_last_messages()
+        unread_counts = load_unread_counts(current_agent)
+
     result_lines = [f"📋 找到 {len(filtered_groups)} 个群组:\n"]
     for group_id, group_info in filtered_groups:
         result_lines.append(f"\n--- {group_id} ---")
@@ -357,28 +383,17 @@ async def handle_list_groups(arguments: dict[str, Any]) -> list[TextContent]:
 
         # P1新增：消息预览
         if include_preview:
-            group_messages = [
-                m
-                for m in reversed(messages)
-                if m.get("type") == "group" and m.get("group_id") == group_id
-            ]
-
-            if group_messages:
-                last_msg = group_messages[0]
+            last_msg = last_messages.get(group_id)
+            if last_msg:
                 result_lines.append(f"\n📨 最新消息:")
                 result_lines.append(f"   发送者: {last_msg.get('sender')}")
                 result_lines.append(f"   时间: {last_msg.get('timestamp', '')[:19]}")
-                preview_content = last_msg.get("content", "")[:100]
-                result_lines.append(f"   内容: {preview_content}...")
+                result_lines.append(f"   内容: {last_msg.get('preview', '')}...")
 
             # 未读统计
-            unread_count = 0
-            mentions_count = 0
-            for m in group_messages:
-                if not m.get("read", {}).get(current_agent, True):
-                    unread_count += 1
-                    if current_agent in m.get("mentions", []):
-                        mentions_count += 1
+            counts = unread_counts.get(group_id, {})
+            unread_count = counts.get("unread", 0)
+            mentions_count = counts.get("mentions", 0)
 
             if unread_count > 0:
                 result_lines.append(f"\n📊 未读: {unread_count}条")
@@ -388,74 +403,81 @@ async def handle_list_groups(arguments: dict[str, Any]) -> list[TextContent]:
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_join_group(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_join_group(arguments: dict[str, Any]) -> list[TextContent]:
     """处理join_group工具"""
     group_id = arguments.get("group_id", "")
 
     if not group_id:
         return [TextContent(type="text", text="错误: 必须提供群组ID")]
 
-    groups = load_groups()
-    group = groups.get(group_id)
+    with locked("groups"):
+        groups = load_groups()
+        group = groups.get(group_id)
 
-    if not group:
-        return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
+        if not group:
+            return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
 
-    current_agent = get_current_agent()
-    members = group.get("members", [])
+        current_agent = get_current_agent()
+        members = group.get("members", [])
+
+        if current_agent in members:
+            return [
+                TextContent(
+                    type="text", text=f"ℹ️ 你已经是群组 {group.get('name', group_id)} 的成员"
+                )
+            ]
+
+        members.append(current_agent)
+        group["members"] = list(set(members))
+        groups[group_id] = group
+        save_groups(groups)
+        refresh_unread_counts(current_agent, group_id)
 
-    if current_agent in members:
         return [
             TextContent(
-                type="text", text=f"ℹ️ 你已经是群组 {group.get('name', group_id)} 的成员"
+                type="text",
+                text=f"✅ 已加入群组\n群组: {group.get('name', group_id)}\n成员数: {len(members)}",
             )
         ]
 
-    members.append(current_agent)
-    group["members"] = list(set(members))
-    groups[group_id] = group
-    save_groups(groups)
-
-    return [
-        TextContent(
-            type="text",
-            text=f"✅ 已加入群组\n群组: {group.get('name', group_id)}\n成员数: {len(members)}",
-        )
-    ]
-
 
-async def handle_leave_group(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_leave_group(arguments: dict[str, Any]) -> list[TextContent]:
     """处理leave_group工具"""
     group_id = arguments.get("group_id", "")
 
     if not group_id:
         return [TextContent(type="text", text="错误: 必须提供群组ID")]
 
-    groups = load_groups()
-    group = groups.get(group_id)
+    with locked("groups"):
+        groups = load_groups()
+        group = groups.get(group_id)
 
-    if not group:
-        return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
+        if not group:
+            return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
 
-    current_agent = get_current_agent()
-    members = group.get("members", [])
+        current_agent = get_current_agent()
+        members = group.get("members", [])
 
-    if current_agent not in members:
-        return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
+        if current_agent not in members:
+            return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
 
-    members.remove(current_agent)
-    group["members"] = members
-    groups[group_id] = group
-    save_groups(groups)
+        members.remove(current_agent)
+        group["members"] = members
+        groups[group_id] = group
+        save_groups(groups)
+        refresh_unread_counts(current_agent, group_id)
 
-    return [
-        TextContent(
-            type="text", text=f"✅ 已离开群组\n群组: {group.get('name', group_id)}"
-        )
-    ]
+        return [
+            TextContent(
+                type="text", text=f"✅ 已离开群组\n群组: {group.get('name', group_id)}"
+            )
+        ]
 
 
-async def handle_summarize_group_messages(
+@blocking_handler
+def handle_summarize_group_messages(
     arguments: dict[str, Any],
 ) -> list[TextContent]:
     """处理summarize_group_messages工具"""
@@ -476,36 +498,13 @@ async def handle_summarize_group_messages(
     if current_agent not in group.get("members", []):
         return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
 
-    messages = load_messages()
+    # 计算时间范围（无法解析时默认最近7天）
+    since_time = parse_time_range(time_range) or datetime.now() - timedelta(days=7)
 
-    # 计算时间范围
-    now = datetime.now()
-    if time_range == "last_24_hours":
-        since_time = now - timedelta(hours=24)
-    elif time_range == "last_7_days":
-        since_time = now - timedelta(days=7)
-    elif time_range == "last_30_days":
-        since_time = now - timedelta(days=30)
-    else:
-        try:
-            since_time = datetime.fromisoformat(time_range.replace("Z", "+00:00"))
-        except Exception:
-            since_time = now - timedelta(days=7)
-
-    # 获取群组消息
-    group_messages = []
-    for msg in messages:
-        if msg.get("type") == "group" and msg.get("group_id") == group_id:
-            try:
-                msg_time = datetime.fromisoformat(
-                    msg.get("timestamp", "").replace("Z", "+00:00")
-                )
-                if msg_time >= since_time:
-                    group_messages.append(msg)
-            except Exception:
-                pass
+    # 合并按小时/按天汇总的统计，不逐条读取窗口内的消息
+    stats = group_message_stats(group_id, round(since_time.timestamp() * 1000))
 
-    if not group_messages:
+    if not stats["count"]:
         return [
             TextContent(
                 type="text",
@@ -518,19 +517,27 @@ async def handle_summarize_group_messages(
         f"📋 群组消息摘要",
         f"群组: {group.get('name', group_id)}",
         f"时间范围: {time_range}",
-        f"消息总数: {len(group_messages)}",
+        f"消息总数: {stats['count']}",
         f"\n参与者:",
     ]
 
-    # 统计参与者
-    participants = {}
-    for msg in group_messages:
-        sender = msg.get("sender", "未知")
-        participants[sender] = participants.get(sender, 0) + 1
-
-    for sender, count in sorted(participants.items(), key=lambda x: x[1], reverse=True):
+    for sender, count in sorted(stats["senders"].items(), key=lambda x: x[1], reverse=True):
         summary_lines.append(f"  - {sender}: {count}条消息")
 
+    if stats["topics"]:
+        summary_lines.append("\n话题:")
+        for topic, count in sorted(stats["topics"].items(), key=lambda x: x[1], reverse=True):
+            summary_lines.append(f"  - {topic}: {count}条消息")
+
+    important_count = stats["importance"].get("high", 0)
+    if important_count:
+        summary_lines.append(f"\n重要消息: {important_count}条")
+
+    if stats["mentions"]:
+        summary_lines.append("\n@提醒:")
+        for agent, count in sorted(stats["mentions"].items(), key=lambda x: x[1], reverse=True):
+            summary_lines.append(f"  - {agent}: {count}次")
+
     summary_text = "\n".join(summary_lines)
     if len(summary_text) > max_length:
         summary_text = summary_text[:max_length] + "..."
@@ -538,52 +545,36 @@ async def handle_summarize_group_messages(
     return [TextContent(type="text", text=summary_text)]
 
 
-async def handle_get_unread_counts(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_get_unread_counts(arguments: dict[str, Any]) -> list[TextContent]:
     """处理get_unread_counts工具（P1新增）"""
     query_groups = arguments.get("groups", [])
 
     current_agent = get_current_agent()
     groups = load_groups()
-    messages = load_messages()
+    index = group_index(groups)
 
-    # 如果没有指定群组，则查询所有群组
+    # 如果没有指定群组，则查询所在的全部活跃群组
     if not query_groups:
         query_groups = [
             gid
-            for gid, g in groups.items()
-            if current_agent in g.get("members", [])
-            and g.get("status", "active") == "active"
+            for gid in index.groups_of(current_agent)
+            if groups[gid].get("status", "active") == "active"
         ]
 
+    # 未读计数随发送、标记已读和成员变化增量维护，这里只需按群组读取
+    unread_counts = load_unread_counts(current_agent)
     result = {}
     for group_id in query_groups:
         group = groups.get(group_id)
-        if not group or current_agent not in group.get("members", []):
+        if not group or not index.is_member(group_id, current_agent):
             continue
-
-        unread_count = 0
-        mentions_count = 0
-        important_count = 0
-
-        for msg in messages:
-            if msg.get("type") != "group" or msg.get("group_id") != group_id:
-                continue
-
-            is_unread = not msg.get("read", {}).get(current_agent, True)
-            if is_unread:
-                unread_count += 1
-
-                if current_agent in msg.get("mentions", []):
-                    mentions_count += 1
-
-                if msg.get("importance") == "high":
-                    important_count += 1
-
         result[group_id] = {
             "group_name": group.get("name", ""),
-            "unread": unread_count,
-            "mentions": mentions_count,
-            "important": important_count,
+            "unread": 0,
+            "mentions": 0,
+            "important": 0,
+            **unread_counts.get(group_id, {}),
         }
 
     # 格式化输出
@@ -616,7 +607,8 @@ async def handle_get_unread_counts(arguments: dict[str, Any]) -> list[TextConten
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_archive_group(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_archive_group(arguments: dict[str, Any]) -> list[TextContent]:
     """处理archive_group工具（P1新增）"""
     group_id = arguments.get("group_id", "")
     reason = arguments.get("reason", "")
@@ -624,40 +616,42 @@ async def handle_archive_group(arguments: dict[str, Any]) -> list[TextContent]:
     if not group_id:
         return [TextContent(type="text", text="错误: 必须提供群组ID")]
 
-    groups = load_groups()
-    group = groups.get(group_id)
+    with locked("groups"):
+        groups = load_groups()
+        group = groups.get(group_id)
 
-    if not group:
-        return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
+        if not group:
+            return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
 
-    current_agent = get_current_agent()
-    creator = group.get("creator", "")
+        current_agent = get_current_agent()
+        creator = group.get("creator", "")
 
-    # 只有创建者可以归档群组
-    if current_agent != creator:
-        return [
-            TextContent(type="text", text=f"错误: 只有创建者（{creator}）可以归档群组")
-        ]
+        # 只有创建者可以归档群组
+        if current_agent != creator:
+            return [
+                TextContent(type="text", text=f"错误: 只有创建者（{creator}）可以归档群组")
+            ]
 
-    # 归档群组
-    group["status"] = "archived"
-    group["archived_at"] = datetime.now().isoformat()
-    group["archived_by"] = current_agent
-    if reason:
-        group["archive_reason"] = reason
+        # 归档群组
+        group["status"] = "archived"
+        group["archived_at"] = datetime.now().isoformat()
+        group["archived_by"] = current_agent
+        if reason:
+            group["archive_reason"] = reason
 
-    groups[group_id] = group
-    save_groups(groups)
+        groups[group_id] = group
+        save_groups(groups)
 
-    return [
-        TextContent(
-            type="text",
-            text=f"✅ 群组已归档\n群组: {group.get('name', group_id)}\n原因: {reason if reason else '无'}",
-        )
-    ]
+        return [
+            TextContent(
+                type="text",
+                text=f"✅ 群组已归档\n群组: {group.get('name', group_id)}\n原因: {reason if reason else '无'}",
+            )
+        ]
 
 
-async def handle_pin_message(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_pin_message(arguments: dict[str, Any]) -> list[TextContent]:
     """处理pin_message工具（P1新增）"""
     group_id = arguments.get("group_id", "")
     message_id = arguments.get("message_id", "")
@@ -665,53 +659,50 @@ async def handle_pin_message(arguments: dict[str, Any]) -> list[TextContent]:
     if not group_id or not message_id:
         return [TextContent(type="text", text="错误: 必须提供群组ID和消息ID")]
 
-    groups = load_groups()
-    group = groups.get(group_id)
-
-    if not group:
-        return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
+    with locked("groups"):
+        groups = load_groups()
+        group = groups.get(group_id)
 
-    current_agent = get_current_agent()
-    if current_agent not in group.get("members", []):
-        return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
+        if not group:
+            return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
 
-    messages = load_messages()
-    message = next((m for m in messages if m.get("id") == message_id), None)
+        current_agent = get_current_agent()
+        if current_agent not in group.get("members", []):
+            return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
 
-    if not message or message.get("group_id") != group_id:
-        return [TextContent(type="text", text=f"错误: 找不到消息 {message_id}")]
+        with locked("messages"):
+            message = find_message(message_id)
 
-    # 置顶消息
-    message["is_pinned"] = True
-    message["pinned_at"] = datetime.now().isoformat()
-    message["pinned_by"] = current_agent
+            if not message or message.get("group_id") != group_id:
+                return [TextContent(type="text", text=f"错误: 找不到消息 {message_id}")]
 
-    # 更新消息
-    for i, m in enumerate(messages):
-        if m.get("id") == message_id:
-            messages[i] = message
-            break
+            # 置顶消息
+            message["is_pinned"] = True
+            message["pinned_at"] = datetime.now().isoformat()
+            message["pinned_by"] = current_agent
 
-    save_messages(messages)
+            # 更新消息
+            update_messages([message])
 
-    # 更新群组的置顶消息列表
-    if "pinned_messages" not in group:
-        group["pinned_messages"] = []
-    if message_id not in group["pinned_messages"]:
-        group["pinned_messages"].append(message_id)
+        # 更新群组的置顶消息列表
+        if "pinned_messages" not in group:
+            group["pinned_messages"] = []
+        if message_id not in group["pinned_messages"]:
+            group["pinned_messages"].append(message_id)
 
-    groups[group_id] = group
-    save_groups(groups)
+        groups[group_id] = group
+        save_groups(groups)
 
-    return [
-        TextContent(
-            type="text",
-            text=f"✅ 消息已置顶\n群组: {group.get('name', group_id)}\n消息: {message.get('content', '')[:100]}...",
-        )
-    ]
+        return [
+            TextContent(
+                type="text",
+                text=f"✅ 消息已置顶\n群组: {group.get('name', group_id)}\n消息: {message.get('content', '')[:100]}...",
+            )
+        ]
 
 
-async def handle_unpin_message(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_unpin_message(arguments: dict[str, Any]) -> list[TextContent]:
     """处理unpin_message工具（P1新增）"""
     group_id = arguments.get("group_id", "")
     message_id = arguments.get("message_id", "")
@@ -719,44 +710,150 @@ async def handle_unpin_message(arguments: dict[str, Any]) -> list[TextContent]:
     if not group_id or not message_id:
         return [TextContent(type="text", text="错误: 必须提供群组ID和消息ID")]
 
-    groups = load_groups()
-    group = groups.get(group_id)
+    with locked("groups"):
+        groups = load_groups()
+        group = groups.get(group_id)
 
-    if not group:
-        return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
+        if not group:
+            return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
 
-    current_agent = get_current_agent()
-    if current_agent not in group.get("members", []):
-        return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
+        current_agent = get_current_agent()
+        if current_agent not in group.get("members", []):
+            return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
 
-    messages = load_messages()
-    message = next((m for m in messages if m.get("id") == message_id), None)
+        with locked("messages"):
+            message = find_message(message_id)
 
-    if not message or message.get("group_id") != group_id:
-        return [TextContent(type="text", text=f"错误: 找不到消息 {message_id}")]
+            if not message or message.get("group_id") != group_id:
+                return [TextContent(type="text", text=f"错误: 找不到消息 {message_id}")]
 
-    # 取消置顶
-    message["is_pinned"] = False
+            # 取消置顶
+            message["is_pinned"] = False
 
-    # 更新消息
-    for i, m in enumerate(messages):
-        if m.get("id") == message_id:
-            messages[i] = message
-            break
+            # 更新消息
+            update_messages([message])
 
-    save_messages(messages)
+        # 更新群组的置顶消息列表
+        if "pinned_messages" in group and message_id in group["pinned_messages"]:
+            group["pinned_messages"].remove(message_id)
+            groups[group_id] = group
+            save_groups(groups)
 
-    # 更新群组的置顶消息列表
-    if "pinned_messages" in group and message_id in group["pinned_messages"]:
-        group["pinned_messages"].remove(message_id)
-        groups[group_id] = group
-        save_groups(groups)
+        return [
+            TextContent(
+                type="text", text=f"✅ 消息已取消置顶\n群组: {group.get('name', group_id)}"
+            )
+        ]
 
-    return [
-        TextContent(
-            type="text", text=f"✅ 消息已取消置顶\n群组: {group.get('name', group_id)}"
+
+# get_thread 最多返回的消息数
+MAX_THREAD_MESSAGES = 500
+
+
+def _visible_to(msg: dict, agent: str, index) -> bool:
+    """代理能否看到该消息：所在群组的消息，或发给他（或所有人）、由他发送的私聊"""
+    if msg.get("type") == "group":
+        return index.is_member(msg.get("group_id"), agent)
+    return msg.get("sender") == agent or not {agent, "*"}.isdisjoint(msg.get("recipients", []))
+
+
+@blocking_handler
+def handle_get_thread(arguments: dict[str, Any]) -> list[TextContent]:
+    """处理get_thread工具：沿 reply_to 找到会话串的起点，再由回复索引逐层展开"""
+    message_id = arguments.get("message_id", "")
+    mode = arguments.get("mode", "tree")
+    max_depth = arguments.get("max_depth")
+    max_content_length = arguments.get("max_content_length", 200)
+
+    if not message_id:
+        return [TextContent(type="text", text="错误: 必须提供消息ID")]
+    if mode not in ("tree", "flat"):
+        return [TextContent(type="text", text="错误: mode 只能是 tree 或 flat")]
+
+    current_agent = get_current_agent()
+    index = group_index(load_groups())
+    message = find_message(message_id)
+    if message is None or not _visible_to(message, current_agent, index):
+        return [TextContent(type="text", text=f"错误: 找不到消息 {message_id}")]
+
+    # 向上找到起点（父消息不存在或不可见时，从最上层可见的消息开始）
+    root = message
+    seen = {message_id}
+    while root.get("reply_to") and root["reply_to"] not in seen:
+        parent = find_message(root["reply_to"])
+        if parent is None or not _visible_to(parent, current_agent, index):
+            break
+        seen.add(parent["id"])
+        root = parent
+
+    # 逐层展开：每条消息只查一次回复索引，耗时与会话串大小成正比
+    depths = {root["id"]: 0}
+    children: dict = {}
+    hidden: dict = {}  # 超过 max_depth 未展开的回复数
+    truncated = False
+    queue = deque([root])
+    while queue and not truncated:
+        node = queue.popleft()
+        replies = [
+            r
+            for r in find_replies(node["id"])
+            if r.get("id") not in depths and _visible_to(r, current_agent, index)
+        ]
+        depth = depths[node["id"]] + 1
+        if max_depth is not None and depth > max_depth:
+            if replies:
+                hidden[node["id"]] = len(replies)
+            continue
+        room = MAX_THREAD_MESSAGES - len(depths)
+        if len(replies) > room:
+            replies = replies[:room]
+            truncated = True
+        children[node["id"]] = replies
+        for reply in replies:
+            depths[reply["id"]] = depth
+            queue.append(reply)
+
+    def describe(msg: dict) -> str:
+        content = msg.get("content", "").replace("\n", " ")
+        if len(content) > max_content_length:
+            content = content[:max_content_length] + "..."
+        focus = "👉 " if msg["id"] == message_id else ""
+        pinned = " 📌" if msg.get("is_pinned") else ""
+        return (
+            f"{focus}[{msg['id']}] {msg.get('sender', '未知')} "
+            f"{msg.get('timestamp', '')[:19]}{pinned}: {content}"
         )
-    ]
+
+    result_lines = [f"🧵 会话串: {len(depths)}条消息"]
+    if root.get("group_id"):
+        result_lines.append(f"群组: {root.get('group_name') or root['group_id']}")
+    result_lines.append("")
+
+    if mode == "tree":
+        stack = [root]
+        while stack:
+            msg = stack.pop()
+            depth = depths[msg["id"]]
+            indent = "  " * depth
+            result_lines.append(f"{indent}{'↳ ' if depth else ''}{describe(msg)}")
+            if msg["id"] in hidden:
+                result_lines.append(f"{indent}  … 还有 {hidden[msg['id']]} 条回复未展开")
+            stack.extend(reversed(children.get(msg["id"], [])))
+    else:
+        nodes = {root["id"]: root}
+        for replies in children.values():
+            nodes.update((r["id"], r) for r in replies)
+        for msg in sorted(nodes.values(), key=lambda m: m.get("seq", 0)):
+            depth = depths[msg["id"]]
+            parent = f" ↩️ {msg.get('reply_to')}" if depth else ""
+            result_lines.append(f"[深度 {depth}]{parent} {describe(msg)}")
+            if msg["id"] in hidden:
+                result_lines.append(f"  … 还有 {hidden[msg['id']]} 条回复未展开")
+
+    if truncated:
+        result_lines.append(f"\n⚠️ 会话串过长，只显示前 {MAX_THREAD_MESSAGES} 条消息")
+
+    return [TextContent(type="text", text="\n".join(result_lines))]
 
 
 # 导出所有处理器
@@ -772,4 +869,5 @@ __all__ = [
     "handle_archive_group",
     "handle_pin_message",
     "handle_unpin_message",
+    "handle_get_thread",
 ]
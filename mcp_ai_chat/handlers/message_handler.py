@@ -10,6 +10,7 @@ Message Handler
 - request_review: 请求审查
 - notify_completion: 完成通知
 - share_code_snippet: 分享代码片段
+- search_messages: 全文检索消息（按相关度排序）
 """
 
 from datetime import datetime
@@ -18,12 +19,29 @@ from mcp.types import TextContent
 from typing import Any
 
 # 导入核心功能
-from ..core.storage import load_messages, save_messages, load_sessions
+from ..core.storage import (
+    append_message,
+    query_messages,
+    find_message,
+    load_sessions,
+    load_read_state,
+    is_message_read,
+    is_message_unread,
+    mark_messages_read,
+    load_groups,
+    search_messages,
+    encode_cursor,
+    decode_cursor,
+)
+from ..core.search_index import snippet
+from ..core.io_executor import blocking_handler
 from ..core.session import get_current_agent, get_current_session_id
 from ..config import WORKSPACE_ROOT
+from ..utils.time_utils import to_epoch_ms
 
 
-async def handle_send_message(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_send_message(arguments: dict[str, Any]) -> list[TextContent]:
     """处理send_message工具"""
     recipients_str = arguments.get("recipients", "")
     file_path = arguments.get("file_path")
@@ -54,8 +72,6 @@ async def handle_send_message(arguments: dict[str, Any]) -> list[TextContent]:
     # 创建消息
     sender = get_current_agent()
     session_id = get_current_session_id()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
 
     # 获取发送者的角色信息
     sender_role = "未知"
@@ -65,7 +81,6 @@ async def handle_send_message(arguments: dict[str, Any]) -> list[TextContent]:
         sender_role = session_info.get("role", "未知")
 
     new_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": sender_role,
         "sender_session_id": session_id,
@@ -73,11 +88,9 @@ async def handle_send_message(arguments: dict[str, Any]) -> list[TextContent]:
         "content": content,
         "file_path": file_path if file_path else None,
         "timestamp": datetime.now().isoformat(),
-        "read": {recipient: False for recipient in recipients},
     }
 
-    messages.append(new_message)
-    save_messages(messages)
+    message_id = append_message(new_message)["id"]
 
     return [
         TextContent(
@@ -87,62 +100,39 @@ async def handle_send_message(arguments: dict[str, Any]) -> list[TextContent]:
     ]
 
 
-async def handle_receive_messages(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_receive_messages(arguments: dict[str, Any]) -> list[TextContent]:
     """处理receive_messages工具"""
     recipient = arguments.get("recipient", "*")
     limit = arguments.get("limit", 20)
     unread_only = arguments.get("unread_only", False)
     since = arguments.get("since")
     keywords = arguments.get("keywords", [])
+    cursor = arguments.get("cursor")
     max_content_length = arguments.get("max_content_length", 5000)
 
-    current_agent = get_current_agent()
-    messages = load_messages()
+    before_seq = None
+    if cursor:
+        before_seq = decode_cursor(cursor)
+        if before_seq is None:
+            return [TextContent(type="text", text="错误: 无效的分页游标")]
 
-    # 解析时间过滤
-    since_time = None
-    if since:
-        try:
-            since_time = datetime.fromisoformat(since.replace("Z", "+00:00"))
-        except Exception:
-            pass
+    current_agent = get_current_agent()
+    read_state = load_read_state(current_agent)
 
-    # 过滤消息
+    # 过滤消息（只查询私聊消息，接收者条件由存储层完成）
     filtered_messages = []
-    for msg in reversed(messages):  # 最新的在前
-        # 类型过滤：只处理私聊消息（type为private或未设置）
-        msg_type = msg.get("type", "private")
-        if msg_type == "group":
+    for msg in query_messages(
+        recipients=None if recipient == "*" else [recipient],
+        msg_type="private",
+        after_seq=read_state["hwm"] if unread_only else None,
+        keywords=keywords,
+        since_ms=to_epoch_ms(since),
+        before_seq=before_seq,
+    ):  # 最新的在前，取够数量即停止（关键词由全文索引过滤，时间窗口由时间索引定位）
+        if unread_only and not is_message_unread(msg, read_state, current_agent):
             continue
 
-        # 接收者过滤
-        if recipient == "*":
-            # 获取所有消息（私聊）
-            if unread_only and msg.get("read", {}).get(current_agent, True):
-                continue
-        else:
-            recipients = msg.get("recipients", [])
-            if recipient not in recipients:
-                continue
-            if unread_only and msg.get("read", {}).get(current_agent, True):
-                continue
-
-        # 时间过滤
-        if since_time:
-            try:
-                msg_time = datetime.fromisoformat(msg.get("timestamp", ""))
-                if msg_time < since_time:
-                    continue
-            except Exception:
-                pass
-
-        # 关键词过滤
-        if keywords:
-            content = msg.get("content", "").lower()
-            has_keyword = any(kw.lower() in content for kw in keywords)
-            if not has_keyword:
-                continue
-
         filtered_messages.append(msg)
 
         # 限制数量
@@ -152,12 +142,19 @@ async def handle_receive_messages(arguments: dict[str, Any]) -> list[TextContent
     if not filtered_messages:
         return [TextContent(type="text", text="📭 没有找到消息")]
 
+    # 取满一页时从本页最旧的消息之前续读
+    next_cursor = (
+        encode_cursor(filtered_messages[-1]["seq"])
+        if len(filtered_messages) >= limit
+        else None
+    )
+
     # 格式化输出
     result_lines = [f"📬 消息: 找到 {len(filtered_messages)} 条\n"]
 
     for msg in filtered_messages:
         read_status = (
-            "✅ 已读" if msg.get("read", {}).get(current_agent, False) else "📩 未读"
+            "✅ 已读" if is_message_read(msg, read_state, current_agent) else "📩 未读"
         )
 
         result_lines.append(f"\n--- 消息 {msg['id']} ---")
@@ -175,31 +172,34 @@ async def handle_receive_messages(arguments: dict[str, Any]) -> list[TextContent
             content = content[:max_content_length] + "..."
         result_lines.append(f"\n内容:\n{content}")
 
+    if next_cursor:
+        result_lines.append(f"\n➡️ 还有更多消息，下一页请传入 cursor: {next_cursor}")
+
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_mark_messages_read(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_mark_messages_read(arguments: dict[str, Any]) -> list[TextContent]:
     """处理mark_messages_read工具"""
     message_ids = arguments.get("message_ids", [])
     current_agent = get_current_agent()
 
-    messages = load_messages()
-    updated_count = 0
-
-    for msg in messages:
-        if msg["id"] in message_ids:
-            if "read" not in msg:
-                msg["read"] = {}
-            msg["read"][current_agent] = True
-            updated_count += 1
+    found_messages = [
+        msg
+        for msg in map(find_message, dict.fromkeys(message_ids))
+        if msg is not None
+    ]
 
+    # 只写入当前代理的已读状态，不改写消息
+    updated_count = len(found_messages)
     if updated_count > 0:
-        save_messages(messages)
+        mark_messages_read(current_agent, found_messages)
 
     return [TextContent(type="text", text=f"✅ 已标记 {updated_count} 条消息为已读")]
 
 
-async def handle_request_help(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_request_help(arguments: dict[str, Any]) -> list[TextContent]:
     """处理request_help工具"""
     recipients_str = arguments.get("recipients", "")
     topic = arguments.get("topic", "")
@@ -213,8 +213,6 @@ async def handle_request_help(arguments: dict[str, Any]) -> list[TextContent]:
 
     sender = get_current_agent()
     session_id = get_current_session_id()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
 
     sessions = load_sessions()
     sender_role = "未知"
@@ -226,7 +224,6 @@ async def handle_request_help(arguments: dict[str, Any]) -> list[TextContent]:
     content = f"{urgency_icon} 请求帮助\n\n主题: {topic}\n紧急程度: {urgency}\n\n详细描述:\n{description}"
 
     help_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": sender_role,
         "sender_session_id": session_id,
@@ -234,11 +231,9 @@ async def handle_request_help(arguments: dict[str, Any]) -> list[TextContent]:
         "content": content,
         "file_path": None,
         "timestamp": datetime.now().isoformat(),
-        "read": {recipient: False for recipient in recipients},
     }
 
-    messages.append(help_message)
-    save_messages(messages)
+    append_message(help_message)
 
     return [
         TextContent(
@@ -248,7 +243,8 @@ async def handle_request_help(arguments: dict[str, Any]) -> list[TextContent]:
     ]
 
 
-async def handle_request_review(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_request_review(arguments: dict[str, Any]) -> list[TextContent]:
     """处理request_review工具"""
     recipients_str = arguments.get("recipients", "")
     file_path = arguments.get("file_path", "")
@@ -271,8 +267,6 @@ async def handle_request_review(arguments: dict[str, Any]) -> list[TextContent]:
 
     sender = get_current_agent()
     session_id = get_current_session_id()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
 
     sessions = load_sessions()
     sender_role = "未知"
@@ -286,7 +280,6 @@ async def handle_request_review(arguments: dict[str, Any]) -> list[TextContent]:
     review_content += f"代码内容:\n```\n{file_content[:2000]}...\n```"
 
     review_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": sender_role,
         "sender_session_id": session_id,
@@ -294,11 +287,9 @@ async def handle_request_review(arguments: dict[str, Any]) -> list[TextContent]:
         "content": review_content,
         "file_path": file_path,
         "timestamp": datetime.now().isoformat(),
-        "read": {recipient: False for recipient in recipients},
     }
 
-    messages.append(review_message)
-    save_messages(messages)
+    append_message(review_message)
 
     return [
         TextContent(
@@ -308,7 +299,8 @@ async def handle_request_review(arguments: dict[str, Any]) -> list[TextContent]:
     ]
 
 
-async def handle_notify_completion(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_notify_completion(arguments: dict[str, Any]) -> list[TextContent]:
     """处理notify_completion工具"""
     recipients_str = arguments.get("recipients", "")
     task_title = arguments.get("task_title", "")
@@ -322,8 +314,6 @@ async def handle_notify_completion(arguments: dict[str, Any]) -> list[TextConten
 
     sender = get_current_agent()
     session_id = get_current_session_id()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
 
     sessions = load_sessions()
     sender_role = "未知"
@@ -340,7 +330,6 @@ async def handle_notify_completion(arguments: dict[str, Any]) -> list[TextConten
         )
 
     completion_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": sender_role,
         "sender_session_id": session_id,
@@ -348,11 +337,9 @@ async def handle_notify_completion(arguments: dict[str, Any]) -> list[TextConten
         "content": completion_content,
         "file_path": None,
         "timestamp": datetime.now().isoformat(),
-        "read": {recipient: False for recipient in recipients},
     }
 
-    messages.append(completion_message)
-    save_messages(messages)
+    append_message(completion_message)
 
     return [
         TextContent(
@@ -362,7 +349,8 @@ async def handle_notify_completion(arguments: dict[str, Any]) -> list[TextConten
     ]
 
 
-async def handle_share_code_snippet(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_share_code_snippet(arguments: dict[str, Any]) -> list[TextContent]:
     """处理share_code_snippet工具"""
     recipients_str = arguments.get("recipients", "")
     file_path = arguments.get("file_path", "")
@@ -397,8 +385,6 @@ async def handle_share_code_snippet(arguments: dict[str, Any]) -> list[TextConte
 
     sender = get_current_agent()
     session_id = get_current_session_id()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
 
     sessions = load_sessions()
     sender_role = "未知"
@@ -409,7 +395,6 @@ async def handle_share_code_snippet(arguments: dict[str, Any]) -> list[TextConte
     snippet_message_content = f"💻 代码片段分享{line_info}\n\n文件: {file_path}\n说明: {description}\n\n代码:\n```\n{snippet_content[:2000]}...\n```"
 
     snippet_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": sender_role,
         "sender_session_id": session_id,
@@ -417,11 +402,9 @@ async def handle_share_code_snippet(arguments: dict[str, Any]) -> list[TextConte
         "content": snippet_message_content,
         "file_path": file_path,
         "timestamp": datetime.now().isoformat(),
-        "read": {recipient: False for recipient in recipients},
     }
 
-    messages.append(snippet_message)
-    save_messages(messages)
+    append_message(snippet_message)
 
     return [
         TextContent(
@@ -431,6 +414,61 @@ async def handle_share_code_snippet(arguments: dict[str, Any]) -> list[TextConte
     ]
 
 
+@blocking_handler
+def handle_search_messages(arguments: dict[str, Any]) -> list[TextContent]:
+    """处理search_messages工具"""
+    query = arguments.get("query", "").strip()
+    group_id = arguments.get("group_id")
+    sender = arguments.get("sender")
+    since = arguments.get("since")
+    until = arguments.get("until")
+    limit = min(max(arguments.get("limit", 10), 1), 50)
+    snippet_length = arguments.get("snippet_length", 120)
+
+    if not query:
+        return [TextContent(type="text", text="错误: 必须提供查询内容")]
+
+    current_agent = get_current_agent()
+    if group_id:
+        group = load_groups().get(group_id)
+        if not group:
+            return [TextContent(type="text", text=f"错误: 找不到群组 {group_id}")]
+        if current_agent not in group.get("members", []):
+            return [TextContent(type="text", text=f"错误: 你不是群组 {group_id} 的成员")]
+
+    results = search_messages(
+        query,
+        limit=limit,
+        group_id=group_id,
+        sender=sender,
+        since=since,
+        until=until,
+        visible_to=current_agent,
+    )
+    if not results:
+        return [
+            TextContent(
+                type="text",
+                text="📭 没有找到相关消息（中文至少输入两个字，英文按完整单词匹配）",
+            )
+        ]
+
+    result_lines = [f"🔍 搜索: {query}，找到 {len(results)} 条相关消息\n"]
+    for rank, (msg, score) in enumerate(results, 1):
+        if msg.get("type") == "group":
+            where = f"群组 {msg.get('group_name', msg.get('group_id'))} ({msg.get('group_id')})"
+        else:
+            where = "私聊 → " + ", ".join(msg.get("recipients", []))
+        result_lines.append(f"\n{rank}. 消息 {msg['id']}（相关度 {score:.2f}）")
+        result_lines.append(f"   发送者: {msg.get('sender', '未知')} | {where}")
+        result_lines.append(f"   时间: {msg.get('timestamp', '未知')}")
+        if msg.get("topic"):
+            result_lines.append(f"   话题: {msg['topic']}")
+        result_lines.append(f"   {snippet(msg.get('content', ''), query, snippet_length)}")
+
+    return [TextContent(type="text", text="\n".join(result_lines))]
+
+
 # 导出所有处理器
 __all__ = [
     "handle_send_message",
@@ -440,4 +478,5 @@ __all__ = [
     "handle_request_review",
     "handle_notify_completion",
     "handle_share_code_snippet",
+    "handle_search_messages",
 ]
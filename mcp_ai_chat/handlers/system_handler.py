@@ -8,8 +8,11 @@ System Handler
 - get_current_session: 获取当前会话
 - list_agents: 列出所有代理
 - standby: 待命监听
+- get_server_metrics: 查看工具调用指标
+- profile_tool_calls: 按需剖析工具调用
 """
 
+import os
 from datetime import datetime, timedelta
 from pathlib import Path
 from mcp.types import TextContent
@@ -23,11 +26,17 @@ from ..core.storage import (
     save_sessions,
     load_employee_config,
     save_employee_config,
-    load_tasks,
-    load_messages,
+    query_tasks,
+    query_messages,
     load_standby,
     save_standby,
+    load_read_state,
+    is_message_unread,
+    locked,
 )
+from ..core import metrics, profiling
+from ..core.notify import ChangeListener
+from ..core.io_executor import blocking_handler, run_io
 from ..core.session import (
     get_current_agent,
     get_current_session_id,
@@ -35,7 +44,8 @@ from ..core.session import (
     set_current_agent,
     set_current_session,
 )
-from ..config import WORKSPACE_ROOT, RULES_DIR
+from .. import config
+from ..config import WORKSPACE_ROOT, RULES_DIR, STANDBY_RECHECK_SECONDS
 
 
 def load_mdc_file(agent_name: str) -> str:
@@ -81,7 +91,8 @@ def extract_description_from_mdc(mdc_content: str) -> str:
     return ""
 
 
-async def handle_register_agent(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_register_agent(arguments: dict[str, Any]) -> list[TextContent]:
     """处理register_agent工具"""
     agent_name = arguments.get("agent_name", "")
     role = arguments.get("role", "")
@@ -92,62 +103,58 @@ async def handle_register_agent(arguments: dict[str, Any]) -> list[TextContent]:
         return [TextContent(type="text", text="错误: 必须提供代理名称")]
 
     # 检查是否有之前的代理信息
-    agents = load_agents()
-    previous_agent_info = agents.get(agent_name, {})
-    previous_role = previous_agent_info.get("role", "")
-    previous_description = previous_agent_info.get("description", "")
-
-    # 尝试从.mdc文件加载员工设定
-    if auto_load_from_mdc:
-        config = load_employee_config()
-        if agent_name in config:
-            mdc_content = load_mdc_file(agent_name)
-            if mdc_content:
-                if not role:
-                    role = extract_role_from_mdc(mdc_content) or previous_role
-                if not description:
-                    description = (
-                        extract_description_from_mdc(mdc_content)
-                        or previous_description
+    with locked("agents"):
+        agents = load_agents()
+        previous_agent_info = agents.get(agent_name, {})
+        previous_role = previous_agent_info.get("role", "")
+        previous_description = previous_agent_info.get("description", "")
+
+        # 尝试从.mdc文件加载员工设定
+        if auto_load_from_mdc:
+            config = load_employee_config()
+            if agent_name in config:
+                mdc_content = load_mdc_file(agent_name)
+                if mdc_content:
+                    if not role:
+                        role = extract_role_from_mdc(mdc_content) or previous_role
+                    if not description:
+                        description = (
+                            extract_description_from_mdc(mdc_content)
+                            or previous_description
+                        )
+
+        # 如果没有提供角色，使用之前的角色或要求提供
+        if not role:
+            if previous_role:
+                role = previous_role
+            else:
+                return [
+                    TextContent(
+                        type="text",
+                        text=f"错误: 必须提供角色信息\n提示: 可以使用 set_employee_config 设置员工配置，然后自动从.mdc文件加载",
                     )
+                ]
 
-    # 如果没有提供角色，使用之前的角色或要求提供
-    if not role:
-        if previous_role:
-            role = previous_role
-        else:
-            return [
-                TextContent(
-                    type="text",
-                    text=f"错误: 必须提供角色信息\n提示: 可以使用 set_employee_config 设置员工配置，然后自动从.mdc文件加载",
-                )
-            ]
-
-    # 如果没有提供描述，使用之前的描述
-    if not description:
-        description = previous_description or ""
-
-    # 创建会话
-    session_id = create_session(agent_name, role, description)
-
-    # 注册代理
-    agent_info = {
-        "role": role,
-        "description": description,
-        "session_id": session_id,
-        "registered_at": datetime.now().isoformat(),
-        "previous_registered_at": previous_agent_info.get("registered_at"),
-    }
-    agents[agent_name] = agent_info
-    save_agents(agents)
+        # 如果没有提供描述，使用之前的描述
+        if not description:
+            description = previous_description or ""
+
+        # 创建会话
+        session_id = create_session(agent_name, role, description)
+
+        # 注册代理
+        agent_info = {
+            "role": role,
+            "description": description,
+            "session_id": session_id,
+            "registered_at": datetime.now().isoformat(),
+            "previous_registered_at": previous_agent_info.get("registered_at"),
+        }
+        agents[agent_name] = agent_info
+        save_agents(agents)
 
     # 检查是否有分配给该代理的任务
-    tasks = load_tasks()
-    agent_tasks = [
-        t
-        for t in tasks
-        if t.get("assignee") == agent_name and t.get("status") in ["待开始", "进行中"]
-    ]
+    agent_tasks = query_tasks(assignee=agent_name, statuses=["待开始", "进行中"])
 
     result_lines = [
         f"✅ AI代理已注册并创建会话",
@@ -176,7 +183,8 @@ async def handle_register_agent(arguments: dict[str, Any]) -> list[TextContent]:
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_set_employee_config(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_set_employee_config(arguments: dict[str, Any]) -> list[TextContent]:
     """处理set_employee_config工具"""
     agent_name = arguments.get("agent_name", "")
     mdc_file_path = arguments.get("mdc_file_path", "")
@@ -194,12 +202,13 @@ async def handle_set_employee_config(arguments: dict[str, Any]) -> list[TextCont
         return [TextContent(type="text", text=f"错误: .mdc文件不存在: {mdc_path}")]
 
     # 保存员工配置
-    config = load_employee_config()
-    config[agent_name] = {
-        "mdc_file_path": str(mdc_path.relative_to(WORKSPACE_ROOT)),
-        "updated_at": datetime.now().isoformat(),
-    }
-    save_employee_config(config)
+    with locked("employee_config"):
+        config = load_employee_config()
+        config[agent_name] = {
+            "mdc_file_path": str(mdc_path.relative_to(WORKSPACE_ROOT)),
+            "updated_at": datetime.now().isoformat(),
+        }
+        save_employee_config(config)
 
     return [
         TextContent(
@@ -209,7 +218,8 @@ async def handle_set_employee_config(arguments: dict[str, Any]) -> list[TextCont
     ]
 
 
-async def handle_get_current_session(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_get_current_session(arguments: dict[str, Any]) -> list[TextContent]:
     """处理get_current_session工具"""
     current_agent = get_current_agent()
     session_id = get_current_session_id()
@@ -244,7 +254,8 @@ async def handle_get_current_session(arguments: dict[str, Any]) -> list[TextCont
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_list_agents(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_list_agents(arguments: dict[str, Any]) -> list[TextContent]:
     """处理list_agents工具"""
     agents = load_agents()
 
@@ -264,6 +275,102 @@ async def handle_list_agents(arguments: dict[str, Any]) -> list[TextContent]:
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
+def _find_new_items(agent: str, check_tasks: bool, check_messages: bool) -> tuple:
+    """查询代理待处理的任务和未读消息"""
+    found_tasks = []
+    found_messages = []
+
+    if check_tasks:
+        found_tasks = query_tasks(assignee=agent, statuses=["待开始", "进行中"])
+
+    if check_messages:
+        read_state = load_read_state(agent)
+
+        # 只查询发给当前AI（或所有人）、高于已读水位的消息
+        for msg in query_messages(recipients=[agent, "*"], after_seq=read_state["hwm"]):
+            if is_message_unread(msg, read_state, agent):
+                found_messages.append(msg)
+
+    return found_tasks, found_messages
+
+
+def _begin_standby(
+    current_agent: str,
+    session_id: str,
+    check_tasks: bool,
+    check_messages: bool,
+    auto_read: bool,
+    status_message: str,
+    timeout_seconds: int,
+) -> tuple:
+    """创建或续期代理的待命状态，返回 (待命ID, 开始时间)"""
+    now = datetime.now()
+
+    # 加载待命状态
+    with locked("standby"):
+        standby_states = load_standby()
+
+        # 查找当前代理的活跃待命状态
+        active_standby_id = None
+        active_standby = None
+        for sid, state in standby_states.items():
+            if (
+                state.get("agent") == current_agent
+                and state.get("session_id") == session_id
+                and state.get("active", False)
+            ):
+                started_at_str = state.get("started_at", "")
+                if started_at_str:
+                    try:
+                        started_at = datetime.fromisoformat(started_at_str)
+                        elapsed = (now - started_at).total_seconds()
+                        if elapsed < timeout_seconds:
+                            active_standby_id = sid
+                            active_standby = state
+                            break
+                    except Exception:
+                        pass
+
+        # 如果没有活跃的待命状态，创建新的
+        if not active_standby:
+            standby_id = f"{current_agent}_{session_id}_{now.isoformat()}"
+            active_standby = {
+                "agent": current_agent,
+                "session_id": session_id,
+                "check_tasks": check_tasks,
+                "check_messages": check_messages,
+                "auto_read": auto_read,
+                "status_message": status_message,
+                "started_at": now.isoformat(),
+                "last_check": now.isoformat(),
+                "active": True,
+                "timeout_seconds": timeout_seconds,
+            }
+            standby_states[standby_id] = active_standby
+            active_standby_id = standby_id
+        else:
+            # 更新现有待命状态
+            active_standby["last_check"] = now.isoformat()
+            if status_message:
+                active_standby["status_message"] = status_message
+            standby_states[active_standby_id] = active_standby
+
+        save_standby(standby_states)
+    return active_standby_id, datetime.fromisoformat(active_standby["started_at"])
+
+
+def _record_standby_result(standby_id: str, found_tasks: list, found_messages: list) -> None:
+    """保存本次待命的检查结果"""
+    with locked("standby"):
+        standby_states = load_standby()
+        if standby_id in standby_states:
+            state = standby_states[standby_id]
+            state["last_check"] = datetime.now().isoformat()
+            state["found_tasks"] = len(found_tasks)
+            state["found_messages"] = len(found_messages)
+            save_standby(standby_states)
+
+
 async def handle_standby(arguments: dict[str, Any]) -> list[TextContent]:
     """处理standby工具"""
     # 固定5分钟定时器
@@ -272,99 +379,46 @@ async def handle_standby(arguments: dict[str, Any]) -> list[TextContent]:
     check_messages = arguments.get("check_messages", True)
     auto_read = arguments.get("auto_read", True)
     status_message = arguments.get("status_message", "")
+    wait = arguments.get("wait", True)
 
-    current_agent = get_current_agent()
+    # 存储读写在 I/O 线程池中执行，等待通知期间不占用事件循环和工作线程
+    current_agent = await run_io(get_current_agent)
     session_id = get_current_session_id()
-    now = datetime.now()
+    active_standby_id, started_at = await run_io(
+        _begin_standby,
+        current_agent,
+        session_id,
+        check_tasks,
+        check_messages,
+        auto_read,
+        status_message,
+        STANDBY_TIMEOUT_SECONDS,
+    )
 
-    # 加载待命状态
-    standby_states = load_standby()
-
-    # 查找当前代理的活跃待命状态
-    active_standby_id = None
-    active_standby = None
-    for sid, state in standby_states.items():
-        if (
-            state.get("agent") == current_agent
-            and state.get("session_id") == session_id
-            and state.get("active", False)
-        ):
-            started_at_str = state.get("started_at", "")
-            if started_at_str:
-                try:
-                    started_at = datetime.fromisoformat(started_at_str)
-                    elapsed = (now - started_at).total_seconds()
-                    if elapsed < STANDBY_TIMEOUT_SECONDS:
-                        active_standby_id = sid
-                        active_standby = state
-                        break
-                except Exception:
-                    pass
-
-    # 如果没有活跃的待命状态，创建新的
-    if not active_standby:
-        standby_id = f"{current_agent}_{session_id}_{now.isoformat()}"
-        active_standby = {
-            "agent": current_agent,
-            "session_id": session_id,
-            "check_tasks": check_tasks,
-            "check_messages": check_messages,
-            "auto_read": auto_read,
-            "status_message": status_message,
-            "started_at": now.isoformat(),
-            "last_check": now.isoformat(),
-            "active": True,
-            "timeout_seconds": STANDBY_TIMEOUT_SECONDS,
-        }
-        standby_states[standby_id] = active_standby
-        active_standby_id = standby_id
-    else:
-        # 更新现有待命状态
-        active_standby["last_check"] = now.isoformat()
-        if status_message:
-            active_standby["status_message"] = status_message
-        standby_states[active_standby_id] = active_standby
+    # 阻塞等待直到有新任务/消息或待命超时：写入方提交后会发送变更通知，
+    # 先建立接收端再检查，检查期间到达的写入同样会唤醒等待
+    with ChangeListener() as listener:
+        while True:
+            found_tasks, found_messages = await run_io(
+                _find_new_items, current_agent, check_tasks, check_messages
+            )
+            elapsed_seconds = (datetime.now() - started_at).total_seconds()
+            remaining_seconds = max(0, STANDBY_TIMEOUT_SECONDS - elapsed_seconds)
+            if (
+                found_tasks
+                or found_messages
+                or not wait
+                or not (check_tasks or check_messages)
+                or remaining_seconds <= 0
+            ):
+                break
+            await listener.wait(min(remaining_seconds, STANDBY_RECHECK_SECONDS))
 
-    # 计算剩余时间
-    started_at = datetime.fromisoformat(active_standby["started_at"])
-    elapsed_seconds = (now - started_at).total_seconds()
-    remaining_seconds = max(0, STANDBY_TIMEOUT_SECONDS - elapsed_seconds)
     remaining_minutes = int(remaining_seconds // 60)
     remaining_secs = int(remaining_seconds % 60)
 
-    # 检查任务和消息
-    found_tasks = []
-    found_messages = []
-
-    if check_tasks:
-        tasks = load_tasks()
-        agent_tasks = [
-            t
-            for t in tasks
-            if t.get("assignee") == current_agent
-            and t.get("status") in ["待开始", "进行中"]
-        ]
-        if agent_tasks:
-            found_tasks = agent_tasks
-
-    if check_messages:
-        messages = load_messages()
-        unread_messages = []
-
-        for msg in reversed(messages):
-            # 检查是否是发给当前AI的消息
-            recipients = msg.get("recipients", [])
-            if current_agent in recipients or "*" in recipients:
-                read_status = msg.get("read", {}).get(current_agent, False)
-                if not read_status:
-                    unread_messages.append(msg)
-
-        found_messages = unread_messages
-
     # 保存待命状态
-    active_standby["found_tasks"] = len(found_tasks)
-    active_standby["found_messages"] = len(found_messages)
-    save_standby(standby_states)
+    await run_io(_record_standby_result, active_standby_id, found_tasks, found_messages)
 
     # 如果有新任务/消息，立即返回
     has_new_items = len(found_tasks) > 0 or len(found_messages) > 0
@@ -413,6 +467,117 @@ async def handle_standby(arguments: dict[str, Any]) -> list[TextContent]:
         return [TextContent(type="text", text="\n".join(result_lines))]
 
 
+def _format_bytes(count: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return f"{count:.0f}{unit}" if unit == "B" else f"{count:.1f}{unit}"
+        count /= 1024
+    return f"{count:.1f}GB"
+
+
+@blocking_handler
+def handle_get_server_metrics(arguments: dict[str, Any]) -> list[TextContent]:
+    """处理get_server_metrics工具"""
+    tool_filter = arguments.get("tool")
+    output_format = arguments.get("format", "table")
+    write_textfile = arguments.get("write_textfile", False)
+
+    if output_format not in ("table", "prometheus"):
+        return [TextContent(type="text", text="错误: format 只能是 table 或 prometheus")]
+
+    textfile_line = ""
+    if write_textfile:
+        try:
+            textfile_line = f"\n📄 已写入: {metrics.write_textfile()}"
+        except OSError as e:
+            return [TextContent(type="text", text=f"错误: 写入指标文件失败: {e}")]
+
+    if output_format == "prometheus":
+        return [TextContent(type="text", text=metrics.render_prometheus() + textfile_line)]
+
+    tools = metrics.snapshot()
+    if tool_filter:
+        tools = {name: stats for name, stats in tools.items() if name == tool_filter}
+
+    uptime = int(metrics.uptime_seconds())
+    result_lines = [
+        f"📊 工具调用指标（进程 {os.getpid()}，运行 {uptime // 3600}时{uptime % 3600 // 60}分{uptime % 60}秒）"
+    ]
+    if not tools:
+        result_lines.append("暂无调用记录" if not tool_filter else f"工具 '{tool_filter}' 暂无调用记录")
+        return [TextContent(type="text", text="\n".join(result_lines) + textfile_line)]
+
+    result_lines.append("延迟分位数为直方图分桶上界；读写字节为处理期间 I/O 线程的读写量\n")
+    ordered = sorted(tools.items(), key=lambda item: item[1]["seconds_total"], reverse=True)
+    for name, stats in ordered:
+        calls = stats["calls"]
+        p50 = metrics.quantile(stats, 0.5)
+        p95 = metrics.quantile(stats, 0.95)
+        result_lines.append(f"--- {name} ---")
+        result_lines.append(f"调用: {calls}  错误: {stats['errors']}")
+        result_lines.append(
+            f"延迟: 平均 {stats['seconds_total'] / calls * 1000:.1f}ms  "
+            f"p50≤{p50 * 1000:.1f}ms  p95≤{p95 * 1000:.1f}ms  "
+            f"最大 {stats['seconds_max'] * 1000:.1f}ms  合计 {stats['seconds_total']:.2f}s"
+        )
+        result_lines.append(
+            f"输出: {stats['output_chars']}字符  "
+            f"读: {_format_bytes(stats['bytes_read'])}  写: {_format_bytes(stats['bytes_written'])}"
+        )
+        result_lines.append("")
+
+    return [TextContent(type="text", text="\n".join(result_lines).rstrip() + textfile_line)]
+
+
+def _profiling_status_lines() -> list:
+    current = profiling.settings()
+    if not current["enabled"]:
+        lines = ["剖析: 未开启"]
+    else:
+        remaining = current["remaining"]
+        lines = [
+            "剖析: 已开启",
+            f"剩余份数: {'不限' if remaining is None else remaining}",
+            f"只保存慢于: {current['slower_than_ms']:g}ms" if current["slower_than_ms"] else "只保存慢于: 不限",
+            f"工具: {current['tool'] or '全部'}",
+            f"tracemalloc: {'是' if current['tracemalloc'] else '否'}",
+        ]
+    lines.append(f"目录: {config.PROFILES_DIR}")
+    recent = profiling.recent_profiles()
+    if recent:
+        lines.append(f"\n最近的剖析结果 ({len(recent)}个):")
+        lines.extend(f"  {path.name}" for path in recent)
+    return lines
+
+
+@blocking_handler
+def handle_profile_tool_calls(arguments: dict[str, Any]) -> list[TextContent]:
+    """处理profile_tool_calls工具"""
+    calls = arguments.get("calls")
+    slower_than_ms = arguments.get("slower_than_ms")
+    tool = arguments.get("tool")
+
+    if arguments.get("stop"):
+        profiling.disable()
+        return [TextContent(type="text", text="⏹️ 已停止剖析\n" + "\n".join(_profiling_status_lines()))]
+
+    if calls is None and slower_than_ms is None:
+        return [TextContent(type="text", text="🔬 " + "\n".join(_profiling_status_lines()))]
+
+    if calls is not None and (not isinstance(calls, int) or calls <= 0):
+        return [TextContent(type="text", text="错误: calls 必须是正整数")]
+    if slower_than_ms is not None and (not isinstance(slower_than_ms, (int, float)) or slower_than_ms < 0):
+        return [TextContent(type="text", text="错误: slower_than_ms 必须是非负数")]
+
+    profiling.configure(
+        calls=calls,
+        slower_than_ms=slower_than_ms,
+        tool=tool,
+        with_tracemalloc=bool(arguments.get("tracemalloc", False)),
+    )
+    return [TextContent(type="text", text="✅ 已开启剖析\n" + "\n".join(_profiling_status_lines()))]
+
+
 # 导出所有处理器
 __all__ = [
     "handle_register_agent",
@@ -420,4 +585,6 @@ __all__ = [
     "handle_get_current_session",
     "handle_list_agents",
     "handle_standby",
+    "handle_get_server_metrics",
+    "handle_profile_tool_calls",
 ]
@@ -15,11 +15,22 @@ from mcp.types import TextContent
 from typing import Any
 
 # 导入核心功能
-from ..core.storage import load_tasks, save_tasks, load_messages, save_messages
+from ..core.storage import (
+    query_tasks,
+    get_task,
+    add_task,
+    update_task,
+    delete_task,
+    count_tasks,
+    append_message,
+    locked,
+)
+from ..core.io_executor import blocking_handler
 from ..core.session import get_current_agent, get_current_session_id
 
 
-async def handle_create_task(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_create_task(arguments: dict[str, Any]) -> list[TextContent]:
     """处理create_task工具"""
     title = arguments.get("title", "")
     description = arguments.get("description", "")
@@ -29,27 +40,28 @@ async def handle_create_task(arguments: dict[str, Any]) -> list[TextContent]:
     if not title or not description:
         return [TextContent(type="text", text="错误: 必须提供任务标题和描述")]
 
-    tasks = load_tasks()
-    task_id = f"TASK_{datetime.now().strftime('%Y%m%d%H%M%S')}_{len(tasks)}"
     creator = get_current_agent()
     session_id = get_current_session_id()
 
-    new_task = {
-        "id": task_id,
-        "title": title,
-        "description": description,
-        "priority": priority,
-        "status": "待开始",
-        "creator": creator,
-        "creator_session_id": session_id,
-        "assignee": None,
-        "created_at": datetime.now().isoformat(),
-        "due_date": due_date,
-        "updated_at": datetime.now().isoformat(),
-    }
-
-    tasks.append(new_task)
-    save_tasks(tasks)
+    # 在锁内按任务数生成ID，多个代理进程同时创建任务时不会得到相同的ID
+    with locked("tasks"):
+        task_id = f"TASK_{datetime.now().strftime('%Y%m%d%H%M%S')}_{count_tasks()}"
+
+        new_task = {
+            "id": task_id,
+            "title": title,
+            "description": description,
+            "priority": priority,
+            "status": "待开始",
+            "creator": creator,
+            "creator_session_id": session_id,
+            "assignee": None,
+            "created_at": datetime.now().isoformat(),
+            "due_date": due_date,
+            "updated_at": datetime.now().isoformat(),
+        }
+
+        add_task(new_task)
 
     return [
         TextContent(
@@ -59,7 +71,8 @@ async def handle_create_task(arguments: dict[str, Any]) -> list[TextContent]:
     ]
 
 
-async def handle_assign_task(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_assign_task(arguments: dict[str, Any]) -> list[TextContent]:
     """处理assign_task工具"""
     task_id = arguments.get("task_id", "")
     assignee = arguments.get("assignee", "")
@@ -67,33 +80,23 @@ async def handle_assign_task(arguments: dict[str, Any]) -> list[TextContent]:
     if not task_id or not assignee:
         return [TextContent(type="text", text="错误: 必须提供任务ID和分配对象")]
 
-    tasks = load_tasks()
-    task_found = False
-    assigned_task = None
-
-    for task in tasks:
-        if task["id"] == task_id:
-            task["assignee"] = assignee
-            task["status"] = "待开始"
-            task["updated_at"] = datetime.now().isoformat()
-            task_found = True
-            assigned_task = task
-            break
+    with locked("tasks"):
+        assigned_task = get_task(task_id)
 
-    if not task_found:
-        return [TextContent(type="text", text=f"错误: 找不到任务 {task_id}")]
+        if not assigned_task:
+            return [TextContent(type="text", text=f"错误: 找不到任务 {task_id}")]
 
-    save_tasks(tasks)
+        assigned_task["assignee"] = assignee
+        assigned_task["status"] = "待开始"
+        assigned_task["updated_at"] = datetime.now().isoformat()
+        update_task(assigned_task)
 
     # 发送通知消息
     sender = get_current_agent()
-    messages = load_messages()
-    message_id = f"{datetime.now().isoformat()}_{len(messages)}"
     session_id = get_current_session_id()
 
-    task_title = assigned_task.get("title", "未知任务") if assigned_task else "未知任务"
+    task_title = assigned_task.get("title", "未知任务")
     notification_message = {
-        "id": message_id,
         "sender": sender,
         "sender_role": "任务分配",
         "sender_session_id": session_id,
@@ -101,11 +104,9 @@ async def handle_assign_task(arguments: dict[str, Any]) -> list[TextContent]:
         "content": f"📋 任务分配通知\n任务ID: {task_id}\n任务标题: {task_title}\n分配给你: {assignee}",
         "file_path": None,
         "timestamp": datetime.now().isoformat(),
-        "read": {assignee: False},
     }
 
-    messages.append(notification_message)
-    save_messages(messages)
+    append_message(notification_message)
 
     return [
         TextContent(
@@ -115,7 +116,8 @@ async def handle_assign_task(arguments: dict[str, Any]) -> list[TextContent]:
     ]
 
 
-async def handle_update_task_status(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_update_task_status(arguments: dict[str, Any]) -> list[TextContent]:
     """处理update_task_status工具"""
     task_id = arguments.get("task_id", "")
     status = arguments.get("status", "")
@@ -124,24 +126,18 @@ async def handle_update_task_status(arguments: dict[str, Any]) -> list[TextConte
     if not task_id or not status:
         return [TextContent(type="text", text="错误: 必须提供任务ID和状态")]
 
-    tasks = load_tasks()
-    task_found = False
-    old_status = "未知"
+    with locked("tasks"):
+        task = get_task(task_id)
 
-    for task in tasks:
-        if task["id"] == task_id:
-            old_status = task.get("status", "未知")
-            task["status"] = status
-            task["updated_at"] = datetime.now().isoformat()
-            if progress_note:
-                task["progress_note"] = progress_note
-            task_found = True
-            break
+        if not task:
+            return [TextContent(type="text", text=f"错误: 找不到任务 {task_id}")]
 
-    if not task_found:
-        return [TextContent(type="text", text=f"错误: 找不到任务 {task_id}")]
-
-    save_tasks(tasks)
+        old_status = task.get("status", "未知")
+        task["status"] = status
+        task["updated_at"] = datetime.now().isoformat()
+        if progress_note:
+            task["progress_note"] = progress_note
+        update_task(task)
 
     return [
         TextContent(
@@ -151,37 +147,29 @@ async def handle_update_task_status(arguments: dict[str, Any]) -> list[TextConte
     ]
 
 
-async def handle_get_tasks(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_get_tasks(arguments: dict[str, Any]) -> list[TextContent]:
     """处理get_tasks工具"""
     assignee = arguments.get("assignee", "*")
     status = arguments.get("status")
     priority = arguments.get("priority")
 
     current_agent = get_current_agent()
-    tasks = load_tasks()
 
     # 权限检查：只有manager可以查看所有任务
     if assignee == "*" and current_agent != "manager":
         assignee = current_agent
 
-    # 过滤任务
+    # 过滤任务（负责人、状态条件由存储层完成）
     filtered_tasks = []
-    for task in tasks:
+    for task in query_tasks(
+        assignee=None if assignee == "*" else assignee,
+        statuses=[status] if status else None,
+    ):
         # 排除已删除的任务
         if task.get("status") == "已删除":
             continue
 
-        # 分配者过滤
-        if assignee != "*":
-            task_assignee = task.get("assignee", "")
-            if task_assignee != assignee:
-                continue
-
-        # 状态过滤
-        if status:
-            if task.get("status") != status:
-                continue
-
         # 优先级过滤
         if priority:
             if task.get("priority") != priority:
@@ -228,7 +216,8 @@ async def handle_get_tasks(arguments: dict[str, Any]) -> list[TextContent]:
     return [TextContent(type="text", text="\n".join(result_lines))]
 
 
-async def handle_delete_task(arguments: dict[str, Any]) -> list[TextContent]:
+@blocking_handler
+def handle_delete_task(arguments: dict[str, Any]) -> list[TextContent]:
     """处理delete_task工具"""
     task_ids = arguments.get("task_ids", [])
     permanent = arguments.get("permanent", False)
@@ -237,57 +226,53 @@ async def handle_delete_task(arguments: dict[str, Any]) -> list[TextContent]:
         return [TextContent(type="text", text="错误: 必须提供至少一个任务ID")]
 
     current_agent = get_current_agent()
-    tasks = load_tasks()
     deleted_count = 0
     failed_tasks = []
     deleted_tasks_info = []
 
-    for task_id in task_ids:
-        task_found = False
-        for i, task in enumerate(tasks):
-            if task["id"] == task_id:
-                task_found = True
-                # 权限检查：只有创建者或manager可以删除
-                creator = task.get("creator", "")
-                if current_agent != creator and current_agent != "manager":
-                    failed_tasks.append(
-                        {
-                            "id": task_id,
-                            "reason": f"权限不足（只有创建者 {creator} 或 manager 可以删除）",
-                        }
-                    )
-                    break
-
-                if permanent:
-                    # 硬删除：直接从列表中移除
-                    deleted_tasks_info.append(
-                        {
-                            "id": task_id,
-                            "title": task.get("title", "未知"),
-                            "type": "永久删除",
-                        }
-                    )
-                    tasks.pop(i)
-                else:
-                    # 软删除：标记为已删除
-                    task["status"] = "已删除"
-                    task["deleted_at"] = datetime.now().isoformat()
-                    task["deleted_by"] = current_agent
-                    deleted_tasks_info.append(
-                        {
-                            "id": task_id,
-                            "title": task.get("title", "未知"),
-                            "type": "软删除（标记为已删除）",
-                        }
-                    )
-
-                deleted_count += 1
-                break
-
-        if not task_found:
-            failed_tasks.append({"id": task_id, "reason": "任务不存在"})
-
-    save_tasks(tasks)
+    with locked("tasks"):
+        for task_id in task_ids:
+            task = get_task(task_id)
+            if not task:
+                failed_tasks.append({"id": task_id, "reason": "任务不存在"})
+                continue
+
+            # 权限检查：只有创建者或manager可以删除
+            creator = task.get("creator", "")
+            if current_agent != creator and current_agent != "manager":
+                failed_tasks.append(
+                    {
+                        "id": task_id,
+                        "reason": f"权限不足（只有创建者 {creator} 或 manager 可以删除）",
+                    }
+                )
+                continue
+
+            if permanent:
+                # 硬删除：直接移除
+                deleted_tasks_info.append(
+                    {
+                        "id": task_id,
+                        "title": task.get("title", "未知"),
+                        "type": "永久删除",
+                    }
+                )
+                delete_task(task_id)
+            else:
+                # 软删除：标记为已删除
+                task["status"] = "已删除"
+                task["deleted_at"] = datetime.now().isoformat()
+                task["deleted_by"] = current_agent
+                deleted_tasks_info.append(
+                    {
+                        "id": task_id,
+                        "title": task.get("title", "未知"),
+                        "type": "软删除（标记为已删除）",
+                    }
+                )
+                update_task(task)
+
+            deleted_count += 1
 
     # 构建结果消息
     result_lines = [f"✅ 任务删除操作完成"]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+MCP AI Chat Group - 存储维护命令
+
+用法：
+    python -m mcp_ai_chat.maintenance check-mailboxes     # 检查"接收者 → 消息"索引
+    python -m mcp_ai_chat.maintenance rebuild-mailboxes   # 由消息数据重建该索引
+    python -m mcp_ai_chat.maintenance check-unread-counters    # 从头重算未读计数（含最新消息摘要）并报告偏差
+    python -m mcp_ai_chat.maintenance rebuild-unread-counters  # 用重算结果覆盖未读计数
+    python -m mcp_ai_chat.maintenance rebuild-search-index     # 从头重建全文索引
+    python -m mcp_ai_chat.maintenance compact-messages    # 重写消息存储，并入已修改消息的新版本
+    python -m mcp_ai_chat.maintenance detach-group --group GRP_ID --to DIR  # 把已归档群组的消息分片移出数据目录
+
+存储后端由环境变量 MCP_AI_CHAT_STORAGE_BACKEND 决定（与服务器一致）。
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from .core import storage
+
+
+def _print_report(report: dict) -> int:
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report.get("ok") else 1
+
+
+def cmd_check_mailboxes(args: argparse.Namespace) -> int:
+    """检查收件箱索引，不一致时返回非零退出码"""
+    return _print_report(storage.check_mailboxes())
+
+
+def cmd_rebuild_mailboxes(args: argparse.Namespace) -> int:
+    """重建收件箱索引"""
+    count = storage.rebuild_mailboxes()
+    print(f"✅ 收件箱索引已重建，共 {count} 条消息")
+    return 0
+
+
+def cmd_check_unread_counters(args: argparse.Namespace) -> int:
+    """检查未读计数，有偏差时返回非零退出码"""
+    return _print_report(storage.check_unread_counters())
+
+
+def cmd_rebuild_unread_counters(args: argparse.Namespace) -> int:
+    """重建未读计数"""
+    count = storage.rebuild_unread_counters()
+    print(f"✅ 未读计数已重建，共 {count} 个有未读消息的 (代理, 群组)")
+    return 0
+
+
+def cmd_rebuild_search_index(args: argparse.Namespace) -> int:
+    """重建全文索引"""
+    count = storage.rebuild_search_index()
+    print(f"✅ 全文索引已重建，共 {count} 条消息")
+    return 0
+
+
+def cmd_compact_messages(args: argparse.Namespace) -> int:
+    """压缩消息存储（JSON 后端同时并入各分片的修改记录）"""
+    count = storage.compact_messages()
+    print(f"✅ 消息存储已压缩，共 {count} 条消息")
+    return 0
+
+
+def cmd_detach_group(args: argparse.Namespace) -> int:
+    """把已归档群组的消息分片移到 --to 目录（JSON 后端）"""
+    if not args.group or not args.to:
+        print("错误: detach-group 需要 --group 和 --to")
+        return 2
+    group = storage.load_groups().get(args.group)
+    if group is not None and group.get("status") != "archived":
+        print(f"错误: 群组 {args.group} 尚未归档，请先使用 archive_group 归档")
+        return 1
+    try:
+        count = storage.detach_group_messages(args.group, Path(args.to))
+    except (RuntimeError, FileExistsError) as e:
+        print(f"错误: {e}")
+        return 1
+    print(f"✅ 群组 {args.group} 的 {count} 条消息已移出到 {args.to}")
+    return 0
+
+
+COMMANDS = {
+    "check-mailboxes": cmd_check_mailboxes,
+    "rebuild-mailboxes": cmd_rebuild_mailboxes,
+    "check-unread-counters": cmd_check_unread_counters,
+    "rebuild-unread-counters": cmd_rebuild_unread_counters,
+    "rebuild-search-index": cmd_rebuild_search_index,
+    "compact-messages": cmd_compact_messages,
+    "detach-group": cmd_detach_group,
+}
+
+
+def main(argv=None) -> int:
+    """主入口"""
+    parser = argparse.ArgumentParser(
+        prog="python -m mcp_ai_chat.maintenance", description="MCP AI Chat 存储维护"
+    )
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--group", help="detach-group: 群组ID")
+    parser.add_argument("--to", help="detach-group: 分片移到的目录")
+    args = parser.parse_args(argv)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -50,12 +50,12 @@ async def list_tools():
     列出所有可用工具
 
     使用模块化的工具定义（tools/模块）
-    - message_tools: 7个消息工具
+    - message_tools: 8个消息工具
     - task_tools: 5个任务工具
-    - group_tools: 11个群组工具
-    - system_tools: 5个系统工具
+    - group_tools: 12个群组工具
+    - system_tools: 8个系统工具
 
-    总计：28个工具
+    总计：33个工具
     """
     return get_all_tools()
 
@@ -66,18 +66,32 @@ async def call_tool(name: str, arguments: dict):
     处理工具调用
 
     架构：使用handlers/模块的处理器
-    - message_handler: 7个消息工具
+    - message_handler: 8个消息工具
     - task_handler: 5个任务工具
-    - group_handler: 11个群组工具
-    - system_handler: 5个系统工具
+    - group_handler: 12个群组工具
+    - system_handler: 7个系统工具
+    - handlers: batch 批量调用
 
-    总计：28个工具，100%模块化
+    总计：33个工具，100%模块化
     """
     # 导入处理器路由
     from .handlers import handle_tool_call
-
-    # 调用对应的处理器
-    return await handle_tool_call(name, arguments)
+    from .core import profiling
+    from .core.io_executor import run_io
+
+    # 按需剖析（见 core/profiling），结果保存到 PROFILES_DIR
+    capture = profiling.begin(name)
+    try:
+        # 调用对应的处理器
+        return await handle_tool_call(name, arguments)
+    finally:
+        if capture is not None:
+            profiling.end(capture)
+            if capture.keep:
+                try:
+                    await run_io(capture.save)
+                except OSError:
+                    pass
 
 
 async def main():
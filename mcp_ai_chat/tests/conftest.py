@@ -0,0 +1,42 @@
+"""
+测试公共夹具
+"""
+
+import threading
+from pathlib import Path
+
+import pytest
+
+from mcp_ai_chat import config
+from mcp_ai_chat.core import message_log, metrics, profiling, search_index, sqlite_store, storage
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """把 MESSAGES_DIR 下的所有数据文件重定向到临时目录"""
+    original_dir = config.MESSAGES_DIR
+    for name in dir(config):
+        value = getattr(config, name)
+        if isinstance(value, Path) and (
+            value == original_dir or original_dir in value.parents
+        ):
+            monkeypatch.setattr(
+                config, name, tmp_path / value.relative_to(original_dir)
+            )
+    monkeypatch.setattr(message_log, "_checked_logs", set())
+    monkeypatch.setattr(storage, "_imported_databases", set())
+    monkeypatch.setattr(storage, "_json_cache_local", threading.local())
+    monkeypatch.setattr(storage, "_json_cache_stats", {"hits": 0, "misses": 0})
+    monkeypatch.setattr(storage, "_group_index_local", threading.local())
+    monkeypatch.setattr(metrics, "_tools", {})
+    monkeypatch.setattr(profiling, "_settings", {**profiling._settings, "enabled": False})
+    yield tmp_path
+    sqlite_store.close_connections()
+    search_index.close_connections()
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, data_dir, monkeypatch):
+    """分别在两种存储后端上运行测试"""
+    monkeypatch.setattr(config, "STORAGE_BACKEND", request.param)
+    return request.param
@@ -0,0 +1,71 @@
+"""
+基准测试套件的冒烟测试：在很小的数据集上确认每个工具的场景都能正常运行
+"""
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from mcp_ai_chat import config
+from mcp_ai_chat.benchmarks import __main__ as bench
+from mcp_ai_chat.benchmarks import dataset
+from mcp_ai_chat.benchmarks.scenarios import SCENARIOS
+from mcp_ai_chat.core import session
+from mcp_ai_chat.handlers import TOOL_HANDLERS
+
+
+@pytest.fixture
+def tiny_dataset(backend, monkeypatch):
+    # 场景会切换当前代理，测试结束后恢复
+    monkeypatch.setattr(session, "_current_agent", None)
+    monkeypatch.setattr(session, "_current_session_id", None)
+    monkeypatch.setitem(
+        dataset.SCALES, "tiny", {"messages": 300, "agents": 12, "groups": 4, "tasks": 20}
+    )
+    return dataset.generate_dataset("tiny")
+
+
+def test_every_tool_has_a_scenario():
+    assert set(SCENARIOS) == set(TOOL_HANDLERS)
+
+
+def test_all_scenarios_run_without_errors(tiny_dataset):
+    for tool in SCENARIOS:
+        result = bench.run_tool(tool, tiny_dataset, calls=2, warmup=0)
+        assert result["errors"] == 0, tool
+        assert result["p50_ms"] <= result["p99_ms"]
+
+
+def test_compare_flags_regressions():
+    baseline = {"get_tasks": {"p50_ms": 1.0, "p99_ms": 2.0, "write_bytes_per_call": 0, "errors": 0}}
+    current = {"get_tasks": {"p50_ms": 5.0, "p99_ms": 2.1, "write_bytes_per_call": 0, "errors": 0}}
+
+    assert bench.compare_with_baseline(current, baseline, tolerance=0.5) == [
+        ("get_tasks", "p50_ms", 1.0, 5.0)
+    ]
+    current["get_thread"] = dict(current["get_tasks"])
+    assert bench.tools_without_baseline(current, baseline) == ["get_thread"]
+
+
+def test_load_test_with_two_server_processes(tmp_path, monkeypatch):
+    from mcp_ai_chat.benchmarks import load_test
+
+    # 负载测试结束后会把 config 指向服务器的数据目录，测试结束时恢复
+    monkeypatch.setattr(config, "STORAGE_BACKEND", config.STORAGE_BACKEND)
+    for name in dir(config):
+        if isinstance(getattr(config, name), Path):
+            monkeypatch.setattr(config, name, getattr(config, name))
+
+    report = asyncio.run(
+        load_test.run_load_test(
+            agents=2,
+            duration=1,
+            mix=load_test.parse_mix(load_test.DEFAULT_MIX),
+            backend="json",
+            data_root=tmp_path,
+        )
+    )
+
+    assert report["total_ops"] > 0
+    assert not load_test.report_failed(report)
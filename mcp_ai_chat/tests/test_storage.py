@@ -0,0 +1,1257 @@
+"""
+存储层测试
+"""
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import pstats
+import socket
+import sqlite3
+import time
+
+import pytest
+
+from mcp_ai_chat import config
+from mcp_ai_chat.core import file_lock, notify, search_index, storage
+
+
+def _message(n: int, **extra) -> dict:
+    return {"id": f"m{n}", "sender": "a", "recipients": ["b"], "content": f"消息{n}", **extra}
+
+
+class TestMessageLog:
+    """追加写消息日志"""
+
+    def test_append_writes_one_line_per_message(self, data_dir):
+        for n in range(3):
+            storage.append_message(_message(n))
+
+        lines = config.MESSAGES_LOG_FILE.read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 3
+        assert json.loads(lines[2])["id"] == "m2"
+        assert storage.count_messages() == 3
+        assert [m["id"] for m in storage.load_messages()] == ["m0", "m1", "m2"]
+
+    def test_iter_reversed_uses_offset_index(self, data_dir):
+        for n in range(2500):
+            storage.append_message(_message(n))
+
+        newest = storage.iter_messages_reversed()
+        assert [next(newest)["id"] for _ in range(3)] == ["m2499", "m2498", "m2497"]
+        assert len(list(storage.iter_messages_reversed())) == 2500
+
+    def test_migrates_legacy_messages_json(self, data_dir):
+        legacy = [_message(0), _message(1)]
+        config.MESSAGES_FILE.write_text(json.dumps(legacy), encoding="utf-8")
+
+        assert [m["id"] for m in storage.load_messages()] == ["m0", "m1"]
+        assert not config.MESSAGES_FILE.exists()
+        assert config.MESSAGES_FILE.with_name("messages.json.migrated").exists()
+
+    def test_index_rebuilt_after_torn_write(self, data_dir):
+        storage.append_message(_message(0))
+        with open(config.MESSAGES_LOG_FILE, "ab") as f:
+            f.write(b'{"id": "half')  # 模拟写入中途崩溃
+        storage.append_message(_message(1))
+
+        assert [m["id"] for m in storage.iter_messages_reversed()] == ["m1", "m0"]
+        assert storage.compact_messages() == 2
+        assert storage.count_messages() == 2
+
+    def test_legacy_log_gets_sequence_numbers(self, data_dir):
+        config.MESSAGES_LOG_FILE.write_text(
+            "".join(json.dumps(_message(n)) + "\n" for n in range(3)), encoding="utf-8"
+        )
+
+        assert [m["seq"] for m in storage.load_messages()] == [1, 2, 3]
+        assert storage.append_message(_message(3))["seq"] == 4
+
+    def test_save_messages_rewrites_log(self, data_dir):
+        for n in range(3):
+            storage.append_message(_message(n))
+        messages = storage.load_messages()
+        messages[0]["pinned"] = True
+        storage.save_messages(messages)
+
+        assert storage.load_messages()[0]["pinned"] is True
+        assert next(storage.iter_messages_reversed())["id"] == "m2"
+
+
+class TestMailboxes:
+    """接收者 → 消息索引"""
+
+    def test_query_reads_only_recipient_entries(self, data_dir, monkeypatch):
+        for n in range(50):
+            storage.append_message(_message(n, recipients=["c"]))
+        storage.append_message(_message(50))
+        storage.append_message(_message(51, type="group", group_id="G1"))
+
+        decoded = []
+        decode = storage.message_log._decode_record
+        monkeypatch.setattr(
+            storage.message_log, "_decode_record", lambda line: decoded.append(line) or decode(line)
+        )
+        assert [m["id"] for m in storage.query_messages(recipients=["b"])] == ["m51", "m50"]
+        assert [m["id"] for m in storage.query_messages(recipients=["b"], msg_type="private")] == [
+            "m50"
+        ]
+        assert len(decoded) < 10  # 只读取了最新一条记录（取序列号）和 b 的消息
+
+    def test_check_and_rebuild(self, backend):
+        for n in range(3):
+            storage.append_message(_message(n, recipients=["b", "c"]))
+        assert storage.check_mailboxes()["ok"] is True
+
+        if backend == "json":
+            (config.MAILBOX_DIR / "c.idx").unlink()
+        else:
+            storage.sqlite_store.get_connection().execute(
+                "DELETE FROM message_recipients WHERE recipient = 'c'"
+            )
+        report = storage.check_mailboxes()
+        assert (report["ok"], report["missing"]) == (False, 3)
+
+        assert storage.rebuild_mailboxes() == 3
+        assert storage.check_mailboxes()["ok"] is True
+        assert len(list(storage.query_messages(recipients=["c"]))) == 3
+
+    def test_catches_up_after_interrupted_append(self, data_dir):
+        storage.append_message(_message(0))
+        storage.message_log.mailbox.write_watermark(0)  # 模拟索引写入前崩溃
+        (config.MAILBOX_DIR / "b.idx").write_bytes(b"")
+
+        storage.append_message(_message(1))
+
+        assert [m["id"] for m in storage.query_messages(recipients=["b"])] == ["m1", "m0"]
+        assert storage.check_mailboxes()["ok"] is True
+
+
+
+def _sharded_message(n: int, group_id: str = "G1") -> dict:
+    return {**_message(n, type="group", group_id=group_id, recipients=["a", "b"]), "id": f"g{n}"}
+
+
+class TestGroupShards:
+    """群组消息按群组分片保存"""
+
+    def _fill(self):
+        for n in range(30):
+            storage.append_message(_sharded_message(n, f"G{n % 3}"))
+            storage.append_message(_message(100 + n))
+
+    def test_group_reads_touch_only_their_shard(self, data_dir, monkeypatch):
+        self._fill()
+        assert len(config.MESSAGES_LOG_FILE.read_text(encoding="utf-8").splitlines()) == 30
+        assert (data_dir / "groups" / "G1" / "messages.jsonl").exists()
+
+        decoded = []
+        decode = storage.message_log._decode_record
+        monkeypatch.setattr(
+            storage.message_log, "_decode_record", lambda line: decoded.append(line) or decode(line)
+        )
+        found = [m["id"] for m in storage.query_messages(msg_type="group", group_id="G1")]
+        assert found == [f"g{n}" for n in range(28, 0, -3)]
+        assert all(b'"G1"' in line for line in decoded)
+
+        both = [m["group_id"] for m in storage.query_messages(group_ids=["G0", "G2"])]
+        assert len(both) == 20 and set(both) == {"G0", "G2"}
+        seqs = [m["seq"] for m in storage.query_messages(group_ids=["G0", "G2"], before_seq=30)]
+        assert seqs == sorted(seqs, reverse=True) and seqs[0] < 30
+
+        # 全局读取和按序列号读取经由目录，顺序与写入一致
+        assert [m["seq"] for m in storage.load_messages()] == list(range(1, 61))
+        assert next(storage.iter_messages_reversed())["id"] == "m129"
+
+    def test_legacy_log_is_split(self, data_dir):
+        records = [_message(0), _sharded_message(1), _sharded_message(2, "G2"), _message(3)]
+        config.MESSAGES_LOG_FILE.write_text(
+            "".join(json.dumps(r) + "\n" for r in records), encoding="utf-8"
+        )
+
+        assert [m["id"] for m in storage.load_messages()] == ["m0", "g1", "g2", "m3"]
+        assert len(config.MESSAGES_LOG_FILE.read_text(encoding="utf-8").splitlines()) == 2
+        assert [m["id"] for m in storage.query_messages(group_id="G2")] == ["g2"]
+        assert storage.append_message(_sharded_message(4))["seq"] == 5
+
+    def test_uncommitted_tail_is_dropped(self, data_dir):
+        storage.append_message(_sharded_message(0))
+        shard = data_dir / "groups" / "G1" / "messages.jsonl"
+        with open(shard, "ab") as f:  # 模拟写入分片后、写入目录前崩溃
+            f.write(json.dumps({**_sharded_message(9), "seq": 2}).encode() + b"\n")
+
+        assert [m["id"] for m in storage.query_messages(group_id="G1")] == ["g0"]
+        assert len(shard.read_text(encoding="utf-8").splitlines()) == 1
+        assert storage.append_message(_message(1))["seq"] == 2
+        assert storage.append_message(_sharded_message(2))["seq"] == 3
+        assert [m["id"] for m in storage.query_messages(group_id="G1")] == ["g2", "g0"]
+        assert storage.check_mailboxes()["ok"] is True
+
+    def test_reader_survives_compaction(self, data_dir):
+        self._fill()
+        newest = storage.iter_messages_reversed()
+        seen = [next(newest)["seq"] for _ in range(5)]
+        storage.compact_messages()
+        seen += [m["seq"] for m in newest]
+        assert seen == list(range(60, 0, -1))
+
+    def test_detach_archived_group(self, data_dir, tmp_path_factory):
+        from mcp_ai_chat import maintenance
+
+        self._fill()
+        storage.save_groups({"G1": {"name": "一组", "members": ["b"], "status": "active"}})
+        target = tmp_path_factory.mktemp("archive")
+        assert maintenance.main(["detach-group", "--group", "G1", "--to", str(target)]) == 1
+
+        storage.save_groups({"G1": {"name": "一组", "members": ["b"], "status": "archived"}})
+        assert maintenance.main(["detach-group", "--group", "G1", "--to", str(target)]) == 0
+        assert (target / "G1" / "messages.jsonl").exists()
+        assert not (data_dir / "groups" / "G1").exists()
+
+        assert storage.count_messages() == 50
+        assert list(storage.query_messages(group_id="G1")) == []
+        assert all(m.get("group_id") != "G1" for m in storage.query_messages(recipients=["b"]))
+        assert storage.check_mailboxes()["ok"] is True
+        assert storage.append_message(_sharded_message(99, "G0"))["seq"] == 61
+
+    def test_detach_never_reuses_sequences(self, data_dir, tmp_path_factory):
+        storage.append_message(_message(0))
+        storage.append_message(_sharded_message(1))
+        storage.append_message(_sharded_message(2))
+        storage.mark_messages_read("b", storage.query_messages(recipients=["b"]))
+        assert storage.load_read_state("b")["hwm"] == 3
+
+        assert storage.detach_group_messages("G1", tmp_path_factory.mktemp("archive")) == 2
+        assert storage.last_sequence() == 3
+        fresh = storage.append_message(_message(3))
+        assert fresh["seq"] == 4
+        assert storage.is_message_unread(fresh, storage.load_read_state("b"), "b")
+        assert [m["id"] for m in storage.query_messages(recipients=["b"])] == ["m3", "m0"]
+
+
+class TestMessageUpdates:
+    """按ID查找消息与原地修改"""
+
+    def test_find_uses_id_index(self, data_dir, monkeypatch):
+        monkeypatch.setattr(storage.message_log.message_ids, "MERGE_THRESHOLD", 4)
+        for n in range(10):
+            storage.append_message(_sharded_message(n, f"G{n % 2}"))
+        tail, main = config.MESSAGES_ID_TAIL_FILE, config.MESSAGES_ID_INDEX_FILE
+        assert tail.stat().st_size < main.stat().st_size  # 尾部已并入主体
+
+        monkeypatch.setattr(
+            storage.message_log, "iter_messages_reversed", lambda *a: pytest.fail("扫描了历史")
+        )
+        assert [storage.find_message(f"g{n}")["seq"] for n in range(10)] == list(range(1, 11))
+        assert storage.find_message("g99") is None
+
+        # 索引丢失时重建
+        config.MESSAGES_ID_INDEX_FILE.unlink()
+        storage.message_log._checked_logs.clear()
+        assert storage.find_message("g3")["seq"] == 4
+
+    def test_pin_appends_new_version(self, data_dir, monkeypatch):
+        for n in range(3):
+            storage.append_message(_sharded_message(n))
+        shard = data_dir / "groups" / "G1" / "messages.jsonl"
+        before = shard.read_bytes()
+
+        message = storage.find_message("g1")
+        message["is_pinned"] = True
+        storage.update_messages([message])
+
+        assert shard.read_bytes() == before
+        assert (data_dir / "groups" / "G1" / "messages.patch").exists()
+        assert storage.find_message("g1")["is_pinned"] is True
+        assert [m.get("is_pinned") for m in storage.query_messages(group_id="G1")] == [
+            None, True, None
+        ]
+        assert storage.load_messages()[1]["is_pinned"] is True
+
+        # 压缩时并入日志，修改记录删除
+        storage.compact_messages()
+        assert not (data_dir / "groups" / "G1" / "messages.patch").exists()
+        assert storage.find_message("g1")["is_pinned"] is True
+
+        # 改动接收者的修改整体重写
+        message = storage.find_message("g2")
+        message["recipients"] = ["a"]
+        storage.update_messages([message])
+        assert storage.check_mailboxes()["ok"] is True
+        assert [m["id"] for m in storage.query_messages(recipients=["b"])] == ["g1", "g0"]
+
+
+class TestThreads:
+    """回复索引与 get_thread"""
+
+    def test_replies_and_thread(self, backend, monkeypatch):
+        from mcp_ai_chat.core import session
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"], "creator": "a"}})
+        parents = {1: "g0", 2: "g0", 3: "g1", 4: "g3", 6: "g5"}
+        for n in range(7):
+            extra = {"reply_to": parents[n]} if n in parents else {}
+            storage.append_message({**_sharded_message(n), **extra})
+
+        assert [m["id"] for m in storage.find_replies("g0")] == ["g1", "g2"]
+        assert storage.find_replies("g2") == []
+
+        def call(agent, **arguments):
+            monkeypatch.setattr(session, "_current_agent", agent)
+            return asyncio.run(handle_tool_call("get_thread", arguments))[0].text
+
+        tree = call("b", message_id="g3")
+        assert "5条消息" in tree and "g5" not in tree
+        lines = tree.splitlines()
+        assert [line.split("]")[0].split("[")[-1] for line in lines[3:]] == [
+            "g0", "g1", "g3", "g4", "g2"
+        ]
+        assert "👉 [g3]" in tree
+
+        shallow = call("b", message_id="g4", mode="flat", max_depth=1)
+        assert "3条消息" in shallow and "还有 1 条回复未展开" in shallow
+        assert "找不到消息" in call("c", message_id="g3")  # 非成员看不到
+
+
+class TestReadState:
+    """按代理保存的已读水位"""
+
+    def test_watermark_advances_over_contiguous_reads(self, backend):
+        msgs = [storage.append_message(_message(n)) for n in range(4)]
+        storage.append_message(_message(4, recipients=["c"]))
+
+        storage.mark_messages_read("b", [msgs[1]])
+        state = storage.load_read_state("b")
+        assert (state["hwm"], state["read"]) == (0, {2})
+
+        storage.mark_messages_read("b", [msgs[0]])
+        state = storage.load_read_state("b")
+        assert (state["hwm"], state["read"]) == (2, set())
+
+        storage.mark_messages_read("b", [msgs[3], msgs[2]])
+        assert storage.load_read_state("b") == {"hwm": 4, "read": set()}
+
+    def test_unread_checks(self, backend):
+        own = storage.append_message(_message(0))
+        other = storage.append_message(_message(1, recipients=["c"]))
+        broadcast = storage.append_message(_message(2, recipients=["*"]))
+        legacy = storage.append_message(_message(3, read={"b": True}))
+
+        state = storage.load_read_state("b")
+        assert storage.is_message_unread(own, state, "b")
+        assert not storage.is_message_unread(other, state, "b")
+        assert storage.is_message_unread(broadcast, state, "b")
+        assert not storage.is_message_unread(legacy, state, "b")
+
+        storage.mark_messages_read("b", [own, broadcast])
+        state = storage.load_read_state("b")
+        assert storage.is_message_read(own, state, "b")
+        assert not storage.is_message_unread(broadcast, state, "b")
+
+    def test_marking_read_does_not_rewrite_messages(self, data_dir):
+        msg = storage.append_message(_message(0))
+        log_stat = config.MESSAGES_LOG_FILE.stat()
+
+        storage.mark_messages_read("b", [msg])
+
+        assert config.MESSAGES_LOG_FILE.stat().st_ino == log_stat.st_ino
+        assert "read" not in storage.find_message("m0")
+
+
+def _group_message(n: int, **extra) -> dict:
+    return _message(n, type="group", group_id="G1", recipients=["a", "b"], **extra)
+
+
+class TestUnreadCounters:
+    """按 (代理, 群组) 增量维护的未读计数"""
+
+    def test_counters_follow_send_read_and_membership(self, backend):
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"]}})
+        first = storage.append_message(_group_message(0, mentions=["b"]))
+        storage.append_message(_group_message(1, importance="high"))
+
+        assert storage.load_unread_counts("b") == {
+            "G1": {"unread": 2, "mentions": 1, "important": 1}
+        }
+
+        storage.mark_messages_read("b", [first, first])
+        assert storage.load_unread_counts("b") == {
+            "G1": {"unread": 1, "mentions": 0, "important": 1}
+        }
+
+        storage.save_groups({"G1": {"name": "一组", "members": ["a"]}})
+        storage.refresh_unread_counts("b", "G1")
+        assert storage.load_unread_counts("b") == {}
+
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"]}})
+        storage.refresh_unread_counts("b", "G1")
+        assert storage.load_unread_counts("b")["G1"]["unread"] == 1
+        assert storage.check_unread_counters()["ok"]
+
+    def test_check_reports_drift_and_rebuild_fixes_it(self, backend):
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"]}})
+        storage.append_message(_group_message(0))
+        counters = storage._load_document("unread_counters")
+        storage._save_document(
+            "unread_counters",
+            {**counters, "counts": {"b": {"G1": {"unread": 5, "mentions": 0, "important": 0}}}},
+        )
+
+        report = storage.check_unread_counters()
+        assert not report["ok"]
+        assert report["drift"] == [
+            {
+                "agent": "a",
+                "group_id": "G1",
+                "stored": {"unread": 0, "mentions": 0, "important": 0},
+                "actual": {"unread": 1, "mentions": 0, "important": 0},
+            },
+            {
+                "agent": "b",
+                "group_id": "G1",
+                "stored": {"unread": 5, "mentions": 0, "important": 0},
+                "actual": {"unread": 1, "mentions": 0, "important": 0},
+            },
+        ]
+
+        assert storage.rebuild_unread_counters() == 2
+        assert storage.check_unread_counters()["ok"]
+
+    def test_private_messages_leave_counters_untouched(self, backend, monkeypatch):
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"]}})
+        storage.append_message(_group_message(0))
+        stored = storage._load_document("unread_counters")
+        for n in range(1, 4):
+            storage.append_message(_message(n))
+
+        # 读取时只在内存中跳过之后的私聊消息，不加锁也不写文件
+        with monkeypatch.context() as patched:
+            patched.setattr(storage, "_counters_locked", lambda: pytest.fail("读取时加锁"))
+            patched.setattr(storage, "_save_document", lambda *a: pytest.fail("读取时写入"))
+            assert storage.load_unread_counts("b") == {
+                "G1": {"unread": 1, "mentions": 0, "important": 0}
+            }
+            assert storage.load_last_messages()["G1"]["id"] == "m0"
+        assert storage._load_document("unread_counters") == stored
+
+        storage.append_message(_group_message(4))
+        assert storage.load_unread_counts("b")["G1"]["unread"] == 2
+        assert storage.check_unread_counters()["ok"]
+
+    def test_existing_messages_are_counted_on_first_use(self, data_dir):
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"]}})
+        storage.message_log.append_message(_group_message(0))  # 绕过计数，模拟旧数据
+
+        assert storage.load_unread_counts("b")["G1"]["unread"] == 1
+
+    def test_last_message_summary(self, backend, monkeypatch):
+        from mcp_ai_chat.core import session
+        from mcp_ai_chat.handlers import group_handler, handle_tool_call
+
+        storage.save_groups(
+            {
+                "G1": {"name": "一组", "members": ["a", "b"]},
+                "G2": {"name": "二组", "members": ["a"]},
+            }
+        )
+        storage.append_message(_group_message(0))
+        storage.append_message({**_group_message(1), "content": "长" * 150, "mentions": ["b"]})
+        last = storage.load_last_messages()
+        assert list(last) == ["G1"]
+        assert last["G1"]["id"] == "m1" and last["G1"]["preview"] == "长" * 100
+
+        # 显示预览时不读取消息；之后的私聊消息只在内存中跳过，不加锁改写计数文件
+        storage.append_message(_message(2))
+        query_messages = storage.query_messages
+
+        def no_messages(*args, **kwargs):
+            for _ in query_messages(*args, **kwargs):
+                pytest.fail("读取了消息")
+            return iter(())
+
+        monkeypatch.setattr(session, "_current_agent", "b")
+        with monkeypatch.context() as patched:
+            for module in (storage, group_handler):
+                patched.setattr(module, "query_messages", no_messages)
+            patched.setattr(storage, "_counters_locked", lambda: pytest.fail("读取时加锁"))
+            listed = asyncio.run(handle_tool_call("list_groups", {"include_preview": True}))
+        assert "长" * 100 + "..." in listed[0].text
+        assert "未读: 2条" in listed[0].text and "@我: 1条" in listed[0].text
+
+        # 旧数据没有摘要时补齐
+        counters = storage._load_document("unread_counters")
+        del counters["last"]
+        storage._save_document("unread_counters", counters)
+        assert storage.load_last_messages()["G1"]["seq"] == 2
+        assert storage.check_unread_counters()["ok"]
+
+
+class TestGroupIndex:
+    """代理 → 群组的成员索引"""
+
+    def test_index_follows_membership_changes(self, backend, monkeypatch):
+        from mcp_ai_chat.core import session
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        storage.save_groups(
+            {
+                "G1": {"name": "一组", "members": ["a", "b"], "creator": "a"},
+                "G2": {"name": "二组", "members": ["b"], "creator": "b"},
+                "G3": {"name": "三组", "members": ["a"], "creator": "a"},
+            }
+        )
+        if backend == "json":  # 文件未变化时复用同一个索引
+            index = storage.group_index(storage.load_groups())
+            assert storage.group_index(storage.load_groups()) is index
+        assert storage.groups_of("a") == ["G1", "G3"]
+        assert storage.groups_of("c") == []
+
+        def call(agent, tool, **arguments):
+            monkeypatch.setattr(session, "_current_agent", agent)
+            return asyncio.run(handle_tool_call(tool, arguments))[0].text
+
+        call("c", "join_group", group_id="G2")
+        call("a", "leave_group", group_id="G3")
+        call("b", "archive_group", group_id="G2")
+
+        assert storage.groups_of("a") == ["G1"]
+        assert storage.groups_of("c") == ["G2"]
+        assert storage.groups_of("b", status="active") == ["G1"]
+        assert storage.group_index(storage.load_groups()).is_member("G2", "c")
+
+        listed = call("a", "list_groups", member="c", status="all")
+        assert "G2" in listed and "G1" not in listed
+        assert "G2" not in call("c", "get_unread_counts")  # 已归档的群组不统计
+
+
+class TestChangeNotify:
+    """standby 使用的变更通知"""
+
+    def test_append_wakes_listener(self, data_dir):
+        async def wait_for_append():
+            with notify.ChangeListener() as listener:
+                asyncio.get_running_loop().call_later(
+                    0.05, storage.append_message, _message(0)
+                )
+                return await listener.wait(5)
+
+        started = time.monotonic()
+        assert asyncio.run(wait_for_append()) is True
+        assert time.monotonic() - started < 2
+        assert list(config.NOTIFY_DIR.iterdir()) == []  # 退出后删除套接字
+
+    def test_wait_times_out_without_changes(self, data_dir):
+        async def wait_idle():
+            with notify.ChangeListener() as listener:
+                return await listener.wait(0.05)
+
+        assert asyncio.run(wait_idle()) is False
+
+    def test_stale_socket_is_removed(self, data_dir):
+        config.NOTIFY_DIR.mkdir(parents=True)
+        stale = config.NOTIFY_DIR / "1_1.sock"
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind(str(stale))  # 绑定后关闭：模拟已退出的等待者
+
+        storage.add_task({"id": "T1", "assignee": "b"})
+
+        assert not stale.exists()
+
+
+class TestJsonCache:
+    """load_json 的修改时间缓存"""
+
+    def test_repeated_reads_hit_cache(self, data_dir):
+        config.GROUPS_FILE.write_text(json.dumps({"G1": {"name": "一组"}}), encoding="utf-8")
+
+        first = storage.load_groups()
+        second = storage.load_groups()
+
+        assert second is first
+        stats = storage.get_json_cache_stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_save_updates_cache_in_place(self, data_dir):
+        storage.save_groups({"G1": {"name": "一组"}})
+
+        assert storage.load_groups() == {"G1": {"name": "一组"}}
+        assert storage.get_json_cache_stats()["misses"] == 0
+
+    def test_external_change_invalidates_cache(self, data_dir):
+        storage.save_agents({"a": {"role": "前端"}})
+        config.AGENTS_FILE.write_text(
+            json.dumps({"a": {"role": "前端"}, "b": {"role": "后端"}}), encoding="utf-8"
+        )
+
+        assert list(storage.load_agents()) == ["a", "b"]
+        config.AGENTS_FILE.unlink()
+        assert storage.load_agents() == {}
+
+    def test_unsaved_changes_are_discarded(self, data_dir):
+        from mcp_ai_chat.core.io_executor import run_io
+
+        storage.save_groups({"G1": {"name": "一组"}})
+        storage.save_agents({"a": {"role": "前端"}})
+
+        def edit_and_fail():
+            storage.load_groups()["G1"]["name"] = "未保存"
+            raise RuntimeError("中途失败")
+
+        def edit_and_return_error():
+            storage.load_groups()["G1"]["name"] = "未保存"
+            storage.load_agents()
+            return "错误: 校验失败"
+
+        with pytest.raises(RuntimeError):
+            with storage.batch():
+                edit_and_fail()
+        assert storage.load_groups()["G1"]["name"] == "一组"
+
+        # 没有抛出异常、只是没有写回的修改同样丢弃；只读的文件仍在缓存中
+        assert storage.drop_unsaved_json_changes(edit_and_return_error) == "错误: 校验失败"
+        misses = storage.get_json_cache_stats()["misses"]
+        assert storage.load_agents() == {"a": {"role": "前端"}}
+        assert storage.get_json_cache_stats()["misses"] == misses
+        assert storage.load_groups()["G1"]["name"] == "一组"
+        assert storage.get_json_cache_stats()["misses"] == misses + 1
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(run_io(edit_and_fail))
+        assert asyncio.run(run_io(storage.load_groups))["G1"]["name"] == "一组"
+
+
+def _hammer_store(worker: int, rounds: int) -> None:
+    """模拟一个代理进程：追加消息并对群组做读-改-写"""
+    for n in range(rounds):
+        storage.append_message(_message(worker * 1000 + n))
+        with storage.locked("groups"):
+            groups = storage.load_groups()
+            groups.setdefault("G1", {"members": []})["members"].append(f"{worker}-{n}")
+            storage.save_groups(groups)
+
+
+@pytest.mark.skipif(file_lock.fcntl is None, reason="需要 fcntl")
+class TestConcurrentWrites:
+    """多进程并发写入"""
+
+    def test_parallel_processes_do_not_lose_updates(self, data_dir):
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=_hammer_store, args=(w, 20)) for w in range(4)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+
+        assert all(p.exitcode == 0 for p in workers)
+        assert storage.count_messages() == 80
+        assert len({m["id"] for m in storage.load_messages()}) == 80
+        assert [m["seq"] for m in storage.load_messages()] == list(range(1, 81))
+        assert len(storage.load_groups()["G1"]["members"]) == 80
+
+    def test_atomic_write_keeps_old_file_on_error(self, data_dir):
+        storage.save_agents({"a": {"role": "前端"}})
+
+        with pytest.raises(RuntimeError):
+            with file_lock.atomic_write(config.AGENTS_FILE) as f:
+                f.write(b"{")
+                raise RuntimeError("写入中断")
+
+        assert json.loads(config.AGENTS_FILE.read_text(encoding="utf-8")) == {
+            "a": {"role": "前端"}
+        }
+        assert [p.name for p in data_dir.iterdir() if p.suffix == ".tmp"] == []
+
+
+class TestBackends:
+    """两种存储后端的查询接口"""
+
+    def test_query_messages_by_recipient_and_group(self, backend):
+        storage.append_message(_message(0))
+        storage.append_message(_message(1, recipients=["c"]))
+        storage.append_message(
+            _message(2, type="group", group_id="G1", recipients=["b", "c"])
+        )
+        storage.append_message(_message(3, type="group", group_id="G2"))
+
+        def ids(**kwargs):
+            return [m["id"] for m in storage.query_messages(**kwargs)]
+
+        assert ids(recipients=["b"]) == ["m3", "m2", "m0"]
+        assert ids(recipients=["b"], msg_type="private") == ["m0"]
+        assert ids(recipients=["b", "c"], msg_type="private") == ["m1", "m0"]
+        assert ids(group_id="G1") == ["m2"]
+        assert ids(group_ids=["G1", "G2"]) == ["m3", "m2"]
+        assert ids(group_ids=[]) == []
+
+    def test_find_and_update_message(self, backend):
+        for n in range(3):
+            storage.append_message(_message(n))
+        msg = storage.find_message("m1")
+        msg["is_pinned"] = True
+        storage.update_messages([msg])
+
+        assert storage.find_message("m1")["is_pinned"] is True
+        assert [m["id"] for m in storage.load_messages()] == ["m0", "m1", "m2"]
+        assert storage.find_message("missing") is None
+
+    def test_duplicate_ids_resolve_to_newest(self, backend):
+        # 早期数据中 isoformat()_N 形式的ID可能重复
+        storage.append_message(_message(0, id="dup", content="旧"))
+        storage.append_message(_message(1))
+        storage.append_message(_message(2, id="dup", content="新"))
+
+        msg = storage.find_message("dup")
+        assert (msg["seq"], msg["content"]) == (3, "新")
+        msg["is_pinned"] = True
+        storage.update_messages([msg])
+        assert [(m["content"], m.get("is_pinned")) for m in storage.load_messages()] == [
+            ("旧", None), ("消息1", None), ("新", True)
+        ]
+
+    def test_task_queries(self, backend):
+        storage.add_task({"id": "T1", "assignee": "a", "status": "待开始"})
+        storage.add_task({"id": "T2", "assignee": "b", "status": "进行中"})
+        storage.add_task({"id": "T3", "assignee": "a", "status": "已完成"})
+
+        task = storage.get_task("T3")
+        task["status"] = "进行中"
+        storage.update_task(task)
+        storage.delete_task("T2")
+
+        assert [t["id"] for t in storage.query_tasks(assignee="a")] == ["T1", "T3"]
+        assert [t["id"] for t in storage.query_tasks(statuses=["进行中"])] == ["T3"]
+        assert storage.count_tasks() == 2
+
+    def test_sequence_numbers_and_generated_ids(self, backend):
+        first = storage.append_message({"sender": "a", "recipients": ["b"], "timestamp": "T"})
+        second = storage.append_message(_message(1))
+
+        assert (first["seq"], second["seq"]) == (1, 2)
+        assert first["id"] == "T_1"
+        assert second["id"] == "m1"
+        assert storage.last_sequence() == 2
+        assert storage.find_message("T_1")["seq"] == 1
+
+    def test_query_after_sequence(self, backend):
+        for n in range(5):
+            storage.append_message(_message(n))
+        cursor = storage.last_sequence()
+        storage.append_message(_message(5))
+
+        assert [m["id"] for m in storage.query_messages(after_seq=cursor)] == ["m5"]
+        assert [m["id"] for m in storage.query_messages(recipients=["b"], after_seq=3)] == [
+            "m5",
+            "m4",
+            "m3",
+        ]
+
+    def test_pages_resume_before_cursor(self, backend):
+        for n in range(30):
+            storage.append_message(_message(n, content=f"消息{n} {'even' if n % 2 == 0 else 'odd'}"))
+
+        for query in ({}, {"recipients": ["b"]}, {"keywords": ["even"]}):
+            pages, before_seq = [], None
+            while True:
+                page = list(
+                    itertools.islice(storage.query_messages(before_seq=before_seq, **query), 4)
+                )
+                if not page:
+                    break
+                pages.extend(m["id"] for m in page)
+                before_seq = storage.decode_cursor(storage.encode_cursor(page[-1]["seq"]))
+            assert pages == [m["id"] for m in storage.query_messages(**query)]
+        assert len(pages) == 15
+        assert storage.decode_cursor("not a cursor") is None
+
+    def test_documents_round_trip(self, backend):
+        storage.save_groups({"G1": {"name": "一组"}, "G0": {"name": "零组"}})
+        assert list(storage.load_groups()) == ["G1", "G0"]
+
+
+def test_sqlite_imports_existing_json_data(data_dir, monkeypatch):
+    storage.append_message(_message(0))
+    storage.save_tasks([{"id": "T1", "assignee": "a", "status": "待开始"}])
+    storage.save_agents({"a": {"role": "前端"}})
+
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+    assert [m["id"] for m in storage.load_messages()] == ["m0"]
+    assert storage.get_task("T1")["assignee"] == "a"
+    assert storage.load_agents() == {"a": {"role": "前端"}}
+    assert config.SQLITE_DB_FILE.exists()
+
+
+class TestTimeWindow:
+    """写入时规范化的毫秒时间戳和按时间窗口查询"""
+
+    # 本地时间与 UTC 混用、写入顺序与时间不完全一致
+    _TIMES = [
+        "2025-01-01T00:00:00+00:00",
+        "2025-01-01T00:30:00Z",
+        "2025-01-01T02:00:00+00:00",
+        "2025-01-01T01:00:00+00:00",
+        "2025-01-01T03:00:00Z",
+        "not a time",
+    ]
+
+    def test_since_uses_normalized_timestamps(self, backend):
+        for n, timestamp in enumerate(self._TIMES):
+            stored = storage.append_message(_message(n, timestamp=timestamp))
+            assert stored["timestamp_ms"] == (
+                None if n == 5 else storage.message_time_ms({"timestamp": timestamp})
+            )
+        naive = storage.append_message(_message(6, timestamp="2025-01-01T01:30:00"))
+        since_ms = storage.message_time_ms({"timestamp": "2025-01-01T01:00:00Z"})
+
+        found = [m["id"] for m in storage.query_messages(since_ms=since_ms)]
+        expected = ["m5", "m4", "m3", "m2"]  # 时间无法解析的消息总是返回
+        if naive["timestamp_ms"] >= since_ms:  # 不带时区的时间按本地时间换算
+            expected.insert(0, "m6")
+        assert found == expected
+        assert storage.last_sequence_before(since_ms) == 2
+        assert storage.last_sequence_before(0) == 0
+
+    def test_receive_keeps_unparseable_timestamps(self, backend, monkeypatch):
+        from mcp_ai_chat.core import session
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        storage.append_message(_message(0, timestamp="2025-01-01T00:00:00Z"))
+        storage.append_message(_message(1, timestamp="昨天"))
+        for n in range(2, 5):
+            storage.append_message(_message(n, timestamp=f"2025-01-0{n}T00:00:00Z"))
+
+        monkeypatch.setattr(session, "_current_agent", "b")
+        text = asyncio.run(
+            handle_tool_call(
+                "receive_messages", {"recipient": "b", "since": "2025-01-03T00:00:00Z"}
+            )
+        )[0].text
+        assert [line.split()[2] for line in text.splitlines() if "--- 消息" in line] == [
+            "m4", "m3", "m1"
+        ]
+
+    def test_legacy_log_is_backfilled(self, data_dir):
+        config.MESSAGES_LOG_FILE.write_text(
+            "".join(
+                json.dumps(_message(n, seq=n + 1, timestamp=f"2025-01-01T0{n}:00:00Z")) + "\n"
+                for n in range(4)
+            ),
+            encoding="utf-8",
+        )
+
+        messages = storage.load_messages()
+        assert all(isinstance(m["timestamp_ms"], int) for m in messages)
+        assert config.MESSAGES_TIME_INDEX_FILE.exists()
+        assert storage.last_sequence_before(messages[2]["timestamp_ms"]) == 2
+
+    def test_time_index_rebuilt_when_missing(self, data_dir):
+        for n in range(3):
+            storage.append_message(_message(n, timestamp=f"2025-01-01T0{n}:00:00Z"))
+        config.MESSAGES_TIME_INDEX_FILE.unlink()
+
+        since_ms = storage.message_time_ms({"timestamp": "2025-01-01T01:00:00Z"})
+        assert [m["id"] for m in storage.query_messages(since_ms=since_ms)] == ["m2", "m1"]
+
+    def test_sqlite_schema_is_migrated(self, data_dir, monkeypatch):
+        monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+        config.SQLITE_DB_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with sqlite3.connect(config.SQLITE_DB_FILE) as conn:
+            conn.execute(
+                "CREATE TABLE messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT, "
+                "type TEXT NOT NULL DEFAULT 'private', group_id TEXT, sender TEXT, "
+                "timestamp TEXT, data TEXT NOT NULL)"
+            )
+            conn.execute(
+                "INSERT INTO messages (id, timestamp, data) "
+                """VALUES ('old', '2025-01-01T00:00:00Z', '{"id": "old"}')"""
+            )
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT INTO meta VALUES ('imported', '1')")
+
+        since_ms = storage.message_time_ms({"timestamp": "2024-12-31T23:00:00Z"})
+        assert [m["id"] for m in storage.query_messages(since_ms=since_ms)] == ["old"]
+        assert list(storage.query_messages(since_ms=since_ms + 7200_000)) == []
+
+    def test_group_stats_merge_rollups(self, backend):
+        from mcp_ai_chat.core import message_rollups
+
+        def send(n):
+            return storage.append_message(
+                _group_message(
+                    n,
+                    sender="abc"[n % 3],
+                    topic="发布" if n % 4 == 0 else None,
+                    importance="high" if n % 5 == 0 else "normal",
+                    mentions=["b"] if n % 2 else [],
+                    timestamp=f"2025-01-{1 + n // 8:02d}T{n * 7 % 24:02d}:{n % 60:02d}:00Z",
+                )
+            )
+
+        sent = [send(n) for n in range(40)]
+
+        def expected(since_ms):
+            stats = message_rollups.empty_stats()
+            for m in sent:
+                if m["timestamp_ms"] >= since_ms:
+                    message_rollups.add_message(stats, m)
+            return stats
+
+        day = storage.message_time_ms({"timestamp": "2025-01-03T00:00:00Z"})
+        for since_ms in (0, day, day + 5 * 3600_000 + 1, day + 30 * 3600_000):
+            assert storage.group_message_stats("G1", since_ms) == expected(since_ms)
+        rollup = storage._load_rollup("G1")
+        assert rollup["hours"] == {} and len(rollup["days"]) == 5  # 旧消息按天汇总
+
+        sent.append(send(40))  # 之后的消息在下次查询时补计
+        assert storage.group_message_stats("G1", day) == expected(day)
+        assert storage.group_message_stats("G2", 0)["count"] == 0
+
+    def test_rollup_catch_up_ignores_concurrent_appends(self, backend, monkeypatch):
+        timestamp = "2025-01-01T00:00:00Z"
+        storage.append_message(_group_message(0, timestamp=timestamp))
+        query = storage.query_messages
+
+        def query_after_append(*args, **kwargs):
+            monkeypatch.setattr(storage, "query_messages", query)
+            storage.append_message(_group_message(1, timestamp=timestamp))  # 读取 last 之后追加
+            return query(*args, **kwargs)
+
+        monkeypatch.setattr(storage, "query_messages", query_after_append)
+        storage.group_message_stats("G1", 0)
+        assert storage.group_message_stats("G1", 0)["count"] == 2
+
+
+class TestSearchIndex:
+    """关键词查询使用的全文索引"""
+
+    def test_tokenize_cjk_bigrams_and_words(self):
+        assert search_index.tokenize("性能测试 API_v2 的") == ["性能", "能测", "测试", "api_v2"]
+        assert search_index.keyword_terms("测试用例") == [
+            ("测试", "exact"), ("试用", "exact"), ("用例", "exact")
+        ]
+        assert search_index.keyword_terms("Deploy to prod") == [
+            ("deploy", "suffix"), ("to", "exact"), ("prod", "prefix")
+        ]
+        assert search_index.keyword_terms("api") == [("api", "infix")]
+        assert search_index.keyword_terms("测") is None
+
+    def test_keyword_query_uses_index(self, backend):
+        storage.append_message(_message(0, content="数据库性能测试报告"))
+        storage.append_message(_message(1, content="性能 review"))
+        storage.append_message(_message(2, content="测试性能"))
+
+        def ids(*keywords):
+            return [m["id"] for m in storage.query_messages(keywords=list(keywords))]
+
+        assert ids("性能测试") == ["m0"]
+        assert ids("REVIEW", "数据库") == ["m1", "m0"]
+        assert ids("性") == ["m2", "m1", "m0"]  # 单字无法用索引，改为扫描
+        assert search_index.indexed_sequence() == 3
+
+        storage.append_message(_message(3, content="新的性能测试"))
+        assert ids("性能测试") == ["m3", "m0"]
+        assert [m["id"] for m in storage.query_messages(keywords=["测试"], after_seq=3)] == ["m3"]
+
+    def test_partial_words_match_like_a_scan(self, backend, monkeypatch):
+        contents = [
+            "deployment done", "redeploy now", "please deploy", "API_v2 ready",
+            "c++ build", "部署deploy成功", "deploys to prod", "无关",
+        ]
+        for n, content in enumerate(contents):
+            storage.append_message(_message(n, content=content))
+        keywords = [
+            "deploy", "PLOY", "deploy ", " deploy", "api_", "v2 re", "c++", "s to pro", "部署deplo",
+        ]
+        expected = {
+            kw: [f"m{n}" for n in reversed(range(len(contents))) if kw.lower() in contents[n].lower()]
+            for kw in keywords
+        }
+
+        matching_seqs = search_index.iter_matching_seqs
+        monkeypatch.setattr(
+            search_index,
+            "iter_matching_seqs",
+            lambda *a: matching_seqs(*a) or pytest.fail("改为扫描"),
+        )
+        for kw in keywords:
+            assert [m["id"] for m in storage.query_messages(keywords=[kw])] == expected[kw], kw
+        assert expected["deploy"] == ["m6", "m5", "m2", "m1", "m0"]
+
+        # 展开过多时改为扫描，结果不变
+        monkeypatch.setattr(search_index, "MAX_EXPANDED_TERMS", 1)
+        monkeypatch.setattr(search_index, "iter_matching_seqs", matching_seqs)
+        assert [m["id"] for m in storage.query_messages(keywords=["deploy"])] == expected["deploy"]
+
+    def test_index_follows_replaced_messages(self, backend):
+        storage.append_message(_message(0, content="旧的消息"))
+        assert [m["id"] for m in storage.query_messages(keywords=["旧的"])] == ["m0"]
+
+        storage.save_messages([_message(5, content="新的消息")])
+
+        assert list(storage.query_messages(keywords=["旧的"])) == []
+        assert [m["id"] for m in storage.query_messages(keywords=["新的"])] == ["m5"]
+
+
+    def test_bm25_search_with_filters(self, backend):
+        storage.save_groups({"G1": {"members": ["a", "b"]}, "G2": {"members": ["c"]}})
+        group = {"type": "group", "recipients": ["a", "b"]}
+        storage.append_message(
+            _message(0, content="缓存命中率下降，缓存需要预热", group_id="G1",
+                     timestamp="2025-01-01T10:00:00", **group)
+        )
+        storage.append_message(
+            _message(1, sender="b", content="今天讨论了一下缓存和数据库的很多其他细节问题",
+                     group_id="G1", timestamp="2025-01-02T10:00:00", **group)
+        )
+        storage.append_message(
+            _message(2, sender="c", content="缓存", type="group", group_id="G2",
+                     recipients=["c"], timestamp="2025-01-03T10:00:00")
+        )
+        storage.append_message(
+            _message(3, content="部署 cache 缓存", topic="发布", timestamp="2025-01-04T10:00:00")
+        )
+
+        def ids(query, **filters):
+            return [m["id"] for m, _ in storage.search_messages(query, **filters)]
+
+        assert ids("缓存", visible_to="a") == ["m0", "m3", "m1"]
+        assert ids("缓存", visible_to="c") == ["m2"]
+        assert ids("缓存", group_id="G1", sender="b") == ["m1"]
+        assert ids("缓存", since="2025-01-02T00:00:00", until="2025-01-04T00:00:00") == ["m2", "m1"]
+        assert ids("发布") == ["m3"]  # 话题也参与检索
+        assert ids("性") == []
+
+        assert search_index.snippet("前言" * 50 + "缓存预热", "缓存", 20).startswith("…")
+
+
+class TestIoExecutor:
+    """阻塞的存储操作在 I/O 线程池中执行"""
+
+    def test_concurrent_tool_calls_overlap(self, data_dir, monkeypatch):
+        from mcp_ai_chat.core import session
+        from mcp_ai_chat.handlers import handle_tool_call, task_handler
+
+        def slow_query_tasks(**kwargs):
+            time.sleep(0.3)
+            return []
+
+        monkeypatch.setattr(task_handler, "query_tasks", slow_query_tasks)
+        monkeypatch.setattr(session, "_current_agent", "a")
+
+        async def run_concurrently():
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *(handle_tool_call("get_tasks", {}) for _ in range(3))
+            )
+            return results, time.perf_counter() - started
+
+        results, elapsed = asyncio.run(run_concurrently())
+
+        assert len(results) == 3
+        assert elapsed < 0.6  # 串行执行需要 0.9 秒
+
+    def test_cache_is_per_thread(self, data_dir):
+        from concurrent.futures import ThreadPoolExecutor
+
+        storage.save_groups({"G1": {"name": "一组"}})
+        groups = storage.load_groups()
+        groups["G1"]["name"] = "未提交的修改"
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            other = pool.submit(storage.load_groups).result()
+
+        assert other == {"G1": {"name": "一组"}}
+
+
+class TestBatch:
+    """batch 工具：共享快照，结束时一起提交"""
+
+    def test_writes_are_committed_together(self, backend):
+        from concurrent.futures import ThreadPoolExecutor
+
+        storage.save_groups({"G1": {"name": "一组"}})
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            with storage.batch():
+                storage.save_groups({"G1": {"name": "改名"}})
+                assert storage.load_groups() == {"G1": {"name": "改名"}}
+                # 其他线程看不到中间状态：JSON 后端等批量结束，SQLite 读到批量前的快照
+                pending = pool.submit(storage.load_groups)
+                time.sleep(0.1)
+                if backend == "json":
+                    assert not pending.done()
+                else:
+                    assert pending.result() == {"G1": {"name": "一组"}}
+            assert pool.submit(storage.load_groups).result() == {"G1": {"name": "改名"}}
+
+    def test_error_discards_pending_writes(self, backend):
+        storage.save_agents({"a": {"role": "前端"}})
+        with pytest.raises(RuntimeError):
+            with storage.batch():
+                storage.save_agents({})
+                raise RuntimeError("中断")
+        assert storage.load_agents() == {"a": {"role": "前端"}}
+
+    def test_batch_tool_runs_calls_in_order(self, backend, monkeypatch):
+        from mcp_ai_chat.core import session
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        monkeypatch.setattr(session, "_current_agent", "a")
+        results = asyncio.run(
+            handle_tool_call(
+                "batch",
+                {
+                    "calls": [
+                        {"tool": "send_message", "arguments": {"recipients": "b", "message": "hi"}},
+                        {"tool": "receive_messages", "arguments": {"recipient": "b"}},
+                        {"tool": "no_such_tool"},
+                    ]
+                },
+            )
+        )
+        assert "未知工具" in results[0].text
+        assert storage.count_messages() == 0
+
+        results = asyncio.run(
+            handle_tool_call(
+                "batch",
+                {
+                    "calls": [
+                        {"tool": "send_message", "arguments": {"recipients": "b", "message": "hi"}},
+                        {"tool": "receive_messages", "arguments": {"recipient": "b"}},
+                    ]
+                },
+            )
+        )
+        assert results[0].text.startswith("[1/2] send_message")
+        assert "找到 1 条" in results[1].text
+        assert storage.count_messages() == 1
+
+
+    def test_failed_call_is_rolled_back(self, backend, monkeypatch):
+        from types import SimpleNamespace
+
+        from mcp_ai_chat import handlers
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        storage.save_groups({"G1": {"name": "一组", "members": ["a", "b"]}})
+        storage.save_agents({"a": {"role": "前端"}})
+
+        def rename(arguments):
+            groups = storage.load_groups()
+            groups["G1"]["name"] = "改名"
+            storage.save_groups(groups)
+            return [handlers.TextContent(type="text", text="ok")]
+
+        def clear_and_fail(arguments):
+            groups = storage.load_groups()
+            groups["G1"]["members"].clear()
+            storage.save_groups(groups)
+            agents = storage.load_agents()
+            agents.clear()
+            storage.save_agents(agents)
+            raise RuntimeError("中途失败")
+
+        monkeypatch.setitem(
+            handlers.TOOL_HANDLERS, "join_group", SimpleNamespace(__wrapped__=rename)
+        )
+        monkeypatch.setitem(
+            handlers.TOOL_HANDLERS, "leave_group", SimpleNamespace(__wrapped__=clear_and_fail)
+        )
+        results = asyncio.run(
+            handle_tool_call(
+                "batch",
+                {"calls": [{"tool": tool} for tool in ("join_group", "leave_group", "join_group")]},
+            )
+        )
+        assert "中途失败" in results[1].text and "已跳过后续 1 个调用" in results[2].text
+        # 失败的调用的修改全部撤销，之前调用的修改照常提交
+        assert storage.load_groups() == {"G1": {"name": "改名", "members": ["a", "b"]}}
+        assert storage.load_agents() == {"a": {"role": "前端"}}
+
+
+class TestMetrics:
+    """工具调用指标：次数、错误、延迟直方图和 Prometheus 文本输出"""
+
+    def test_tool_calls_are_counted(self, data_dir, monkeypatch):
+        from mcp_ai_chat.core import metrics, session
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        monkeypatch.setattr(session, "_current_agent", "a")
+        for _ in range(3):
+            asyncio.run(handle_tool_call("send_message", {"recipients": "b", "message": "hi"}))
+        asyncio.run(handle_tool_call("send_message", {"recipients": "", "message": "hi"}))
+        asyncio.run(handle_tool_call("no_such_tool", {}))
+
+        stats = metrics.snapshot()
+        assert set(stats) == {"send_message"}
+        sent = stats["send_message"]
+        assert sent["calls"] == 4
+        assert sent["errors"] == 1
+        assert sum(sent["buckets"]) == 4
+        assert sent["output_chars"] > 0
+        assert metrics.quantile(sent, 0.5) in metrics.LATENCY_BUCKETS + (sent["seconds_max"],)
+        if metrics._thread_io() is not None:
+            assert sent["bytes_written"] > 0
+
+        text = asyncio.run(handle_tool_call("get_server_metrics", {}))[0].text
+        assert "--- send_message ---" in text
+        assert "调用: 4  错误: 1" in text
+
+    def test_prometheus_textfile(self, data_dir, monkeypatch):
+        from mcp_ai_chat.core import metrics, session
+        from mcp_ai_chat.handlers import handle_tool_call
+
+        monkeypatch.setattr(session, "_current_agent", "a")
+        asyncio.run(handle_tool_call("list_agents", {}))
+        text = asyncio.run(
+            handle_tool_call("get_server_metrics", {"format": "prometheus", "write_textfile": True})
+        )[0].text
+        assert 'mcp_ai_chat_tool_calls_total{pid="' in text
+        assert 'tool="list_agents"} 1' in text
+        assert 'tool="list_agents",le="+Inf"} 1' in text
+
+        path = metrics.textfile_path()
+        assert path.parent == data_dir / "metrics"
+        assert "# TYPE mcp_ai_chat_tool_latency_seconds histogram" in path.read_text(encoding="utf-8")
+
+
+class TestProfiling:
+    """按需剖析：限定份数 / 慢调用阈值，结果保存到 profiles/"""
+
+    def _call(self, name: str, arguments: dict):
+        from mcp_ai_chat.server_modular import call_tool
+
+        return asyncio.run(call_tool(name, arguments))
+
+    def test_profiles_next_calls(self, data_dir, monkeypatch):
+        from mcp_ai_chat.core import profiling, session
+
+        monkeypatch.setattr(session, "_current_agent", "a")
+        text = self._call("profile_tool_calls", {"calls": 2, "tool": "send_message", "tracemalloc": True})[0].text
+        assert "剩余份数: 2" in text
+
+        self._call("list_agents", {})
+        for _ in range(3):
+            self._call("send_message", {"recipients": "b", "message": "hi"})
+
+        profiles = profiling.recent_profiles()
+        assert len(profiles) == 2
+        assert all("_send_message_" in path.name for path in profiles)
+        assert profiles[0].parent == data_dir / "profiles"
+        assert profiles[0].with_suffix(".alloc.txt").exists()
+        stats = pstats.Stats(str(profiles[0]))
+        # 处理器在 I/O 线程中执行的代码也被采集到
+        assert any(func[2] == "handle_send_message" for func in stats.stats)
+        assert not profiling.settings()["enabled"]
+
+    def test_slower_than_threshold(self, data_dir):
+        from mcp_ai_chat.core import profiling
+
+        self._call("profile_tool_calls", {"slower_than_ms": 60_000})
+        self._call("list_agents", {})
+        assert profiling.recent_profiles() == []
+        assert profiling.settings()["enabled"]
+
+        self._call("profile_tool_calls", {"stop": True})
+        assert not profiling.settings()["enabled"]
@@ -81,10 +81,14 @@ def get_group_tools():
                         "type": "string",
                         "description": "时间过滤：只返回此时间之后的消息（ISO格式）",
                     },
+                    "cursor": {
+                        "type": "string",
+                        "description": "分页游标：传入上一页返回的 cursor，从上一页最旧的消息之后继续读取（其他参数应与上一页相同）",
+                    },
                     "keywords": {
                         "type": "array",
                         "items": {"type": "string"},
-                        "description": "关键词过滤：只返回包含这些关键词的消息",
+                        "description": "关键词过滤：只返回包含这些关键词的消息（任一关键词匹配即可）",
                     },
                     "topic": {
                         "type": "string",
@@ -227,4 +231,29 @@ def get_group_tools():
                 "required": ["group_id", "message_id"],
             },
         ),
+        Tool(
+            name="get_thread",
+            description="查看消息所在的会话串：沿回复关系找到起始消息，返回整棵回复树",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "message_id": {"type": "string", "description": "会话串中任意一条消息的ID"},
+                    "mode": {
+                        "type": "string",
+                        "enum": ["tree", "flat"],
+                        "description": "tree: 按回复关系缩进显示；flat: 按发送顺序平铺（默认 tree）",
+                    },
+                    "max_depth": {
+                        "type": "integer",
+                        "description": "最多展开的回复层数（可选，默认不限）",
+                    },
+                    "max_content_length": {
+                        "type": "integer",
+                        "description": "每条消息内容的最大显示长度（默认200）",
+                        "default": 200,
+                    },
+                },
+                "required": ["message_id"],
+            },
+        ),
     ]
@@ -55,6 +55,10 @@ def get_message_tools():
                         "type": "string",
                         "description": "时间过滤：只返回此时间之后的消息（ISO格式，例如：2025-11-10T00:00:00）",
                     },
+                    "cursor": {
+                        "type": "string",
+                        "description": "分页游标：传入上一页返回的 cursor，从上一页最旧的消息之后继续读取（其他参数应与上一页相同）",
+                    },
                     "keywords": {
                         "type": "array",
                         "items": {"type": "string"},
@@ -171,4 +175,44 @@ def get_message_tools():
                 "required": ["recipients", "file_path", "description"],
             },
         ),
+        Tool(
+            name="search_messages",
+            description="全文检索私聊和群组历史消息，按相关度（BM25）排序，返回最相关的若干条及内容摘要。适合查找以前的讨论；只检索你能看到的消息",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "查询内容（匹配消息内容、话题和发送者；中文至少两个字，英文按完整单词匹配）",
+                    },
+                    "group_id": {
+                        "type": "string",
+                        "description": "只检索该群组的消息（可选）",
+                    },
+                    "sender": {
+                        "type": "string",
+                        "description": "只检索该发送者的消息（可选）",
+                    },
+                    "since": {
+                        "type": "string",
+                        "description": "只检索此时间及之后的消息（ISO格式，例如：2025-11-10T00:00:00）",
+                    },
+                    "until": {
+                        "type": "string",
+                        "description": "只检索此时间之前的消息（ISO格式）",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "返回结果数量（默认：10，最多50）",
+                        "default": 10,
+                    },
+                    "snippet_length": {
+                        "type": "integer",
+                        "description": "每条结果的摘要长度（默认：120字符）",
+                        "default": 120,
+                    },
+                },
+                "required": ["query"],
+            },
+        ),
     ]
@@ -66,7 +66,7 @@ def get_system_tools():
         ),
         Tool(
             name="standby",
-            description="进入待命状态，定时器强制为5分钟。在5分钟内持续监听任务和消息，如果收到新任务/消息立即返回继续工作，如果5分钟内没有新任务/消息则继续等待。建议在回复末尾调用此工具",
+            description="进入待命状态，定时器强制为5分钟。调用会阻塞等待，收到新任务/消息时立即返回继续工作，5分钟内没有新任务/消息则在待命结束时返回。建议在回复末尾调用此工具",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -89,6 +89,90 @@ def get_system_tools():
                         "description": "是否自动读取新任务/消息内容，默认：true",
                         "default": True,
                     },
+                    "wait": {
+                        "type": "boolean",
+                        "description": "是否阻塞等待新任务/消息（false时只检查一次立即返回），默认：true",
+                        "default": True,
+                    },
+                },
+            },
+        ),
+        Tool(
+            name="batch",
+            description="在一次调用中按顺序执行多个工具（最多20个，不能包含standby和batch），减少往返次数。所有调用读取同一份一致的数据，写入在全部调用结束后一起提交；某个调用出错时撤销它的修改并跳过后续调用，之前的调用照常提交",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "calls": {
+                        "type": "array",
+                        "description": "要执行的工具调用列表，按顺序执行",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "tool": {
+                                    "type": "string",
+                                    "description": "工具名称（例如: receive_messages）",
+                                },
+                                "arguments": {
+                                    "type": "object",
+                                    "description": "该工具的参数",
+                                },
+                            },
+                            "required": ["tool"],
+                        },
+                    },
+                },
+                "required": ["calls"],
+            },
+        ),
+        Tool(
+            name="get_server_metrics",
+            description="查看本服务器进程的工具调用指标：每个工具的调用次数、错误次数、延迟分布、输出字符数和读写字节数",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tool": {
+                        "type": "string",
+                        "description": "只看指定工具（可选）",
+                    },
+                    "format": {
+                        "type": "string",
+                        "enum": ["table", "prometheus"],
+                        "description": "输出格式：table（默认，可读表格）或 prometheus（Prometheus 文本格式）",
+                    },
+                    "write_textfile": {
+                        "type": "boolean",
+                        "description": "同时把指标写入数据目录下的 metrics/ 文本文件（默认: false）",
+                    },
+                },
+            },
+        ),
+        Tool(
+            name="profile_tool_calls",
+            description="按需剖析之后的工具调用：采集 cProfile 统计（可选 tracemalloc 内存分配），保存到数据目录下的 profiles/。不带参数时查看当前状态和最近的剖析结果。注意：tracemalloc 和 Python 3.12+ 上的 cProfile 是进程级的，剖析期间并发执行的其他调用也会计入结果",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "calls": {
+                        "type": "integer",
+                        "description": "最多保存多少份剖析结果，保存完自动关闭（可选，默认不限）",
+                    },
+                    "slower_than_ms": {
+                        "type": "number",
+                        "description": "只保存耗时超过该毫秒数的调用（可选）",
+                    },
+                    "tool": {
+                        "type": "string",
+                        "description": "只剖析指定工具（可选，默认全部）",
+                    },
+                    "tracemalloc": {
+                        "type": "boolean",
+                        "description": "同时记录分配内存最多的代码行（默认: false，开启后调用会明显变慢）",
+                    },
+                    "stop": {
+                        "type": "boolean",
+                        "description": "停止剖析",
+                    },
                 },
             },
         ),
@@ -49,6 +49,27 @@ def parse_iso_time(time_str: str) -> Optional[datetime]:
         return None
 
 
+def to_epoch_ms(timestamp: Optional[str]) -> Optional[int]:
+    """
+    ISO格式时间戳转为整数毫秒（Unix 时间）
+
+    带时区的按其时区换算，不带时区的按本地时间，统一后可以直接比较大小。
+
+    Args:
+        timestamp: ISO格式时间字符串
+
+    Returns:
+        毫秒时间戳，无法解析时返回None
+    """
+    if not isinstance(timestamp, str) or not timestamp:
+        return None
+    try:
+        moment = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return round(moment.timestamp() * 1000)
+
+
 def format_timestamp(dt: datetime) -> str:
     """
     格式化datetime为标准字符串